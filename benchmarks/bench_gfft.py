@@ -0,0 +1,327 @@
+"""
+bench_gfft.py
+
+Benchmarks for GFFT. Each case transforms synthetic data with a GFFTPlan in
+one of the four modes (regular/irregular to regular/irregular), for a given
+number of dimensions, number of irregularly spaced samples, grid size and
+gridding parameters (W, alpha), and records
+
+    - the time to create the plan,
+    - the wall time of plan.execute (the best of several repeats),
+    - the time spent in each stage (as reported by the stats argument of
+      execute) for the best repeat,
+    - the peak memory allocated by numpy during one execute call (measured
+      with tracemalloc, separately from the timings).
+
+Everything runs offline on synthetic data. Run from a directory where the
+gfft package can be imported, e.g.
+
+    python benchmarks/bench_gfft.py                  # quick sweep
+    python benchmarks/bench_gfft.py --full           # nvis up to 1e7
+    python benchmarks/bench_gfft.py --modes IR --dims 2 --nvis 1e5 1e6 \\
+        --W 4 6 8 --alpha 1.25 1.5 2
+
+Results are printed as a table and can be saved with --save results.json.
+--compare baseline.json prints the ratio of each timing to that of the
+same case in a saved baseline and flags the cases slower than --threshold,
+e.g. to compare two versions of gridding.pyx:
+
+    git checkout master     # build, then
+    python benchmarks/bench_gfft.py --save base.json
+    git checkout mybranch   # build, then
+    python benchmarks/bench_gfft.py --compare base.json
+"""
+
+"""
+Copyright 2012 Michael Bell, Henrik Junklewitz
+
+This file is part of GFFT.
+
+GFFT is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+GFFT is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with GFFT.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+import time
+import json
+import argparse
+import platform
+import itertools
+import tracemalloc
+
+import numpy as np
+
+from gfft import gfft as G
+
+################################################################################
+# Sweep definitions
+
+MODES = ['RR', 'IR', 'RI', 'II']
+
+# default image size along each axis for each number of dimensions
+SIZES = {1:4096, 2:256, 3:64}
+
+QUICK_NVIS = [10**3, 10**5]
+FULL_NVIS = [10**3, 10**4, 10**5, 10**6, 10**7]
+
+# the grids with these many cells or more are skipped, and so are the sample
+# arrays with more than MAX_VIS_BYTES bytes of data and kernels
+MAX_GRID_CELLS = 2**28
+MAX_VIS_BYTES = 2**32
+
+################################################################################
+# Synthetic data
+
+def random_samples(rng, N, nvis, n, dx, fill=0.9):
+    """
+    nvis uniformly distributed sample coordinates in the Fourier space of an
+    image with n pixels of size dx along each of N axes, covering the fraction
+    fill of the band along each axis.
+    """
+    umax = 0.5*fill/dx
+    return [rng.uniform(-umax, umax, nvis) for i in range(N)]
+
+def clustered_samples(rng, N, nvis, n, dx, fill=0.9):
+    """
+    As random_samples, but concentrated towards u = 0 as in the sampling of a
+    radio interferometer (Gaussian, clipped to the band).
+    """
+    umax = 0.5*fill/dx
+    return [np.clip(rng.normal(0., umax/3., nvis), -umax, umax) \
+        for i in range(N)]
+
+def image_points(rng, N, npts, n, dx, fill=0.9):
+    """
+    npts uniformly distributed points in an image with n pixels of size dx
+    along each of N axes (the output coordinates of irregular to irregular
+    transforms).
+    """
+    xmax = 0.5*fill*n*dx
+    return [rng.uniform(-xmax, xmax, npts) for i in range(N)]
+
+def complex_data(rng, shape):
+    return rng.standard_normal(shape) + 1j*rng.standard_normal(shape)
+
+################################################################################
+# Running a case
+
+def case_name(case):
+    return '%(mode)s N=%(N)d nvis=%(nvis)d n=%(n)d W=%(W)d alpha=%(alpha)g' \
+        % case
+
+def make_case(rng, case, samples):
+    """
+    Returns the plan arguments and the input data for a case.
+    """
+    N, n, nvis = case['N'], case['n'], case['nvis']
+    dx = 1./n
+    image_ax = [(dx, n)]*N
+    mode = case['mode']
+
+    if mode == 'RR':
+        return ([], [], dict(ndim=N)), complex_data(rng, (n,)*N)
+    coords = samples(rng, N, nvis, n, dx)
+    if mode == 'IR':
+        return (coords, image_ax, {}), complex_data(rng, nvis)
+    if mode == 'RI':
+        return (image_ax, coords, {}), complex_data(rng, (n,)*N)
+    out = image_points(rng, N, nvis, n, dx)
+    return (coords, (out, image_ax), {}), complex_data(rng, nvis)
+
+def run_case(case, args, executor=None):
+    """
+    Benchmarks one case, returning a record of its results. executor is the
+    GriddingPool to grid with, if any.
+    """
+    rng = np.random.default_rng(args.seed)
+    samples = clustered_samples if args.clustered else random_samples
+    (in_ax, out_ax, extra), inp = make_case(rng, case, samples)
+
+    opts = dict(W=case['W'], alpha=case['alpha'], verbose=False, \
+        nthreads=args.nthreads, fft_backend=args.fft_backend, \
+        precision=args.precision, sort_samples=args.sort_samples, \
+        executor=executor)
+    opts.update(extra)
+
+    t0 = time.perf_counter()
+    plan = G.GFFTPlan(in_ax, out_ax, **opts)
+    t_plan = time.perf_counter() - t0
+
+    # one untimed call fills the workspace and the FFT plan caches
+    ws = {}
+    plan.execute(inp, workspace=ws)
+
+    best = None
+    for r in range(args.repeat):
+        t0 = time.perf_counter()
+        plan.execute(inp, workspace=ws)
+        t = time.perf_counter() - t0
+        stats = {}
+        plan.execute(inp, workspace=ws, stats=stats)
+        if best is None or t < best[0]:
+            best = (t, stats['times'])
+
+    # peak memory of a call without a workspace, i.e. including the grids
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    plan.execute(inp)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    record = dict(case)
+    record.update(name=case_name(case), plan=t_plan, wall=best[0], \
+        stages=best[1], peak_mb=peak/2.**20)
+    return record
+
+################################################################################
+# Sweep, report and comparison
+
+def cases(args):
+    """
+    Yields the cases of the sweep, skipping those that would not fit in
+    memory.
+    """
+    nvis_list = args.nvis
+    if nvis_list is None:
+        nvis_list = FULL_NVIS if args.full else QUICK_NVIS
+
+    for mode, N, W, alpha in itertools.product(args.modes, args.dims, \
+        args.W, args.alpha):
+            sizes = args.sizes if args.sizes is not None else [SIZES[N]]
+            for n in sizes:
+                if int(alpha*n)**N >= MAX_GRID_CELLS:
+                    continue
+                for nvis in ([0] if mode == 'RR' else nvis_list):
+                    if nvis*(16 + N*(W + 1)*8) > MAX_VIS_BYTES:
+                        continue
+                    yield dict(mode=mode, N=N, nvis=int(nvis), n=n, W=W, \
+                        alpha=alpha)
+
+def format_stages(stages):
+    return ' '.join(['%s=%.4f' % (k, stages[k]) for k in sorted(stages)])
+
+def report_header():
+    print('%-48s %9s %9s %9s  %s' % ('case', 'plan [s]', 'exec [s]', \
+        'peak [MB]', 'stages [s]'))
+
+def report(rec):
+    print('%-48s %9.4f %9.4f %9.1f  %s' % (rec['name'], rec['plan'], \
+        rec['wall'], rec['peak_mb'], format_stages(rec['stages'])))
+
+def compare(records, baseline, threshold):
+    """
+    Prints the ratio of the plan and execute times, and of the time of each
+    stage, to those in baseline for every case found in both. Returns the
+    number of cases whose execute time grew by more than threshold.
+    """
+    base = dict([(rec['name'], rec) for rec in baseline['records']])
+    print('')
+    print('Comparison with the baseline (new/old, > 1 is slower)')
+    print('%-48s %7s %7s %7s  %s' % ('case', 'plan', 'exec', 'peak', \
+        'stages'))
+
+    slower = 0
+    for rec in records:
+        old = base.get(rec['name'])
+        if old is None:
+            continue
+        ratio = lambda new, old: new/old if old > 0 else float('nan')
+        stages = dict([(k, ratio(rec['stages'][k], old['stages'][k])) \
+            for k in rec['stages'] if k in old['stages']])
+        r = ratio(rec['wall'], old['wall'])
+        flag = ''
+        if r > threshold:
+            flag = '  <- slower'
+            slower += 1
+        print('%-48s %7.2f %7.2f %7.2f  %s%s' % (rec['name'], \
+            ratio(rec['plan'], old['plan']), r, \
+            ratio(rec['peak_mb'], old['peak_mb']), \
+            ' '.join(['%s=%.2f' % (k, stages[k]) for k in sorted(stages)]), \
+            flag))
+
+    return slower
+
+def environment():
+    return dict(python=platform.python_version(), numpy=np.__version__, \
+        gfft=G.VERSION, machine=platform.machine(), \
+        processor=platform.processor(), \
+        fft_backends=G.available_fft_backends())
+
+################################################################################
+# Command line
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description='Benchmarks for GFFT.')
+    p.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    p.add_argument('--dims', nargs='+', type=int, default=[1, 2, 3])
+    p.add_argument('--nvis', nargs='+', type=float, default=None, \
+        help='numbers of irregularly spaced samples')
+    p.add_argument('--full', action='store_true', \
+        help='sweep nvis from 1e3 to 1e7 (default 1e3 and 1e5)')
+    p.add_argument('--sizes', nargs='+', type=int, default=None, \
+        help='image sizes along each axis (default depends on N)')
+    p.add_argument('--W', nargs='+', type=int, default=[6])
+    p.add_argument('--alpha', nargs='+', type=float, default=[1.5])
+    p.add_argument('--clustered', action='store_true', \
+        help='concentrate the samples towards u = 0')
+    p.add_argument('--nthreads', type=int, default=1)
+    p.add_argument('--nprocs', type=int, default=1, \
+        help='grid with a GriddingPool of this many processes')
+    p.add_argument('--fft-backend', default=None)
+    p.add_argument('--precision', default='double', \
+        choices=['double', 'single'])
+    p.add_argument('--sort-samples', default=None, choices=['tile', 'morton'])
+    p.add_argument('--repeat', type=int, default=3)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--save', default=None, help='save the results as JSON')
+    p.add_argument('--compare', default=None, \
+        help='compare with results saved by --save')
+    p.add_argument('--threshold', type=float, default=1.1, \
+        help='execute time ratio above which a case is flagged as slower')
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    executor = None
+    if args.nprocs > 1:
+        executor = G.GriddingPool(args.nprocs)
+
+    report_header()
+    records = []
+    try:
+        for case in cases(args):
+            records += [run_case(case, args, executor)]
+            report(records[-1])
+            sys.stdout.flush()
+    finally:
+        if executor is not None:
+            executor.close()
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(dict(environment=environment(), args=vars(args), \
+                records=records), f, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(records, baseline, args.threshold) > 0:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
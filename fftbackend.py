@@ -0,0 +1,305 @@
+"""
+fftbackend.py
+
+This file contains the FFT backends used in the GFFT package. A backend
+provides N-D FFTs and IFFTs along a given set of axes. The numpy backend is
+always available, the scipy (scipy.fft) and pyfftw backends are registered
+when the corresponding packages can be imported.
+
+The backend used by gfft and GFFTPlan can be chosen for each call with their
+fft_backend argument, or globally with set_fft_backend. Other backends can be
+added with register_fft_backend.
+"""
+
+"""
+Copyright 2012 Michael Bell, Henrik Junklewitz
+
+This file is part of GFFT.
+
+GFFT is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+GFFT is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with GFFT.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+try:
+    import pyfftw
+except ImportError:
+    pyfftw = None
+
+################################################################################
+# Backends
+
+class FFTBackend(object):
+    """
+    FFTBackend
+
+    The interface of an FFT backend. fftn and ifftn transform the complex
+    array a along axes using nthreads threads (where supported) and return the
+    result, with the same normalization as numpy.fft.fftn/ifftn. If overwrite
+    is True, a is not needed afterwards, and the backend may transform it in
+    place and return it.
+
+    irfftn is the inverse FFT of a Hermitian array of which only the first
+    s[-1]//2+1 elements along the last of axes are given, as numpy's irfftn,
+    returning a real array with lengths s along axes. If out is given, the
+    result is written to it.
+
+    empty allocates an array suited to the backend (e.g. aligned for SIMD),
+    for work arrays that are transformed repeatedly.
+    """
+
+    name = None
+
+    def empty(self, shape, dtype):
+        return np.empty(shape, dtype=dtype)
+
+    def fftn(self, a, axes, overwrite=False, nthreads=1):
+        raise NotImplementedError
+
+    def ifftn(self, a, axes, overwrite=False, nthreads=1):
+        raise NotImplementedError
+
+    def irfftn(self, a, s, axes, overwrite=False, nthreads=1, out=None):
+        raise NotImplementedError
+
+
+class NumpyFFTBackend(FFTBackend):
+    """
+    numpy.fft, single threaded. Transforms in place using the out argument
+    where numpy supports it. Versions of numpy that always transform in double
+    precision have their output cast back to single precision for single
+    precision input.
+    """
+
+    name = 'numpy'
+
+    def __init__(self):
+        try:
+            np.fft.fftn(np.zeros(1, dtype=complex), out=np.zeros(1, \
+                dtype=complex))
+            self.has_out = True
+        except TypeError:
+            self.has_out = False
+
+    def fftn(self, a, axes, overwrite=False, nthreads=1):
+        if overwrite and self.has_out and np.iscomplexobj(a):
+            return np.fft.fftn(a, axes=axes, out=a)
+        return np.fft.fftn(a, axes=axes).astype(np.result_type(a.dtype, \
+            np.complex64), copy=False)
+
+    def ifftn(self, a, axes, overwrite=False, nthreads=1):
+        if overwrite and self.has_out and np.iscomplexobj(a):
+            return np.fft.ifftn(a, axes=axes, out=a)
+        return np.fft.ifftn(a, axes=axes).astype(np.result_type(a.dtype, \
+            np.complex64), copy=False)
+
+    def irfftn(self, a, s, axes, overwrite=False, nthreads=1, out=None):
+        out_dtype = np.empty(0, \
+            dtype=np.result_type(a.dtype, np.complex64)).real.dtype
+        if out is not None and self.has_out and out.dtype == out_dtype:
+            return np.fft.irfftn(a, s=s, axes=axes, out=out)
+        res = np.fft.irfftn(a, s=s, axes=axes).astype(out_dtype, copy=False)
+        if out is not None:
+            out[...] = res
+            return out
+        return res
+
+
+class ScipyFFTBackend(FFTBackend):
+    """
+    scipy.fft, multi threaded through its workers argument. scipy caches its
+    own plans by shape, dtype and axes.
+    """
+
+    name = 'scipy'
+
+    def fftn(self, a, axes, overwrite=False, nthreads=1):
+        return scipy_fft.fftn(a, axes=axes, overwrite_x=overwrite, \
+            workers=nthreads)
+
+    def ifftn(self, a, axes, overwrite=False, nthreads=1):
+        return scipy_fft.ifftn(a, axes=axes, overwrite_x=overwrite, \
+            workers=nthreads)
+
+    def irfftn(self, a, s, axes, overwrite=False, nthreads=1, out=None):
+        res = scipy_fft.irfftn(a, s=s, axes=axes, overwrite_x=overwrite, \
+            workers=nthreads)
+        if out is not None:
+            out[...] = res
+            return out
+        return res
+
+
+class PyFFTWBackend(FFTBackend):
+    """
+    pyFFTW, multi threaded. The FFTW plans are cached, keyed on the shape,
+    dtype, alignment and axes of the array, the direction, the number of
+    threads and whether the transform is done in place. The accumulated
+    FFTW wisdom can be saved and restored with get_wisdom and set_wisdom.
+    """
+
+    name = 'pyfftw'
+
+    def __init__(self, planner_effort='FFTW_MEASURE'):
+        self.planner_effort = planner_effort
+        self.plans = {}
+
+    def empty(self, shape, dtype):
+        return pyfftw.empty_aligned(shape, dtype=dtype)
+
+    def get_wisdom(self):
+        return pyfftw.export_wisdom()
+
+    def set_wisdom(self, wisdom):
+        pyfftw.import_wisdom(wisdom)
+
+    def _execute(self, a, axes, overwrite, nthreads, direction):
+
+        # the plans are made for C contiguous complex arrays
+        b = np.ascontiguousarray(a, \
+            dtype=np.result_type(a.dtype, np.complex64))
+        overwrite = overwrite or b is not a
+        a = b
+
+        axes = tuple(axes)
+        aligned = a.ctypes.data % pyfftw.simd_alignment == 0
+        key = (a.shape, a.dtype.str, aligned, axes, direction, nthreads, \
+            overwrite)
+
+        if key not in self.plans:
+            # plan on scratch arrays, FFTW_MEASURE overwrites its arrays
+            flags = [self.planner_effort]
+            if aligned:
+                src = pyfftw.empty_aligned(a.shape, dtype=a.dtype)
+            else:
+                flags += ['FFTW_UNALIGNED']
+                src = np.empty_like(a)
+            dst = src if overwrite else pyfftw.empty_aligned(a.shape, \
+                dtype=a.dtype)
+            self.plans[key] = pyfftw.FFTW(src, dst, axes=axes, \
+                direction=direction, flags=flags, threads=nthreads)
+
+        plan = self.plans[key]
+        out = a if overwrite else pyfftw.empty_aligned(a.shape, dtype=a.dtype)
+        plan.update_arrays(a, out)
+        plan.execute()
+
+        if direction == 'FFTW_BACKWARD':
+            out /= np.prod([a.shape[i] for i in axes])
+
+        return out
+
+    def fftn(self, a, axes, overwrite=False, nthreads=1):
+        return self._execute(a, axes, overwrite, nthreads, 'FFTW_FORWARD')
+
+    def ifftn(self, a, axes, overwrite=False, nthreads=1):
+        return self._execute(a, axes, overwrite, nthreads, 'FFTW_BACKWARD')
+
+    def irfftn(self, a, s, axes, overwrite=False, nthreads=1, out=None):
+
+        # multi-dimensional complex to real FFTW plans always destroy their
+        # input
+        b = np.ascontiguousarray(a, \
+            dtype=np.result_type(a.dtype, np.complex64))
+        if b is a and not overwrite:
+            b = b.copy()
+        a = b
+
+        axes = tuple(axes)
+        s = tuple(s)
+        out_shape = list(a.shape)
+        for i in range(len(axes)):
+            out_shape[axes[i]] = s[i]
+        out_dtype = np.empty(0, dtype=a.dtype).real.dtype
+
+        aligned = a.ctypes.data % pyfftw.simd_alignment == 0
+        key = (a.shape, a.dtype.str, aligned, axes, s, 'C2R', nthreads)
+
+        if key not in self.plans:
+            flags = [self.planner_effort, 'FFTW_DESTROY_INPUT']
+            if aligned:
+                src = pyfftw.empty_aligned(a.shape, dtype=a.dtype)
+            else:
+                flags += ['FFTW_UNALIGNED']
+                src = np.empty_like(a)
+            dst = pyfftw.empty_aligned(out_shape, dtype=out_dtype)
+            self.plans[key] = pyfftw.FFTW(src, dst, axes=axes, \
+                direction='FFTW_BACKWARD', flags=flags, threads=nthreads)
+
+        plan = self.plans[key]
+        res = out
+        if res is None or res.shape != tuple(out_shape) or \
+            res.dtype != out_dtype or not res.flags.c_contiguous or \
+            res.ctypes.data % pyfftw.simd_alignment != 0:
+                res = pyfftw.empty_aligned(out_shape, dtype=out_dtype)
+        plan.update_arrays(a, res)
+        plan.execute()
+        res /= np.prod(s)
+
+        if out is not None and res is not out:
+            out[...] = res
+            return out
+        return res
+
+################################################################################
+# Registry
+
+_fft_backends = {}
+_default_fft_backend = 'numpy'
+
+def register_fft_backend(backend):
+    """
+    Makes the FFTBackend instance backend available under backend.name.
+    """
+    if not isinstance(backend, FFTBackend):
+        raise TypeError('backend must be an FFTBackend instance.')
+    _fft_backends[backend.name] = backend
+
+def available_fft_backends():
+    """
+    Returns the names of the registered FFT backends.
+    """
+    return sorted(_fft_backends.keys())
+
+def set_fft_backend(name):
+    """
+    Sets the FFT backend used when none is given to gfft or GFFTPlan.
+    """
+    global _default_fft_backend
+    get_fft_backend(name)
+    _default_fft_backend = name
+
+def get_fft_backend(name=None):
+    """
+    Returns the FFT backend registered as name, or the default backend if name
+    is None.
+    """
+    if name is None:
+        name = _default_fft_backend
+    if name not in _fft_backends:
+        raise Exception('Unknown or unavailable FFT backend '+str(name)+\
+            '. Available backends are: '+\
+            ', '.join(available_fft_backends()))
+    return _fft_backends[name]
+
+register_fft_backend(NumpyFFTBackend())
+if scipy_fft is not None:
+    register_fft_backend(ScipyFFTBackend())
+if pyfftw is not None:
+    register_fft_backend(PyFFTWBackend())
@@ -4,8 +4,11 @@ GFFT
 This package mainly consists of a single function, gfft, which is a generalized
 Fourier transformation function that can transform between regularly- or
 irregularly-spaced, N-D fields. Gridding and degridding is performed when
-irregularly spaced fields are requested. Gridding is only supported for 1-, 2-,
-or 3-D fields.
+irregularly spaced fields are requested. Gridding is supported for up to
+gridding.MAX_DIMS (32) dimensions. The GFFTPlan class provides the same
+transformations for repeated use on fixed axes, and NormalOperator the normal
+operator of a fixed sampling for iterative reconstruction, with GFFTOperator
+the sampling itself as a linear operator.
 """
 
 """
@@ -27,14 +30,67 @@ You should have received a copy of the GNU General Public License
 along with GFFT.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
+import json
+import time
+import tempfile
 import numpy as np
 import warnings
+import itertools
+from multiprocessing.pool import ThreadPool
+
+try:
+    import scipy.sparse.linalg as sparse_linalg
+except ImportError:
+    sparse_linalg = None
 
 from gfft import gridding
+from gfft import fftbackend
+from gfft.fftbackend import FFTBackend, register_fft_backend, \
+    available_fft_backends, set_fft_backend, get_fft_backend
+from gfft.gridpool import GriddingPool
+
+VERSION = "0.2.1"
+
+################################################################################
+# Set some global variables
+
+# different modes of operation
+MODE_RR = 0 # regular grid to regular grid
+MODE_IR = 1 # irregular grid to regular grid
+MODE_RI = 2 # regular grid to irregular grid
+MODE_II = 3 # irregular grid to irregular grid
+
+mode_types = {MODE_RR:"regular to regular (no gridding)", \
+    MODE_IR:"irregular to regular (gridding)", \
+    MODE_RI:"regular to irregular (de-gridding)", \
+    MODE_II:"irregular to irregular (gridding and degridding)"}
+
+# Different ftmachine options
+FTM_FFT = 'fft'
+FTM_IFFT = 'ifft'
+FTM_NONE = 'none'
+
+# default size in bytes of the blocks of the Fourier matrix used by dft/idft
+DFT_BLOCK_BYTES = 2**26
+
+# default size in bytes of the slabs and pencils of an out of core grid that
+# are held in memory at a time
+OUT_OF_CORE_BYTES = 2**30
+
+# the (W, alpha) candidates tried by autotune
+AUTOTUNE_W = [2, 3, 4, 5, 6, 7, 8, 10, 12]
+AUTOTUNE_ALPHA = [1.25, 1.5, 1.75, 2.]
+
+# the configurations found by autotune, keyed on the problem (see autotune)
+autotune_cache = {}
 
 def gfft(inp, in_ax=[], out_ax=[], ftmachine='fft', in_zero_center=True, \
     out_zero_center=True, enforce_hermitian_symmetry=False, W=6, alpha=1.5,\
-    verbose=True):
+    verbose=False, kernel_tol=1e-7, nthreads=1, deterministic=False, \
+    fft_backend=None, precision='double', sort_samples=None, out=None, \
+    workspace=None, weights=None, psf=False, stats=None, out_of_core=None, \
+    executor=None, batch_axes=None):
 
     """
     gfft (Generalized FFT)
@@ -44,13 +100,22 @@ def gfft(inp, in_ax=[], out_ax=[], ftmachine='fft', in_zero_center=True, \
         out_zero_center=True, out_is_real=False, W=6, alpha=1.5)
 
     This is a generalized Fourier transformation function that can transform
-    between regularly- or irregularly-spaced, 1- 2- or 3-D fields. Gridding and
+    between regularly- or irregularly-spaced, N-D fields. Gridding and
     degridding is performed when irregularly spaced fields are requested.
 
     input
     ------------------
-    inp: The input data to be transformed. This can be a 1-, 2- or 3-D
-        (henceforth N-D) numpy array.
+    inp: The input data to be transformed. This can be a 1-, 2-, 3- or
+        higher dimensional (henceforth N-D) numpy array, e.g. 4-D data on
+        (u, v, w, lambda^2) axes.
+
+        When gridding or degridding, inp may also hold several channels (e.g.
+        frequencies or polarizations) that share the same coordinates, as an
+        extra last axis, i.e. an (nvis, nchan) array for irregularly spaced
+        input or an N-D array with one extra axis for regularly spaced input.
+        The kernel weights are then computed once for all channels, all
+        channels are Fourier transformed together, and the output has the
+        channel axis last.
 
     in_ax, out_ax: The axes on which the input/output arrays are defined. There
         are a few options here depending on the types of fields that are to be
@@ -104,1054 +169,2254 @@ def gfft(inp, in_ax=[], out_ax=[], ftmachine='fft', in_zero_center=True, \
 
     W, alpha: These are gridding parameters.
 
+    verbose: If True, the version, the mode and some progress messages are
+        printed. Off by default.
+
+    kernel_tol: The gridding kernel is interpolated from a table that is built
+        once per (W, alpha) and reproduces the kernel to within kernel_tol.
+        Set to 0 to evaluate the kernel exactly for every grid point instead.
+
+    nthreads: The number of OpenMP threads used for gridding and degridding.
+        Degridding always gives the same result as with a single thread. For
+        gridding, with the default deterministic=False, each thread grids its
+        share of the samples onto a private copy of the grid and the copies
+        are summed afterwards, so the result can differ from the single
+        threaded one by rounding errors. Setting deterministic=True instead
+        gives each thread its own slab of the grid along the first axis, which
+        needs no extra memory and reproduces the single threaded result bit
+        for bit, but balances the work less evenly when the samples are
+        clustered. FFT backends that support it also use nthreads threads.
+
+    fft_backend: The name of the FFT backend to use, e.g. 'numpy', 'scipy' or
+        'pyfftw' (see available_fft_backends). If None, the default backend
+        is used, which is 'numpy' unless changed with set_fft_backend.
+
+    precision: 'double' (default) or 'single'. In single precision the data,
+        grids, grid corrections and FFTs are complex64/float32, which halves
+        the memory used by the grids. The gridding kernels are still computed
+        in double precision, and the sums over the kernel footprint when
+        degridding (and over the per thread grids when gridding with several
+        threads) are accumulated in double precision. Expect relative errors
+        of order 1e-6 to 1e-5 on top of those of the gridding itself. The
+        output is complex64 (or float32 if real).
+
+    sort_samples: None (default), 'tile' or 'morton'. Irregularly spaced
+        samples are gridded and degridded in the order they are given, which
+        for randomly ordered samples on large grids makes most grid accesses
+        cache misses. With 'tile' the samples are processed sorted by the
+        tile of 16**N grid cells they fall in, and with 'morton' along a
+        Morton (Z order) curve through the grid. The ordering is computed
+        once per plan, and the output is always in the original order.
+        Sorting changes the order in which samples are summed on the grid, so
+        the result can differ by rounding errors.
+
+    out: An array to write the output to, instead of a new array. It must
+        have the shape of the output, and when degridding also its dtype.
+
+    workspace: A dict in which the work arrays (grids and FFT buffers) are
+        kept. Passing the same dict to repeated calls for arrays of the same
+        shape reuses them instead of allocating new ones.
+
+    weights: A real array of one weight per input sample, which multiplies
+        irregularly spaced input before it is gridded (e.g. natural or
+        uniform imaging weights).
+
+    psf: If True (irregular to regular only), the weights (or ones if no
+        weights are given) are gridded along with the weighted data, in the
+        same pass over the samples, and both grids are Fourier transformed
+        together. The output is then a tuple (out, psf) of the transform of
+        the weighted data and that of the weights, i.e. the dirty image and
+        the point spread function (or beam) in imaging, unnormalized. out may
+        then be a tuple of two arrays to write them to.
+
     enforce_hermitian_symmetry: A length N list of booleans. If the in array is
         to be gridded, setting this to 'True' indicates that the Hermitian
         conjugate of the input array needs to be generated during gridding.
         This can be set for each axis independently. This is ignored when going
         from a regular grid to another regular grid.
 
+        When going from irregular to regular space with Hermitian symmetry
+        enforced (and a transform) along every axis, the output is real. Only
+        half of the grid is then gridded and it is transformed with a complex
+        to real FFT, and the output is returned as a real array. (This is not
+        possible for input axes that are not zero centered or have an odd
+        number of grid cells, which use the full complex grid as before.)
+
+    out_of_core: None (default) or the name of a directory. For irregular to
+        regular and regular to irregular transformations of 2 or more
+        dimensions, the oversampled grid is then kept in a temporary memory
+        mapped file in that directory instead of in memory. The gridding,
+        FFT, cropping and grid correction (or the zero padding, FFT and
+        degridding) are done one slab (a block of rows along the first axis)
+        or pencil (a block along the second axis, spanning the first) at a
+        time, each of about OUT_OF_CORE_BYTES bytes, so the grid is never
+        held in memory as a whole. inp and out still are, unless they are
+        given as memory mapped arrays themselves (np.memmap). The file is
+        removed when the grid is no longer used, or kept in workspace for
+        reuse if one is given.
+
+    executor: None (default) or a GriddingPool. If given, irregularly spaced
+        input is gridded by the worker processes of the pool, each gridding
+        a share of the samples onto its own copy of the grid in shared
+        memory (see GriddingPool). The copies are then summed and the FFT is
+        done in the calling process. Not available with out_of_core.
+
+    batch_axes: None (default) or a list of the leading axes of inp, i.e.
+        [0], [0, 1], etc. (regular to regular only). These axes index a stack
+        of frames and are neither shifted nor transformed, and ftmachine,
+        in_zero_center and out_zero_center refer to the remaining axes only.
+        All frames are shifted and transformed together, in one FFT call.
+
+    stats: None (default), a dict or a callable. If given, the call is
+        timed and counted: a dict with the following entries is filled in
+        (the given dict) or passed to the callable at the end of the call.
+
+            mode: the mode of operation, as a string.
+            times: a dict of the wall time in seconds spent in each stage
+                that was run: 'plan' (validating the arguments and setting
+                up the plan, including the gridding kernels), 'validation'
+                (checking and converting the input), 'gridding', 'shift',
+                'fft', 'crop', 'correction' (grid correction, including the
+                zero padding before degridding) and 'degridding'.
+            total: the wall time of the whole call.
+            bytes_allocated: the bytes of the work arrays (see workspace) and
+                the output allocated by the call. Arrays allocated inside
+                the FFT backend are not counted.
+            nchan: the number of channels.
+            nvis_in, nvis_out: the number of irregularly spaced input and
+                output samples (for the modes that have them).
+            grid_clipped, grid_dropped: the number of input samples whose
+                gridding kernel lies partly (clipped) or entirely (dropped)
+                outside the grid, and so is partly or entirely lost.
+            degrid_clipped, degrid_dropped: the same for the output samples.
+
+        Nothing is timed or counted when stats is None.
+
 
     output
     ------------------
-    out: A numpy array that contains the FT or IFT of inp.
+    out: A numpy array that contains the FT or IFT of inp, or a tuple
+        (out, psf) if psf is True.
+
+    To transform many data arrays defined on the same axes, create a GFFTPlan
+    once and call its execute method for each array instead. To grid data
+    sets that do not fit in memory, use gfft_stream.
 
     """
 
-    VERSION = "0.2.1"
+    if type(inp) != np.ndarray:
+        raise TypeError('inp must be a numpy array.')
 
-    if verbose:
-        print("gfft v. "+VERSION)
+    check_stats(stats)
+    t = _now(stats)
 
-    ############################################################################
-    # Set some global variables
+    ndim = inp.ndim
+    if type(batch_axes) == list:
+        ndim -= len(batch_axes)
 
-    # different modes of operation
-    MODE_RR = 0 # regular grid to regular grid
-    MODE_IR = 1 # irregular grid to regular grid
-    MODE_RI = 2 # regular grid to irregular grid
-    MODE_II = 3 # irregular grid to irregular grid
+    plan = GFFTPlan(in_ax, out_ax, ftmachine, in_zero_center, \
+        out_zero_center, enforce_hermitian_symmetry, W, alpha, verbose, \
+        ndim=ndim, kernel_tol=kernel_tol, nthreads=nthreads, \
+        deterministic=deterministic, fft_backend=fft_backend, \
+        precision=precision, sort_samples=sort_samples, \
+        out_of_core=out_of_core, executor=executor, batch_axes=batch_axes)
 
-    mode_types = {MODE_RR:"regular to regular (no gridding)", \
-        MODE_IR:"irregular to regular (gridding)", \
-        MODE_RI:"regular to irregular (de-gridding)", \
-        MODE_II:"irregular to irregular (gridding and degridding)"}
+    if stats is None:
+        return plan.execute(inp, out, workspace, weights, psf)
 
-    # Different ftmachine options
-    FTM_FFT = 'fft'
-    FTM_IFFT = 'ifft'
-    FTM_NONE = 'none'
+    t_plan = time.perf_counter() - t
+    rec = {}
+    out = plan.execute(inp, out, workspace, weights, psf, rec)
+    rec['times']['plan'] = t_plan
+    rec['total'] += t_plan
+    report_stats(stats, rec)
 
-    ############################################################################
-    # Validate the inputs...
+    return out
 
-    if type(inp) != np.ndarray:
-        raise TypeError('inp must be a numpy array.')
 
-    if type(in_ax) != list and type(in_ax) != tuple:
-        raise TypeError('in_ax must be either a list or a tuple.')
-    if type(out_ax) != list and type(out_ax) != tuple:
-        raise TypeError('out_ax must be either a list or a tuple.')
-    if type(out_ax) == tuple and type(in_ax) == tuple:
-        raise TypeError('out_ax and in_ax cannot both be tuples')
-
-    if type(in_ax) == tuple and (not validate_iterrable_types(in_ax, list)\
-        or len(in_ax) != 2):
-            raise TypeError('If in_ax is a tuple, it must contain two lists.')
-    if type(out_ax) == tuple and (not validate_iterrable_types(out_ax, list)\
-        or len(out_ax) != 2):
-            raise TypeError('If out_ax is a tuple, it must contain two lists.')
-
-    if type(in_ax) == tuple and \
-        not validate_iterrable_types(in_ax[0], np.ndarray):
-            raise TypeError('If in_ax is a tuple, it must contain two lists,' +\
-                ' the first of which is a list of arrays.')
-    if type(in_ax) == tuple and \
-        not validate_iterrable_types(in_ax[1], tuple):
-            raise TypeError('If in_ax is a tuple, it must contain two lists,' +\
-                ' the second of which is a list of tuples.')
-
-    if type(out_ax) == tuple and \
-        not validate_iterrable_types(out_ax[0], np.ndarray):
-            raise TypeError('If out_ax is a tuple, it must contain two lists,'+\
-                ' the first of which is a list of arrays.')
-    if type(out_ax) == tuple and \
-        not validate_iterrable_types(out_ax[1], tuple):
-            raise TypeError('If out_ax is a tuple, it must contain two lists,'+\
-                ' the second of which is a list of tuples.')
-
-    if type(W) != int:
-        raise TypeError('W must be an integer.')
-    if type(alpha) != float and type(alpha) != int:
-        raise TypeError('alpha must be a float or int.')
-
-    if (type(ftmachine) != str and type(ftmachine) != list) or \
-        (type(ftmachine) == list and \
-        not validate_iterrable_types(ftmachine, str)):
-            raise TypeError('ftmachine must be a string or a list of strings.')
-
-    if (type(in_zero_center) != bool and type(in_zero_center) != list) or \
-        (type(in_zero_center) == list and \
-        not validate_iterrable_types(in_zero_center, bool)):
-            raise TypeError('in_zero_center must be a Bool or list of Bools.')
-
-    if (type(out_zero_center) != bool and type(out_zero_center) != list) or \
-        (type(out_zero_center) == list and \
-        not validate_iterrable_types(out_zero_center, bool)):
-            raise TypeError('out_zero_center must be a Bool or list of Bools.')
-
-    if (type(enforce_hermitian_symmetry) != bool and \
-        type(enforce_hermitian_symmetry) != list) or \
-        (type(enforce_hermitian_symmetry) == list and \
-        not validate_iterrable_types(enforce_hermitian_symmetry, bool)):
-            raise TypeError('enforce_hermitian_symmetry must be a Bool '\
-                +'or list of Bools.')
+def gfft_stream(chunks, out_ax, ftmachine='fft', in_zero_center=True, \
+    out_zero_center=True, enforce_hermitian_symmetry=False, W=6, alpha=1.5, \
+    verbose=False, kernel_tol=1e-7, nthreads=1, deterministic=False, \
+    fft_backend=None, precision='double', sort_samples=None, \
+    chunk_size=gridding.GRID_CHUNK, out=None, workspace=None, stats=None):
 
+    """
+    gfft_stream
 
-    ############################################################################
-    # figure out how many dimensions we are talking about, and what mode we
-    # want to use
-
-    N = 0 # number of dimensions
-    mode = -1
-
-    if len(in_ax) == 0:
-        # regular to regular transformation
-        mode = MODE_RR
-        N = inp.ndim
-        if len(out_ax) != 0:
-            warnings.warn('in_ax is empty, indicating regular to regular '\
-                +'transformation is requested, but out_ax is not empty. '+\
-                'Ignoring out_ax and proceeding with regular to regular mode.')
-    elif type(in_ax)==tuple or type(out_ax)==tuple:
-        # irregular to irregular transformation
-        mode = MODE_II
-        if type(out_ax)==tuple:
-            if len(out_ax) != 2:
-                raise TypeError('Invalid out_ax for '+\
-                    'irregular to irregular mode.')
-            N = len(in_ax)
-        else:
-            if len(in_ax) != 2:
-                raise TypeError('Invalid in_ax for '+\
-                    'irregular to irregular mode.')
-            N = len(out_ax)
-    else:
-        if type(in_ax[0])==tuple:
-            # regular to irregular transformation
-            mode = MODE_RI
-        else:
-            # irregular to regular transformation
-            mode = MODE_IR
-        N = len(in_ax)
-        if len(out_ax) != len(in_ax):
-            raise TypeError('For regular to irregular mode, len(in_ax) must '+\
-                'equal len(out_ax).')
-
-    if N==0 or mode == -1:
-        raise Exception('Something went wrong in setting the mode and ' \
-            + 'dimensionality.')
-
-    if N > 3 and mode != MODE_RR:
-        raise Exception('Gridding has been requested for an unsupported '+\
-            'number of dimensions!')
+    An irregular to regular gfft for data sets that do not fit in memory.
+    The data are gridded a chunk at a time onto a single grid, which is then
+    Fourier transformed and grid corrected, so that at any time only the grid
+    and one chunk of data (with its gridding kernels) are held in memory.
 
-    if verbose:
-        print('Requested mode = ' + mode_types[mode])
-        print("Number of dimensions = " + str(N))
+    input
+    ------------------
+    chunks: Either an iterable (e.g. a generator) yielding (in_ax, inp) pairs,
+        where in_ax is a list of N arrays holding the coordinates of the
+        samples in inp (as for gfft), or a single (in_ax, inp) tuple of arrays
+        that are read chunk_size samples at a time, e.g. np.memmap arrays or
+        arrays loaded with np.load(..., mmap_mode='r').
 
-    ############################################################################
-    # Figure out which axes should have which transforms applied to them
+    chunk_size: The number of samples per chunk when chunks is a tuple of
+        arrays.
 
-    # flags to determine whether I need to use fftn and/or ifftn
-    do_fft = False
-    do_ifft = False
-    # if you give an empty list to fftn in the axes position, nothing happens
-    fftaxes = []
-    ifftaxes = []
+    The remaining arguments are the same as for gfft. With stats, the times
+    and sample counts are summed over the chunks.
 
-    if type(ftmachine) == str:
-        if ftmachine.lower() == FTM_FFT:
-            do_fft = True
-            fftaxes = None
-        elif ftmachine.lower() == FTM_IFFT:
-            do_ifft = True
-            ifftaxes = None
-    elif type(ftmachine) == list:
-        if len(ftmachine) != N:
-            raise Exception('ftmachine is a list with invalid length')
-
-        for i in range(len(ftmachine)):
-            if ftmachine[i].lower() == FTM_FFT:
-                do_fft = True
-                fftaxes += [i]
-            elif ftmachine[i].lower() == FTM_IFFT:
-                do_ifft = True
-                ifftaxes += [i]
+    output
+    ------------------
+    out: A numpy array that contains the FT or IFT of the data.
+    """
 
-# As requested by Marco, if no FFT is requested, the function will still
-# perform a shift.
-    if (do_fft == False and do_ifft == False) or \
-        (fftaxes == [] and ifftaxes == []):
-            warnings.warn('No Fourier transformation requested, only '+\
-                'shifting will be performed!')
-#            return
-            mode = MODE_RR #Since gridding will not be needed, just use RR mode
+    if type(out_ax) != list:
+        raise TypeError('out_ax must be a list.')
+    if type(chunk_size) != int or chunk_size < 1:
+        raise TypeError('chunk_size must be a positive integer.')
 
-    ############################################################################
-    # figure out which axes need to be shifted (before and after FT)
+    check_stats(stats)
+    t = _now(stats)
 
-    do_preshift = False
-    do_postshift = False
+    # the plan is made without any samples, the kernels are computed for each
+    # chunk as it is gridded
+    plan = GFFTPlan([np.zeros(0)]*len(out_ax), out_ax, ftmachine, \
+        in_zero_center, out_zero_center, enforce_hermitian_symmetry, W, \
+        alpha, verbose, kernel_tol=kernel_tol, nthreads=nthreads, \
+        deterministic=deterministic, fft_backend=fft_backend, \
+        precision=precision, sort_samples=sort_samples)
 
-    preshift_axes = []
-    postshift_axes = []
+    rec = None
+    if stats is not None:
+        rec = plan.new_stats()
+        t0 = t
+        t = _tick(rec, 'plan', t)
 
-    if type(in_zero_center) == bool:
-        if in_zero_center:
-            do_preshift = True
-            preshift_axes = None
-    elif type(in_zero_center) == list:
-        if len(in_zero_center) != N:
-            raise Exception('in_zero_center is a list with invalid length')
+    if type(chunks) == tuple:
+        chunks = array_chunks(chunks[0], chunks[1], chunk_size)
 
-        for i in range(len(in_zero_center)):
-            if in_zero_center[i]:
-                do_preshift = True
-                preshift_axes += [i]
-
-    if type(out_zero_center) == bool:
-        if out_zero_center:
-            do_postshift = True
-            postshift_axes = None
-    elif type(out_zero_center) == list:
-        if len(out_zero_center) != N:
-            raise Exception('out_zero_center is a list with invalid length')
-
-        for i in range(len(out_zero_center)):
-            if out_zero_center[i]:
-                do_postshift = True
-                postshift_axes += [i]
+    grid = None
+    for in_ax, inp in chunks:
+        if grid is None:
+            grid = plan.new_grid(np.shape(inp)[1:], workspace)
+        plan.add_to_grid(grid, in_ax, inp, workspace, rec)
 
-    ############################################################################
-    # figure out which axes need to be hermitianized
+    if grid is None:
+        raise Exception('No data were given to gfft_stream.')
 
-    hermitianized_axes = []
+    res = plan.finish_grid(grid, out, workspace, rec)
 
-    if type(enforce_hermitian_symmetry) == bool:
-        if enforce_hermitian_symmetry:
-            for i in range(N):
-                hermitianized_axes += [True]
-        else:
-            for i in range(N):
-                hermitianized_axes += [False]
+    if verbose:
+        print("Done!")
+        print("")
 
-    elif type(enforce_hermitian_symmetry) == list:
-        if len(enforce_hermitian_symmetry) != N:
-            raise Exception('enforce_hermitian_symmetry is a list with '+\
-                'invalid length')
+    if stats is not None:
+        rec['nchan'] = int(np.prod(grid.shape[plan.N:]))
+        rec['total'] = time.perf_counter() - t0
+        if workspace is None:
+            rec['bytes_allocated'] += grid.nbytes
+        if res is not out:
+            rec['bytes_allocated'] += res.nbytes
+        report_stats(stats, rec)
 
-        for i in range(len(enforce_hermitian_symmetry)):
-            if enforce_hermitian_symmetry[i]:
-                hermitianized_axes += [True]
-            else:
-                hermitianized_axes += [False]
+    return res
 
-    if len(hermitianized_axes) != N:
-        raise Exception('Something went wrong when setting up the '+\
-            'hermitianized_axes list!')
 
-    ############################################################################
-    # Print operation summary
+def array_chunks(in_ax, inp, chunk_size):
+    """
+    Yields (in_ax, inp) chunks of chunk_size samples from the arrays in_ax and
+    inp. Only the current chunk is read from memory mapped arrays.
+    """
+    for k0 in range(0, len(inp), chunk_size):
+        yield [ax[k0:k0+chunk_size] for ax in in_ax], inp[k0:k0+chunk_size]
 
-    if verbose:
-        print("")
-        print("Axis#, FFT, IFFT, ZCIN, ZCOUT, HERM")
 
-        for i in range(N):
-            pstr = str(N)+', '
+class GFFTPlan(object):
+    """
+    GFFTPlan
+
+    A reusable transformation plan for gfft.
+
+    def GFFTPlan(in_ax=[], out_ax=[], ftmachine='fft', in_zero_center=True, \
+        out_zero_center=True, enforce_hermitian_symmetry=False, W=6, \
+        alpha=1.5, verbose=False, ndim=None, kernel_tol=1e-7, nthreads=1, \
+        deterministic=False, fft_backend=None, precision='double', \
+        sort_samples=None, out_of_core=None, executor=None, batch_axes=None)
+
+    Everything that gfft does which depends only on the axes and the
+    transformation options, i.e. argument validation, mode detection, shift
+    bookkeeping, the gridding kernel weights and indices, and the grid
+    correction arrays, is done once when the plan is created. The plan can then
+    be applied to any number of data arrays defined on the same axes with
+    the execute method, e.g.
+
+        plan = GFFTPlan(in_ax, out_ax)
+        for inp in data:
+            out = plan.execute(inp)
+
+    The arguments have the same meaning as for gfft (see the gfft docstring).
+    For a regular to regular transformation the number of dimensions can not be
+    inferred from the axes, so it must be given using ndim (not counting any
+    batch_axes, which are the leading axes of the arrays). The size of the
+    slabs and pencils of an out of core grid can be changed with the
+    block_bytes attribute.
+    """
 
-            if fftaxes == None or fftaxes.count(i)>0:
-                pstr = pstr + 'True, '
-            else:
-                pstr = pstr + 'False, '
+    def __init__(self, in_ax=[], out_ax=[], ftmachine='fft', \
+        in_zero_center=True, out_zero_center=True, \
+        enforce_hermitian_symmetry=False, W=6, alpha=1.5, verbose=False, \
+        ndim=None, kernel_tol=1e-7, nthreads=1, deterministic=False, \
+        fft_backend=None, precision='double', sort_samples=None, \
+        out_of_core=None, executor=None, batch_axes=None):
 
-            if ifftaxes == None or ifftaxes.count(i)>0:
-                pstr = pstr + 'True, '
+        if verbose:
+            print("gfft v. "+VERSION)
+
+        ########################################################################
+        # Validate the inputs...
+
+        if type(in_ax) != list and type(in_ax) != tuple:
+            raise TypeError('in_ax must be either a list or a tuple.')
+        if type(out_ax) != list and type(out_ax) != tuple:
+            raise TypeError('out_ax must be either a list or a tuple.')
+        if type(out_ax) == tuple and type(in_ax) == tuple:
+            raise TypeError('out_ax and in_ax cannot both be tuples')
+
+        if type(in_ax) == tuple and (not validate_iterrable_types(in_ax, list)\
+            or len(in_ax) != 2):
+                raise TypeError('If in_ax is a tuple, it must contain two '+\
+                    'lists.')
+        if type(out_ax) == tuple and \
+            (not validate_iterrable_types(out_ax, list) or len(out_ax) != 2):
+                raise TypeError('If out_ax is a tuple, it must contain two '+\
+                    'lists.')
+
+        if type(in_ax) == tuple and \
+            not validate_iterrable_types(in_ax[0], np.ndarray):
+                raise TypeError('If in_ax is a tuple, it must contain two '+\
+                    'lists, the first of which is a list of arrays.')
+        if type(in_ax) == tuple and \
+            not validate_iterrable_types(in_ax[1], tuple):
+                raise TypeError('If in_ax is a tuple, it must contain two '+\
+                    'lists, the second of which is a list of tuples.')
+
+        if type(out_ax) == tuple and \
+            not validate_iterrable_types(out_ax[0], np.ndarray):
+                raise TypeError('If out_ax is a tuple, it must contain two '+\
+                    'lists, the first of which is a list of arrays.')
+        if type(out_ax) == tuple and \
+            not validate_iterrable_types(out_ax[1], tuple):
+                raise TypeError('If out_ax is a tuple, it must contain two '+\
+                    'lists, the second of which is a list of tuples.')
+
+        if type(W) != int:
+            raise TypeError('W must be an integer.')
+        if type(alpha) != float and type(alpha) != int:
+            raise TypeError('alpha must be a float or int.')
+        if type(kernel_tol) != float and type(kernel_tol) != int:
+            raise TypeError('kernel_tol must be a float or int.')
+        if type(nthreads) != int or nthreads < 1:
+            raise TypeError('nthreads must be a positive integer.')
+        if type(deterministic) != bool:
+            raise TypeError('deterministic must be a boolean.')
+        if fft_backend is not None and type(fft_backend) != str:
+            raise TypeError('fft_backend must be a string.')
+        if precision != 'double' and precision != 'single':
+            raise TypeError("precision must be either 'double' or 'single'.")
+        if sort_samples is not None and sort_samples != 'tile' and \
+            sort_samples != 'morton':
+                raise TypeError("sort_samples must be None, 'tile' or "+\
+                    "'morton'.")
+        if out_of_core is not None and type(out_of_core) != str:
+            raise TypeError('out_of_core must be None or a directory name.')
+        if executor is not None and not isinstance(executor, GriddingPool):
+            raise TypeError('executor must be None or a GriddingPool.')
+        if executor is not None and out_of_core is not None:
+            raise TypeError('executor can not be combined with out_of_core.')
+        if batch_axes is not None and (type(batch_axes) != list or \
+            batch_axes != list(range(len(batch_axes)))):
+                raise TypeError('batch_axes must be None or a list of the '+\
+                    'leading axes, [0, 1, ...].')
+
+        if (type(ftmachine) != str and type(ftmachine) != list) or \
+            (type(ftmachine) == list and \
+            not validate_iterrable_types(ftmachine, str)):
+                raise TypeError('ftmachine must be a string or a list of '+\
+                    'strings.')
+
+        if (type(in_zero_center) != bool and type(in_zero_center) != list) or\
+            (type(in_zero_center) == list and \
+            not validate_iterrable_types(in_zero_center, bool)):
+                raise TypeError('in_zero_center must be a Bool or list of '+\
+                    'Bools.')
+
+        if (type(out_zero_center) != bool and type(out_zero_center) != list)\
+            or (type(out_zero_center) == list and \
+            not validate_iterrable_types(out_zero_center, bool)):
+                raise TypeError('out_zero_center must be a Bool or list of '+\
+                    'Bools.')
+
+        if (type(enforce_hermitian_symmetry) != bool and \
+            type(enforce_hermitian_symmetry) != list) or \
+            (type(enforce_hermitian_symmetry) == list and \
+            not validate_iterrable_types(enforce_hermitian_symmetry, bool)):
+                raise TypeError('enforce_hermitian_symmetry must be a Bool '\
+                    +'or list of Bools.')
+
+        ########################################################################
+        # figure out how many dimensions we are talking about, and what mode we
+        # want to use
+
+        N = 0 # number of dimensions
+        mode = -1
+
+        if len(in_ax) == 0:
+            # regular to regular transformation
+            mode = MODE_RR
+            if ndim is None:
+                raise TypeError('ndim must be given for a regular to '+\
+                    'regular transformation plan.')
+            N = ndim
+            if len(out_ax) != 0:
+                warnings.warn('in_ax is empty, indicating regular to regular '\
+                    +'transformation is requested, but out_ax is not empty. '+\
+                    'Ignoring out_ax and proceeding with regular to regular '+\
+                    'mode.')
+        elif type(in_ax)==tuple or type(out_ax)==tuple:
+            # irregular to irregular transformation
+            mode = MODE_II
+            if type(out_ax)==tuple:
+                if len(out_ax) != 2:
+                    raise TypeError('Invalid out_ax for '+\
+                        'irregular to irregular mode.')
+                N = len(in_ax)
             else:
-                pstr = pstr + 'False, '
-
-            if preshift_axes == None or preshift_axes.count(i)>0:
-                pstr = pstr + 'True, '
+                if len(in_ax) != 2:
+                    raise TypeError('Invalid in_ax for '+\
+                        'irregular to irregular mode.')
+                N = len(out_ax)
+        else:
+            if type(in_ax[0])==tuple:
+                # regular to irregular transformation
+                mode = MODE_RI
             else:
-                pstr = pstr + 'False, '
+                # irregular to regular transformation
+                mode = MODE_IR
+            N = len(in_ax)
+            if len(out_ax) != len(in_ax):
+                raise TypeError('For regular to irregular mode, len(in_ax) '+\
+                    'must equal len(out_ax).')
 
-            if postshift_axes == None or postshift_axes.count(i)>0:
-                pstr = pstr + 'True, '
-            else:
-                pstr = pstr + 'False, '
+        if N==0 or mode == -1:
+            raise Exception('Something went wrong in setting the mode and ' \
+                + 'dimensionality.')
 
-            if hermitianized_axes[i]:
-                pstr = pstr + 'True'
-            else:
-                pstr = pstr + 'False'
+        if N > gridding.MAX_DIMS and mode != MODE_RR:
+            raise Exception('Gridding has been requested for an unsupported '+\
+                'number of dimensions!')
 
-        print(pstr)
+        if verbose:
+            print('Requested mode = ' + mode_types[mode])
+            print("Number of dimensions = " + str(N))
+
+        ########################################################################
+        # Figure out which axes should have which transforms applied to them
+
+        # flags to determine whether I need to use fftn and/or ifftn
+        do_fft = False
+        do_ifft = False
+        # if you give an empty list to fftn in the axes position, nothing
+        # happens
+        fftaxes = []
+        ifftaxes = []
+
+        if type(ftmachine) == str:
+            if ftmachine.lower() == FTM_FFT:
+                do_fft = True
+                fftaxes = None
+            elif ftmachine.lower() == FTM_IFFT:
+                do_ifft = True
+                ifftaxes = None
+        elif type(ftmachine) == list:
+            if len(ftmachine) != N:
+                raise Exception('ftmachine is a list with invalid length')
+
+            for i in range(len(ftmachine)):
+                if ftmachine[i].lower() == FTM_FFT:
+                    do_fft = True
+                    fftaxes += [i]
+                elif ftmachine[i].lower() == FTM_IFFT:
+                    do_ifft = True
+                    ifftaxes += [i]
 
-    ############################################################################
-    # Do MODE_RR transform
+# As requested by Marco, if no FFT is requested, the function will still
+# perform a shift.
+        if (do_fft == False and do_ifft == False) or \
+            (fftaxes == [] and ifftaxes == []):
+                warnings.warn('No Fourier transformation requested, only '+\
+                    'shifting will be performed!')
+                mode = MODE_RR #Since gridding will not be needed, use RR mode
+
+        if out_of_core is not None and \
+            ((mode != MODE_IR and mode != MODE_RI) or N < 2):
+                raise Exception('out_of_core is only supported for '+\
+                    'irregular to regular and regular to irregular '+\
+                    'transformations of 2 or more dimensions.')
+
+        if batch_axes is not None and len(batch_axes) > 0 and \
+            mode != MODE_RR:
+                raise Exception('batch_axes is only supported for regular '+\
+                    'to regular transformations.')
+
+        ########################################################################
+        # figure out which axes need to be shifted (before and after FT)
+
+        do_preshift = False
+        do_postshift = False
+
+        preshift_axes = []
+        postshift_axes = []
+
+        if type(in_zero_center) == bool:
+            if in_zero_center:
+                do_preshift = True
+                preshift_axes = None
+        elif type(in_zero_center) == list:
+            if len(in_zero_center) != N:
+                raise Exception('in_zero_center is a list with invalid length')
+
+            for i in range(len(in_zero_center)):
+                if in_zero_center[i]:
+                    do_preshift = True
+                    preshift_axes += [i]
+
+        if type(out_zero_center) == bool:
+            if out_zero_center:
+                do_postshift = True
+                postshift_axes = None
+        elif type(out_zero_center) == list:
+            if len(out_zero_center) != N:
+                raise Exception('out_zero_center is a list with invalid '+\
+                    'length')
+
+            for i in range(len(out_zero_center)):
+                if out_zero_center[i]:
+                    do_postshift = True
+                    postshift_axes += [i]
+
+        ########################################################################
+        # figure out which axes need to be hermitianized
+
+        hermitianized_axes = []
+
+        if type(enforce_hermitian_symmetry) == bool:
+            if enforce_hermitian_symmetry:
+                for i in range(N):
+                    hermitianized_axes += [True]
+            else:
+                for i in range(N):
+                    hermitianized_axes += [False]
 
-    if mode == MODE_RR:
-        if do_preshift:
-            inp = np.fft.fftshift(inp, axes=preshift_axes)
+        elif type(enforce_hermitian_symmetry) == list:
+            if len(enforce_hermitian_symmetry) != N:
+                raise Exception('enforce_hermitian_symmetry is a list with '+\
+                    'invalid length')
 
-        if do_fft:
-            out = np.fft.fftn(inp, axes=fftaxes)
-        else:
-            out = inp.copy()
+            for i in range(len(enforce_hermitian_symmetry)):
+                if enforce_hermitian_symmetry[i]:
+                    hermitianized_axes += [True]
+                else:
+                    hermitianized_axes += [False]
 
-        if do_ifft:
-            out = np.fft.ifftn(out, axes=ifftaxes)
+        if len(hermitianized_axes) != N:
+            raise Exception('Something went wrong when setting up the '+\
+                'hermitianized_axes list!')
 
-        if do_postshift:
-            out = np.fft.fftshift(out, axes=postshift_axes)
+        ########################################################################
+        # Print operation summary
 
         if verbose:
-            print("Done!")
             print("")
+            print("Axis#, FFT, IFFT, ZCIN, ZCOUT, HERM")
 
-        return out
+            for i in range(N):
+                pstr = str(N)+', '
 
-    ############################################################################
-    # Do MODE_IR transform
+                if fftaxes == None or fftaxes.count(i)>0:
+                    pstr = pstr + 'True, '
+                else:
+                    pstr = pstr + 'False, '
+
+                if ifftaxes == None or ifftaxes.count(i)>0:
+                    pstr = pstr + 'True, '
+                else:
+                    pstr = pstr + 'False, '
 
-    elif mode == MODE_IR:
+                if preshift_axes == None or preshift_axes.count(i)>0:
+                    pstr = pstr + 'True, '
+                else:
+                    pstr = pstr + 'False, '
 
-        # all gridding code assumes the data array is complex
-        inp = np.array(inp, dtype=complex)
+                if postshift_axes == None or postshift_axes.count(i)>0:
+                    pstr = pstr + 'True, '
+                else:
+                    pstr = pstr + 'False, '
 
-        # grid
-        if N == 1:
-            dx = out_ax[0][0]
-            Nx = out_ax[0][1]
+                if hermitianized_axes[i]:
+                    pstr = pstr + 'True'
+                else:
+                    pstr = pstr + 'False'
+
+            print(pstr)
+
+        self.mode = mode
+        self.N = N
+        self.W = W
+        self.alpha = alpha
+        self.kernel_tol = kernel_tol
+        self.nthreads = nthreads
+        self.deterministic = deterministic
+        self.fft = get_fft_backend(fft_backend)
+        self.verbose = verbose
+
+        self.precision = precision
+        self.sort_samples = sort_samples
+        self.out_of_core = out_of_core
+        self.executor = executor
+        self.block_bytes = OUT_OF_CORE_BYTES
+        self.lost = {}
+        self.grid_perm = None
+        self.degrid_perm = None
+        if precision == 'single':
+            self.ctype = np.complex64
+            self.rtype = np.float32
+        else:
+            self.ctype = complex
+            self.rtype = float
+
+        self.do_fft = do_fft
+        self.do_ifft = do_ifft
+        # None means all axes, but the arrays may have trailing channel axes
+        # that must not be transformed, so the axes are always listed
+        if fftaxes == None:
+            fftaxes = list(range(N))
+        if ifftaxes == None:
+            ifftaxes = list(range(N))
+        if preshift_axes == None:
+            preshift_axes = list(range(N))
+        if postshift_axes == None:
+            postshift_axes = list(range(N))
+
+        # the arrays of a batched plan have the batch axes in front, so the
+        # axes of a regular to regular plan are counted after them
+        self.nbatch = 0
+        if batch_axes is not None:
+            self.nbatch = len(batch_axes)
+        if self.nbatch > 0:
+            fftaxes = [i + self.nbatch for i in fftaxes]
+            ifftaxes = [i + self.nbatch for i in ifftaxes]
+            preshift_axes = [i + self.nbatch for i in preshift_axes]
+            postshift_axes = [i + self.nbatch for i in postshift_axes]
+
+        self.fftaxes = fftaxes
+        self.ifftaxes = ifftaxes
+
+        self.do_preshift = do_preshift
+        self.do_postshift = do_postshift
+        self.preshift_axes = preshift_axes
+        self.postshift_axes = postshift_axes
+
+        self.hermitianized_axes = hermitianized_axes
+
+        ########################################################################
+        # Precompute the grids, kernels and grid corrections
+
+        if mode == MODE_IR:
+            self._setup_IR(in_ax, out_ax)
+        elif mode == MODE_RI:
+            self._setup_RI(in_ax, out_ax)
+        elif mode == MODE_II:
+            self._setup_II(in_ax, out_ax)
+
+
+    def _preshifted(self, i):
+        """
+        Returns True if axis i is zero centered on input.
+        """
+        return self.do_preshift and \
+            (self.preshift_axes == None or self.preshift_axes.count(i) > 0)
+
+    def _postshifted(self, i):
+        """
+        Returns True if axis i is zero centered on output.
+        """
+        return self.do_postshift and \
+            (self.postshift_axes == None or self.postshift_axes.count(i) > 0)
+
+    def _setup_IR(self, in_ax, out_ax):
+
+        alpha = self.alpha
+
+        self.grid_shape = []
+        self.grid_min = []
+        self.grid_d = []
+        self.grid_rolls = []
+        crop = []
+
+        xd = []
+        xn = []
+        xmins = []
+
+        for i in range(self.N):
+            dx = out_ax[i][0]
+            Nx = out_ax[i][1]
             xmin = 0.
-            if do_postshift:
+            if self._postshifted(i):
                 xmin = -0.5*Nx*dx
             du = 1./dx/Nx/alpha
             Nu = int(alpha*Nx)
             umin = 0.
-            if do_preshift:
+            if self._preshifted(i):
                 umin = -0.5*Nu*du
 
-            inp_grid = gridding.grid_1d(in_ax[0], inp, du, Nu, umin, alpha, W, \
-                hermitianized_axes[0])
-
-        elif N == 2:
-            dx = out_ax[0][0]
-            Nx = out_ax[0][1]
+            # the fftshifts are folded into the gridding (which fills the
+            # grid rolled by Nu//2 directly) and into the cropping indices
+            roll = 0
+            if self._preshifted(i):
+                roll = Nu//2
+
+            xndx = np.arange(Nx)
+            if self._postshifted(i):
+                xndx = (xndx + int(0.5*Nx*(alpha-1)) - Nu//2) % Nu
+
+            self.grid_shape += [Nu]
+            self.grid_min += [umin]
+            self.grid_d += [du]
+            self.grid_rolls += [roll]
+            crop += [xndx]
+
+            xd += [dx]
+            xn += [Nx]
+            xmins += [xmin]
+
+        self.nvis = len(in_ax[0])
+        self.grid_kernels, self.grid_perm = self._sort_kernels(\
+            self._get_kernels(in_ax, self.grid_d, self.grid_min), \
+            self.grid_shape, self.grid_rolls)
+        self.gc = self._get_grid_corr(xd, xn, xmins, self.grid_d)
+
+        # With Hermitian symmetry along all axes the output is real, and only
+        # half of the grid is needed. This requires zero centered grids of
+        # even length, for which the mirror of the grid cell stored at
+        # position k is stored at -k (mirrors falling off non zero centered
+        # grids are dropped). The transform is then done with irfftn, using
+        # FFT(g)[x] = n*IFFT(g)[-x] along the FFT axes.
+        self.real = True
+        for i in range(self.N):
+            if not self.hermitianized_axes[i] or not self._preshifted(i) or \
+                self.grid_shape[i] % 2 != 0 or \
+                not ((self.do_fft and self.fftaxes.count(i) > 0) or \
+                (self.do_ifft and self.ifftaxes.count(i) > 0)):
+                    self.real = False
+
+        if self.real and self.do_fft:
+            scale = 1.
+            for i in self.fftaxes:
+                crop[i] = (-crop[i]) % self.grid_shape[i]
+                scale *= self.grid_shape[i]
+            self.gc[0] = (self.gc[0]/scale).astype(self.rtype)
+
+        self.out_shape = tuple(xn)
+        self.crop = index_blocks(crop)
+
+    def _setup_RI(self, in_ax, out_ax):
+
+        alpha = self.alpha
+
+        self.degrid_shape = []
+        self.degrid_min = []
+        self.degrid_d = []
+        self.degrid_rolls = []
+        pad = []
+
+        xd = []
+        xn = []
+        xmins = []
+
+        for i in range(self.N):
+            dx = in_ax[i][0]
+            Nx = in_ax[i][1]
             xmin = 0.
+            if self._preshifted(i):
+                xmin = -0.5*Nx*dx
             du = 1./dx/Nx/alpha
             Nu = int(alpha*Nx)
             umin = 0.
+            if self._postshifted(i):
+                umin = -0.5*Nu*du
 
-            dy = out_ax[1][0]
-            Ny = out_ax[1][1]
-            ymin = 0.
-            dv = 1./dy/Ny/alpha
-            Nv = int(alpha*Ny)
-            vmin = 0.
-
-            if do_preshift:
-                if preshift_axes == None: #shift all axes
-                    vmin = -0.5*Nv*dv
-                    umin = -0.5*Nu*du
-                else: #only shift some axes...
-                    if preshift_axes.count(1) > 0:
-                        vmin = -0.5*Nv*dv
-                    if preshift_axes.count(0) > 0:
-                        umin = -0.5*Nu*du
-            if do_postshift:
-                if postshift_axes == None: #shift all axes
-                    xmin = -0.5*Nx*dx
-                    ymin = -0.5*Ny*dy
-                else: #only shift some axes...
-                    if postshift_axes.count(1) > 0:
-                        ymin = -0.5*Ny*dy
-                    if postshift_axes.count(0) > 0:
-                        xmin = -0.5*Nx*dx
-
-            inp_grid = gridding.grid_2d(in_ax[0], in_ax[1], inp, du, Nu, umin, \
-                dv, Nv, vmin, alpha, W, \
-                hermitianized_axes[0], hermitianized_axes[1])
-
-
-        elif N == 3:
-            dx = out_ax[0][0]
-            Nx = out_ax[0][1]
-            xmin = 0.
+            # the fftshifts are folded into the padding indices and into the
+            # degridding (which reads the FFT output rolled by -(Nu//2))
+            xndx = np.arange(Nx)
+            if self._preshifted(i):
+                xndx = (xndx + int(0.5*Nx*(alpha-1)) + Nu//2) % Nu
+
+            roll = 0
+            if self._postshifted(i):
+                roll = -(Nu//2)
+
+            self.degrid_shape += [Nu]
+            self.degrid_min += [umin]
+            self.degrid_d += [du]
+            self.degrid_rolls += [roll]
+            pad += [xndx]
+
+            xd += [dx]
+            xn += [Nx]
+            xmins += [xmin]
+
+        self.pad = [(s, d) for d, s in index_blocks(pad)]
+        self.in_shape = tuple(xn)
+        self.degrid_kernels, self.degrid_perm = self._sort_kernels(\
+            self._get_kernels(out_ax, self.degrid_d, self.degrid_min), \
+            self.degrid_shape, self.degrid_rolls)
+        self.gc = self._get_grid_corr(xd, xn, xmins, self.degrid_d)
+
+    def _setup_II(self, in_ax, out_ax):
+
+        #defining the grids
+        if type(in_ax) == tuple:
+            raise Exception("Defining grid on in_ax in MODE_II not yet "\
+                +"supported...")
+
+        alpha = self.alpha
+
+        self.grid_shape = []
+        self.grid_min = []
+        self.grid_d = []
+        self.grid_rolls = None
+        pad = []
+
+        self.degrid_shape = []
+        self.degrid_min = []
+        self.degrid_d = []
+        self.degrid_rolls = []
+
+        dxa = []
+
+        for i in range(self.N):
+            dx = out_ax[1][i][0]
+            Nx = out_ax[1][i][1]
             du = 1./dx/Nx/alpha
             Nu = int(alpha*Nx)
             umin = 0.
+            if self._preshifted(i):
+                umin = -0.5*Nu*du
 
-            dy = out_ax[1][0]
-            Ny = out_ax[1][1]
-            ymin = 0.
-            dv = 1./dy/Ny/alpha
-            Nv = int(alpha*Ny)
-            vmin = 0.
-
-            dz = out_ax[2][0]
-            Nz = out_ax[2][1]
-            zmin = 0.
-            dw = 1./dz/Nz/alpha
-            Nw = int(alpha*Nz)
-            wmin = 0.
-
-
-            if do_preshift:
-                if preshift_axes == None:
-                    vmin = -0.5*Nv*dv
-                    umin = -0.5*Nu*du
-                    wmin = -0.5*Nw*dw
-                else:
-                    if preshift_axes.count(1) > 0:
-                        vmin = -0.5*Nv*dv
-                    if preshift_axes.count(0) > 0:
-                        umin = -0.5*Nu*du
-                    if preshift_axes.count(2) > 0:
-                        wmin = -0.5*Nw*dw
-            if do_postshift:
-                if postshift_axes == None:
-                    xmin = -0.5*Nx*dx
-                    ymin = -0.5*Ny*dy
-                    zmin = -0.5*Nz*dz
-                else:
-                    if postshift_axes.count(1) > 0:
-                        ymin = -0.5*Ny*dy
-                    if postshift_axes.count(0) > 0:
-                        xmin = -0.5*Nx*dx
-                    if postshift_axes.count(2) > 0:
-                        zmin = -0.5*Nz*dz
-
-            inp_grid = gridding.grid_3d(in_ax[0], in_ax[1], in_ax[2], inp, \
-                du, Nu, umin, dv, Nv, vmin, dw, Nw, wmin, alpha, W, \
-                hermitianized_axes[0], hermitianized_axes[1], \
-                hermitianized_axes[2])
-
-        if do_preshift:
-            inp_grid = np.fft.fftshift(inp_grid, axes=preshift_axes)
-
-        if do_fft:
-            out = np.fft.fftn(inp_grid, axes=fftaxes)
+            # the grid is zero padded by another factor alpha before the FFT,
+            # so that the FFT output can be degridded. The fftshifts are
+            # folded into the padding indices and the degridding.
+            Nup = int(alpha*Nu)
+            undx = np.arange(Nu)
+            if self._preshifted(i):
+                undx = (undx + int(0.5*Nu*(alpha-1.)) + Nup//2) % Nup
+
+            roll = 0
+            if self._postshifted(i):
+                roll = -(Nup//2)
+
+            dxp = 1./du/Nup
+            xmin = 0.
+            if self._postshifted(i):
+                xmin = -0.5*Nup*dxp
+
+            self.grid_shape += [Nu]
+            self.grid_min += [umin]
+            self.grid_d += [du]
+            pad += [undx]
+
+            self.degrid_shape += [Nup]
+            self.degrid_min += [xmin]
+            self.degrid_d += [dxp]
+            self.degrid_rolls += [roll]
+
+            dxa += [dx/alpha]
+
+        self.pad = [(s, d) for d, s in index_blocks(pad)]
+        self.nvis = len(in_ax[0])
+        self.grid_kernels, self.grid_perm = self._sort_kernels(\
+            self._get_kernels(in_ax, self.grid_d, self.grid_min), \
+            self.grid_shape, self.grid_rolls)
+        self.degrid_kernels, self.degrid_perm = self._sort_kernels(\
+            self._get_kernels(out_ax[0], self.degrid_d, self.degrid_min), \
+            self.degrid_shape, self.degrid_rolls)
+
+        # degrid correct (applied on the u grid) and grid correct (applied at
+        # the output coordinates, after degridding)
+        self.gc_in = self._get_grid_corr(self.grid_d, self.grid_shape, \
+            self.grid_min, dxa)
+        self.gc = 1.
+        for i in range(self.N):
+            self.gc = self.gc*gridding.get_grid_corr_points(\
+                np.array(out_ax[0][i], dtype=float), self.grid_d[i], self.W, \
+                self.alpha)
+        self.gc = self.gc.astype(self.rtype)
+
+    def _get_kernels(self, ax, d, amin):
+        """
+        Precomputes the gridding kernel indices and weights for each axis.
+        """
+        kernels = []
+        for i in range(self.N):
+            kernels += [gridding.get_gcf(np.array(ax[i], dtype=float), \
+                d[i], amin[i], self.alpha, self.W, self.kernel_tol)]
+        return kernels
+
+    def _sort_kernels(self, kernels, shape, rolls):
+        """
+        Reorders the samples of the precomputed kernels as requested by
+        sort_samples. Returns the kernels and the permutation applied to the
+        samples (None if they are not reordered).
+        """
+        if self.sort_samples is None:
+            return kernels, None
+        perm = gridding.get_sample_order(kernels, list(shape), rolls, \
+            self.sort_samples)
+        return [(ndx[perm], gcf[perm]) for ndx, gcf in kernels], perm
+
+    def _get_grid_corr(self, xd, xn, xmins, kd):
+        """
+        The grid correction is separable, so it is kept as one 1-D array per
+        axis, each shaped to broadcast along its own axis.
+        """
+        gc = []
+        for i in range(self.N):
+            shape = [1]*self.N
+            shape[i] = xn[i]
+            gc += [gridding.get_grid_corr_1d(xd[i], xn[i], xmins[i], kd[i], \
+                self.W, self.alpha).reshape(shape).astype(self.rtype)]
+        return gc
+
+    def _grid_correct(self, arr, gc, copy=False):
+        """
+        Divides arr by the separable grid correction gc, in place unless copy
+        is set. Any axes of arr after the first N are channels.
+        """
+        extra = (1,)*(arr.ndim - self.N)
+        for g in gc:
+            g = g.reshape(g.shape + extra)
+            if copy:
+                arr = arr/g
+                copy = False
+            else:
+                arr /= g
+        return arr
+
+    def _buffer(self, workspace, name, shape, dtype):
+        return work_array(self.fft, workspace, name, shape, dtype)
+
+    def _result(self, out, shape, dtype):
+        return result_array(out, shape, dtype)
+
+    def _grid(self, inp, workspace=None, stats=None):
+
+        half = self.mode == MODE_IR and self.real
+
+        if self.grid_perm is not None:
+            inp = np.take(inp, self.grid_perm, axis=0, out=\
+                None if workspace is None else \
+                self._buffer(workspace, 'sorted_in', inp.shape, inp.dtype))
+
+        if self.out_of_core is not None:
+            return self._grid_slabs(inp, workspace, stats)
+
+        shape = list(self.grid_shape)
+        if half:
+            shape[-1] = shape[-1]//2 + 1
+        shape = tuple(shape) + inp.shape[1:]
+
+        grid = None
+        if workspace is not None:
+            grid = self._buffer(workspace, 'grid', shape, self.ctype)
+
+        t = _now(stats)
+        if self.executor is not None:
+            if grid is None:
+                grid = np.empty(shape, dtype=self.ctype)
+            grid = self.executor.grid(grid, self.grid_kernels, inp, \
+                self.grid_shape, self.grid_min, self.grid_d, \
+                self.hermitianized_axes, self.grid_rolls, self.nthreads, \
+                self.deterministic)
         else:
-            out = inp_grid.copy()
+            grid = gridding.grid_nd_gcf(self.grid_kernels, inp, \
+                self.grid_shape, self.grid_min, self.grid_d, \
+                self.hermitianized_axes, self.nthreads, \
+                self.deterministic, self.grid_rolls, half, grid, workspace)
+        _tick(stats, 'gridding', t)
 
-        if do_ifft:
-            out = np.fft.ifftn(out, axes=ifftaxes)
+        return grid
 
-        # shift
-        if do_postshift:
-            out = np.fft.fftshift(out, axes=postshift_axes)
+    def _degrid(self, regVis, out=None, workspace=None):
 
-        # crop & grid correct
-        if N == 1:
-            tndxx = int(0.5*Nx*(alpha-1))
-            if do_postshift:
-                out = out[tndxx:tndxx+Nx]
+        if self.degrid_perm is None:
+            return self._sample(regVis, out)
+
+        # degrid in the sorted order, then put the samples back in order
+        vis = None
+        if workspace is not None:
+            vis = self._buffer(workspace, 'sorted_out', \
+                (len(self.degrid_perm),) + regVis.shape[self.N:], self.ctype)
+        vis = self._sample(regVis, vis)
+
+        out = self._result(out, vis.shape, vis.dtype)
+        out[self.degrid_perm] = vis
+
+        return out
+
+    def _sample(self, regVis, out=None):
+        """
+        Degrids regVis, in the order of the degridding kernels. An out of core
+        grid is degridded one slab at a time.
+        """
+        if self.out_of_core is None:
+            return gridding.degrid_nd_gcf(self.degrid_kernels, regVis, \
+                self.nthreads, self.degrid_rolls, out)
+
+        n = self.degrid_shape[0]
+        kernels = self.degrid_kernels
+        roll = self.degrid_rolls[0]
+        rolls = list(self.degrid_rolls)
+        find = slab_samples(kernels[0][0], kernels[0][1].shape[1], n, roll)
+
+        out = self._result(out, (len(kernels[0][0]),) + \
+            regVis.shape[self.N:], regVis.dtype)
+        out.fill(0)
+        for a, b in slab_ranges(n, regVis.nbytes//n, self.block_bytes):
+            k = find(a, b)
+            if len(k) == 0:
+                continue
+            # the slab is the grid rolled by a further -a, cut off at b-a
+            rolls[0] = roll - a
+            out[k] += gridding.degrid_nd_gcf([(ndx[k], gcf[k]) for ndx, gcf \
+                in kernels], np.array(regVis[a:b]), self.nthreads, rolls, \
+                None, list(self.degrid_shape))
+
+        return out
+
+    def _correct_block(self, view, gc, ndx):
+        """
+        Divides view, the block ndx (a tuple of slices) of an array on which
+        the separable grid correction gc is defined, by gc.
+        """
+        extra = (1,)*(view.ndim - self.N)
+        for i in range(self.N):
+            sl = [slice(None)]*self.N
+            sl[i] = ndx[i]
+            g = gc[i][tuple(sl)]
+            view /= g.reshape(g.shape + extra)
+
+    def _pad(self, inp, gc, workspace=None):
+        """
+        Zero pads inp onto the (rolled) grid to be degridded, dividing it by
+        the separable grid correction gc (defined on inp) on the way.
+        """
+        grid = self._buffer(workspace, 'pad', tuple(self.degrid_shape) + \
+            inp.shape[self.N:], self.ctype)
+        grid.fill(0)
+
+        for dst, src in self.pad:
+            view = grid[dst]
+            view[...] = inp[src]
+            self._correct_block(view, gc, src)
+
+        return grid
+
+    def _fft_along(self, inp, axes):
+        """
+        As _fft, but only along those of axes that are transformed, and always
+        in place if the backend allows it.
+        """
+        if self.do_fft:
+            fftaxes = [i for i in self.fftaxes if axes.count(i) > 0]
+            if len(fftaxes) > 0:
+                inp = self.fft.fftn(inp, fftaxes, True, self.nthreads)
+
+        if self.do_ifft:
+            ifftaxes = [i for i in self.ifftaxes if axes.count(i) > 0]
+            if len(ifftaxes) > 0:
+                inp = self.fft.ifftn(inp, ifftaxes, True, self.nthreads)
+
+        return inp
+
+    ############################################################################
+    # Out of core grids
+
+    def _grid_slabs(self, inp, workspace=None, stats=None):
+        """
+        Grids inp onto an out of core grid (see out_of_core) and returns it.
+        Each slab of the grid is gridded in memory, from the samples whose
+        kernels (or their mirrors) reach it, and then written out.
+        """
+        t = _now(stats)
+
+        shape = list(self.grid_shape)
+        if self.real:
+            shape[-1] = shape[-1]//2 + 1
+        shape = tuple(shape) + inp.shape[1:]
+        grid = scratch_array(self.out_of_core, workspace, 'ooc_grid', shape, \
+            self.ctype)
+
+        n = self.grid_shape[0]
+        kernels = self.grid_kernels
+        rolls = list(self.grid_rolls)
+        roll = rolls[0]
+        mirror = None
+        if self.hermitianized_axes[0]:
+            mirror = int(np.floor(-2.*self.grid_min[0]/self.grid_d[0] + 0.5))
+        find = slab_samples(kernels[0][0], kernels[0][1].shape[1], n, roll, \
+            mirror)
+
+        for a, b in slab_ranges(n, grid.nbytes//n, self.block_bytes):
+            slab = np.zeros((b - a,) + shape[1:], dtype=self.ctype)
+            k = find(a, b)
+            if len(k) > 0:
+                # the slab is the grid rolled by a further -a, cut off at b-a
+                rolls[0] = roll - a
+                gridding.add_nd_gcf(slab, [(ndx[k], gcf[k]) for ndx, gcf in \
+                    kernels], inp[k], self.grid_shape, self.grid_min, \
+                    self.grid_d, self.hermitianized_axes, self.nthreads, \
+                    self.deterministic, rolls, workspace)
+            grid[a:b] = slab
+        _tick(stats, 'gridding', t)
+
+        return grid
+
+    def _fft_pencils(self, grid, real=False):
+        """
+        Transforms grid in place along its first axis, one block of pencils at
+        a time. If real, this is the IFFT (see _finish_slabs).
+        """
+        if not real and not ((self.do_fft and self.fftaxes.count(0) > 0) or \
+            (self.do_ifft and self.ifftaxes.count(0) > 0)):
+                return
+
+        m = grid.shape[1]
+        for j0, j1 in slab_ranges(m, grid.nbytes//m, self.block_bytes):
+            pencils = np.array(grid[:, j0:j1])
+            if real:
+                pencils = self.fft.ifftn(pencils, [0], True, self.nthreads)
             else:
-                out = out[0:Nx]
-            gc = gridding.get_grid_corr_1d(dx, Nx, xmin, du, W, alpha)
-
-        elif N == 2:
-            tndxx = int(0.5*Nx*(alpha-1))
-            tndxy = int(0.5*Ny*(alpha-1))
-            xl = 0
-            yl = 0
-
-            if do_postshift:
-                if postshift_axes == None:
-                    xl = tndxx
-                    yl = tndxy
-                else:
-                    if postshift_axes.count(0)>0:
-                        xl = tndxx
-                    if postshift_axes.count(1)>0:
-                        yl = tndxy
-
-            out = out[int(xl):int(xl+Nx), int(yl):int(yl+Ny)]
-            gc = gridding.get_grid_corr_2d(dx, Nx, xmin, dy, Ny, ymin, \
-                du, dv, W, alpha)
-
-        elif N == 3:
-            tndxx = int(0.5*Nx*(alpha-1))
-            tndxy = int(0.5*Ny*(alpha-1))
-            tndxz = int(0.5*Nz*(alpha-1))
-            xl = 0
-            yl = 0
-            zl = 0
-
-            if do_postshift:
-                if postshift_axes == None:
-                    xl = tndxx
-                    yl = tndxy
-                    zl = tndxz
+                pencils = self._fft_along(pencils, [0])
+            grid[:, j0:j1] = pencils
+
+    def _finish_slabs(self, grid, out=None, workspace=None, stats=None):
+        """
+        finish_grid for an out of core grid. The grid is transformed along
+        the first axis a block of pencils at a time, and then along the other
+        axes a slab at a time, each slab being cropped and grid corrected
+        into out straight away. The complex to real FFT along all axes of a
+        real transform is split the same way.
+        """
+        t = _now(stats)
+
+        self._fft_pencils(grid, self.real)
+        t = _tick(stats, 'fft', t)
+
+        n = self.grid_shape[0]
+        rest = list(range(1, self.N))
+        out = self._result(out, self.out_shape + grid.shape[self.N:], \
+            self.rtype if self.real else self.ctype)
+
+        for a, b in slab_ranges(n, grid.nbytes//n, self.block_bytes):
+            slab = np.array(grid[a:b])
+            if self.real:
+                slab = self.fft.irfftn(slab, self.grid_shape[1:], rest, \
+                    True, self.nthreads)
+            else:
+                slab = self._fft_along(slab, rest)
+            t = _tick(stats, 'fft', t)
+
+            for dst, src in slab_blocks(self.crop, 1, n, a, b):
+                view = out[dst]
+                view[...] = slab[src]
+                t = _tick(stats, 'crop', t)
+                self._correct_block(view, self.gc, dst)
+                t = _tick(stats, 'correction', t)
+
+        return out
+
+    def _pad_slabs(self, inp, workspace=None, stats=None):
+        """
+        Zero pads inp onto an out of core grid, dividing it by the grid
+        correction, and transforms it, a slab at a time along all but the
+        first axis and then a block of pencils at a time along the first.
+        """
+        t = _now(stats)
+
+        n = self.degrid_shape[0]
+        rest = list(range(1, self.N))
+        shape = tuple(self.degrid_shape) + inp.shape[self.N:]
+        grid = scratch_array(self.out_of_core, workspace, 'ooc_grid', shape, \
+            self.ctype)
+
+        for a, b in slab_ranges(n, grid.nbytes//n, self.block_bytes):
+            slab = np.zeros((b - a,) + shape[1:], dtype=self.ctype)
+            for dst, src in slab_blocks(self.pad, 0, n, a, b):
+                view = slab[dst]
+                view[...] = inp[src]
+                self._correct_block(view, self.gc, src)
+            t = _tick(stats, 'correction', t)
+            grid[a:b] = self._fft_along(slab, rest)
+            t = _tick(stats, 'fft', t)
+
+        self._fft_pencils(grid)
+        _tick(stats, 'fft', t)
+
+        return grid
+
+    def _fft(self, inp, overwrite=False):
+        """
+        Performs the FFT/IFFT (without any shifts) on a regular array. If
+        overwrite is True, inp is a temporary array that may be transformed in
+        place.
+        """
+        out = inp
+
+        if self.do_fft:
+            out = self.fft.fftn(out, self.fftaxes, overwrite, self.nthreads)
+            overwrite = True
+
+        if self.do_ifft:
+            out = self.fft.ifftn(out, self.ifftaxes, overwrite, self.nthreads)
+            overwrite = True
+
+        if not overwrite:
+            out = out.copy()
+
+        return out
+
+    def _transform(self, inp, out=None, workspace=None, stats=None):
+        """
+        Performs the shift, FFT/IFFT, shift sequence on a regular array. The
+        shift after the transform along a transformed axis of even length is
+        done by multiplying the input by (-1)^k along that axis instead, which
+        avoids copying the output. The shift before the transform is done
+        while copying inp to the (work) array that is transformed in place.
+        """
+        t = _now(stats)
+
+        if self.precision == 'single':
+            dtype = self.ctype
+        else:
+            dtype = np.result_type(inp.dtype, np.complex64)
+        buf = self._buffer(workspace, 'rr', inp.shape, dtype)
+
+        if self.do_preshift:
+            copy_blocks(buf, inp, fftshift_blocks(inp.shape, \
+                self.preshift_axes))
+        else:
+            buf[...] = inp
+
+        modulated = []
+        postshift_axes = []
+        if self.do_postshift:
+            for i in self.postshift_axes:
+                if inp.shape[i] % 2 == 0 and \
+                    ((self.do_fft and self.fftaxes.count(i) > 0) or \
+                    (self.do_ifft and self.ifftaxes.count(i) > 0)):
+                        modulated += [i]
                 else:
-                    if postshift_axes.count(0)>0:
-                        xl = tndxx
-                    if postshift_axes.count(1)>0:
-                        yl = tndxy
-                    if postshift_axes.count(2)>0:
-                        zl = tndxz
+                    postshift_axes += [i]
+
+        for i in modulated:
+            odd = [slice(None)]*inp.ndim
+            odd[i] = slice(1, None, 2)
+            buf[tuple(odd)] *= -1
+        t = _tick(stats, 'shift', t)
+
+        res = self._fft(buf, overwrite=True)
+        t = _tick(stats, 'fft', t)
+
+        if len(postshift_axes) > 0:
+            out = self._result(out, res.shape, res.dtype)
+            copy_blocks(out, res, fftshift_blocks(res.shape, postshift_axes))
+        elif out is not None:
+            self._result(out, res.shape, res.dtype)[...] = res
+        elif workspace is not None and res is buf:
+            # never return an array that the next call will overwrite
+            out = res.copy()
+        else:
+            out = res
+        _tick(stats, 'shift', t)
 
-            out = out[xl:xl+Nx, yl:yl+Ny, zl:zl+Nz]
-            gc = gridding.get_grid_corr_3d(dx, Nx, xmin, dy, Ny, ymin, \
-                dz, Nz, zmin, du, dv, dw, W, alpha)
+        return out
 
-        if verbose:
+    def execute(self, inp, out=None, workspace=None, weights=None, \
+        psf=False, stats=None):
+        """
+        Transforms inp using the precomputed plan. inp must be defined on the
+        input axes that were used to create the plan.
+
+        If out is given, the result is written to it (and out is returned).
+        It must have the shape of the result, and, for irregularly spaced
+        output, its dtype. workspace may be a dict, in which the work arrays
+        (grids and FFT buffers) are kept for reuse, so that transforming
+        further arrays of the same shape with the same dict does not allocate
+        any new large arrays.
+
+        weights, psf and stats are as for gfft. With psf=True, a tuple (out,
+        psf) is returned, and out may be a tuple of two arrays to write them
+        to.
+        """
+
+        if stats is None:
+            return self._execute(inp, out, workspace, weights, psf)
+
+        check_stats(stats)
+
+        # The work arrays are always kept in a workspace, so that the new ones
+        # can be counted.
+        rec = self.new_stats()
+        t0 = time.perf_counter()
+        if workspace is None:
+            ws = {}
+        elif type(workspace) != dict:
+            raise TypeError('workspace must be a dict.')
+        else:
+            ws = workspace
+        before = dict(ws)
+
+        res = self._execute(inp, out, ws, weights, psf, rec)
+
+        rec['total'] = time.perf_counter() - t0
+        given = out if type(out) == tuple else (out,)
+        for arr in (res if type(res) == tuple else (res,)):
+            if not any([arr is a for a in given]):
+                rec['bytes_allocated'] += arr.nbytes
+        for name, arr in ws.items():
+            if before.get(name) is not arr:
+                rec['bytes_allocated'] += arr.nbytes
+
+        if self.mode != MODE_RR:
+            rec['nchan'] = int(np.prod(inp.shape[1:] if self.mode != \
+                MODE_RI else inp.shape[self.N:]))
+        if self.mode == MODE_IR or self.mode == MODE_II:
+            rec['nvis_in'] = self.nvis
+            rec['grid_clipped'], rec['grid_dropped'] = self._lost_samples(\
+                'grid')
+        if self.mode == MODE_RI or self.mode == MODE_II:
+            rec['nvis_out'] = len(self.degrid_kernels[0][0])
+            rec['degrid_clipped'], rec['degrid_dropped'] = \
+                self._lost_samples('degrid')
+
+        report_stats(stats, rec)
+
+        return res
+
+    def new_stats(self):
+        """
+        Returns an empty stats dict for this plan (see the stats argument of
+        gfft), e.g. to pass to add_to_grid and finish_grid.
+        """
+        return {'mode':mode_types[self.mode], 'times':{}, 'total':0., \
+            'bytes_allocated':0}
+
+    def _lost_samples(self, which):
+        """
+        The numbers of samples whose gridding (which='grid') or degridding
+        kernel lies partly and entirely outside the grid, computed once.
+        """
+        if which not in self.lost:
+            if which == 'grid':
+                kernels, shape = self.grid_kernels, self.grid_shape
+            else:
+                kernels, shape = self.degrid_kernels, self.degrid_shape
+            self.lost[which] = lost_samples(kernels, shape)
+        return self.lost[which]
+
+    def _execute(self, inp, out, workspace, weights, psf, stats=None):
+
+        t = _now(stats)
+
+        if type(inp) != np.ndarray:
+            raise TypeError('inp must be a numpy array.')
+        if workspace is not None and type(workspace) != dict:
+            raise TypeError('workspace must be a dict.')
+        if weights is not None:
+            if self.mode != MODE_IR and self.mode != MODE_II:
+                raise Exception('weights can only be given for irregularly '+\
+                    'spaced input.')
+            weights = np.asarray(weights)
+            if weights.shape != (self.nvis,) or np.iscomplexobj(weights):
+                raise TypeError('weights must be a real array with one '+\
+                    'weight per sample.')
+        if psf:
+            if self.mode != MODE_IR:
+                raise Exception('psf is only available for irregular to '+\
+                    'regular plans.')
+            if out is not None and (type(out) != tuple or len(out) != 2):
+                raise TypeError('out must be a tuple of two numpy arrays.')
+            return self._execute_psf(inp, out, workspace, weights, stats, t)
+        if out is not None and type(out) != np.ndarray:
+            raise TypeError('out must be a numpy array.')
+
+        if self.mode == MODE_RR:
+            if inp.ndim < self.nbatch + self.N:
+                raise Exception('inp has an invalid shape for this plan.')
+            t = _tick(stats, 'validation', t)
+            out = self._transform(inp, out, workspace, stats)
+
+        elif self.mode == MODE_IR:
+            if inp.shape[:1] != (self.nvis,) or inp.ndim > 2:
+                raise Exception('inp has an invalid shape for this plan.')
+
+            # all gridding code assumes the data array is complex
+            inp = self._weighted(inp, weights, workspace)
+            t = _tick(stats, 'validation', t)
+
+            out = self.finish_grid(self._grid(inp, workspace, stats), out, \
+                workspace, stats)
+
+        elif self.mode == MODE_RI:
+            if inp.shape[:self.N] != self.in_shape or inp.ndim > self.N + 1:
+                raise Exception('inp has an invalid shape for this plan.')
+            t = _tick(stats, 'validation', t)
+
+            if self.out_of_core is None:
+                # degrid correct & enlargement
+                grid = self._pad(inp, self.gc, workspace)
+                t = _tick(stats, 'correction', t)
+
+                grid = self._fft(grid, overwrite=True)
+                t = _tick(stats, 'fft', t)
+            else:
+                grid = self._pad_slabs(inp, workspace, stats)
+                t = _now(stats)
+
+            out = self._degrid(grid, out, workspace)
+            t = _tick(stats, 'degridding', t)
+
+        elif self.mode == MODE_II:
+            if inp.shape[:1] != (self.nvis,) or inp.ndim > 2:
+                raise Exception('inp has an invalid shape for this plan.')
+
+            # all gridding code assumes the data array is complex
+            inp = self._weighted(inp, weights, workspace)
+            t = _tick(stats, 'validation', t)
+
+            # grid, degrid correct & enlargement
+            grid = self._grid(inp, workspace, stats)
+            t = _now(stats)
+            grid = self._pad(grid, self.gc_in, workspace)
+            t = _tick(stats, 'correction', t)
+
+            # fft, degrid & grid correct
+            grid = self._fft(grid, overwrite=True)
+            t = _tick(stats, 'fft', t)
+            out = self._degrid(grid, out, workspace)
+            t = _tick(stats, 'degridding', t)
+            out /= self.gc.reshape(self.gc.shape + (1,)*(inp.ndim - 1))
+            t = _tick(stats, 'correction', t)
+
+        if self.verbose:
             print("Done!")
             print("")
 
-        return out/gc
+        return out
 
-    ############################################################################
-    # Do MODE_RI transform
+    def _weighted(self, inp, weights, workspace=None):
+        """
+        Returns the irregularly spaced inp as the complex data type of the
+        plan, multiplied by weights if given.
+        """
+        if weights is None:
+            return np.asarray(inp, dtype=self.ctype)
+        w = weights.reshape((self.nvis,) + (1,)*(inp.ndim - 1))
+        if workspace is None:
+            return np.multiply(inp, w, dtype=self.ctype)
+        return np.multiply(inp, w, dtype=self.ctype, out=self._buffer(\
+            workspace, 'weighted', inp.shape, self.ctype))
+
+    def _execute_psf(self, inp, out, workspace, weights, stats=None, t=None):
+        """
+        Grids the weighted data and the weights as one set of channels, so
+        that the kernels are evaluated once per sample and both grids are
+        transformed by one batched FFT, and splits the result.
+        """
+        if inp.shape[:1] != (self.nvis,) or inp.ndim > 2:
+            raise Exception('inp has an invalid shape for this plan.')
+
+        nchan = 1
+        if inp.ndim == 2:
+            nchan = inp.shape[1]
+
+        # the weights become the last channel
+        vis = self._buffer(workspace, 'psf_in', (self.nvis, nchan + 1), \
+            self.ctype)
+        data = vis[:, :nchan]
+        data[...] = inp.reshape((self.nvis, nchan))
+        if weights is None:
+            vis[:, nchan] = 1
+        else:
+            data *= weights.reshape((self.nvis, 1))
+            vis[:, nchan] = weights
+        _tick(stats, 'validation', t)
 
-    elif mode == MODE_RI:
+        res = None
+        if workspace is not None:
+            res = self._buffer(workspace, 'psf_out', self.out_shape + \
+                (nchan + 1,), self.rtype if self.real else self.ctype)
+        res = self.finish_grid(self._grid(vis, workspace, stats), res, \
+            workspace, stats)
 
-        # all gridding code assumes the data array is complex
-        inp = np.array(inp, dtype=complex)
+        t = _now(stats)
 
-        # grid basics
-        if N == 1:
-            dx = in_ax[0][0]
-            Nx = in_ax[0][1]
-            xmin = 0.
-            if do_preshift:
-                xmin = -0.5*Nx*dx
-            du = 1./dx/Nx/alpha
-            Nu = int(alpha*Nx)
-            umin = 0.
-            if do_postshift:
-                umin = -0.5*Nu*du
+        if inp.ndim == 2:
+            dirty = res[..., :nchan]
+        else:
+            dirty = res[..., 0]
+        if out is None:
+            out = (None, None)
+        out = (self._result(out[0], dirty.shape, res.dtype), \
+            self._result(out[1], self.out_shape, res.dtype))
+        out[0][...] = dirty
+        out[1][...] = res[..., nchan]
+        _tick(stats, 'crop', t)
+
+        if self.verbose:
+            print("Done!")
+            print("")
 
-        elif N == 2:
-            dx = in_ax[0][0]
-            Nx = in_ax[0][1]
-            xmin = 0.
-            du = 1./dx/Nx/alpha
-            Nu = int(alpha*Nx)
-            umin = 0.
+        return out
 
-            dy = in_ax[1][0]
-            Ny = in_ax[1][1]
-            ymin = 0.
-            dv = 1./dy/Ny/alpha
-            Nv = int(alpha*Ny)
-            vmin = 0.
-
-            if do_postshift:
-                if postshift_axes == None:
-                    vmin = -0.5*Nv*dv
-                    umin = -0.5*Nu*du
-                else:
-                    if postshift_axes.count(1) > 0:
-                        vmin = -0.5*Nv*dv
-                    if postshift_axes.count(0) > 0:
-                        umin = -0.5*Nu*du
-            if do_preshift:
-                if preshift_axes == None:
-                    xmin = -0.5*Nx*dx
-                    ymin = -0.5*Ny*dy
-                else:
-                    if preshift_axes.count(1) > 0:
-                        ymin = -0.5*Ny*dy
-                    if preshift_axes.count(0) > 0:
-                        xmin = -0.5*Nx*dx
-
-        elif N == 3:
-            dx = in_ax[0][0]
-            Nx = in_ax[0][1]
-            xmin = 0.
-            du = 1./dx/Nx/alpha
-            Nu = int(alpha*Nx)
-            umin = 0.
+    def new_grid(self, chan_shape=(), workspace=None):
+        """
+        Returns an empty grid to which irregularly spaced data can be added a
+        chunk at a time with add_to_grid (irregular to regular plans only).
+        chan_shape is the shape of the channel axes of the data, if any. The
+        grid is kept in workspace if given (see execute).
+        """
+
+        if self.mode != MODE_IR:
+            raise Exception('Chunked gridding is only available for '+\
+                'irregular to regular plans.')
+
+        shape = list(self.grid_shape)
+        if self.real:
+            shape[-1] = shape[-1]//2 + 1
+
+        if workspace is None:
+            return np.zeros(tuple(shape) + tuple(chan_shape), \
+                dtype=self.ctype)
+
+        grid = self._buffer(workspace, 'grid', tuple(shape) + \
+            tuple(chan_shape), self.ctype)
+        grid.fill(0)
+
+        return grid
+
+    def add_to_grid(self, grid, in_ax, inp, workspace=None, stats=None):
+        """
+        Grids inp, defined on the coordinates in in_ax (a list of N arrays,
+        which need not be those the plan was created with), onto grid (see
+        new_grid). Only the gridding kernels for this chunk are computed, so
+        the data can be gridded in chunks of any size. If stats (see
+        new_stats) is given, the gridding time and the sample counts of the
+        chunk are added to it.
+        """
+
+        t = _now(stats)
+
+        if self.mode != MODE_IR:
+            raise Exception('Chunked gridding is only available for '+\
+                'irregular to regular plans.')
+        if len(in_ax) != self.N:
+            raise Exception('in_ax must have one array for each dimension.')
+        for ax in in_ax:
+            if len(ax) != len(inp):
+                raise Exception('inp has an invalid shape for this plan.')
+        if np.ndim(inp) > 2:
+            raise Exception('inp has an invalid shape for this plan.')
+
+        kernels, perm = self._sort_kernels(self._get_kernels(in_ax, \
+            self.grid_d, self.grid_min), self.grid_shape, self.grid_rolls)
+        if perm is not None:
+            inp = np.take(inp, perm, axis=0)
+
+        gridding.add_nd_gcf(grid, kernels, np.asarray(inp, \
+            dtype=self.ctype), self.grid_shape, self.grid_min, self.grid_d, \
+            self.hermitianized_axes, self.nthreads, self.deterministic, \
+            self.grid_rolls, workspace)
+
+        if stats is not None:
+            _tick(stats, 'gridding', t)
+            clipped, dropped = lost_samples(kernels, self.grid_shape)
+            stats['nvis_in'] = stats.get('nvis_in', 0) + len(inp)
+            stats['grid_clipped'] = stats.get('grid_clipped', 0) + clipped
+            stats['grid_dropped'] = stats.get('grid_dropped', 0) + dropped
+
+        return grid
+
+    def finish_grid(self, grid, out=None, workspace=None, stats=None):
+        """
+        Performs the FFT, cropping and grid correction on a grid filled by
+        add_to_grid, and returns the result, in out if given (see execute).
+        The grid is overwritten. If stats (see new_stats) is given, the time
+        of each stage is added to it.
+        """
+
+        if self.mode != MODE_IR:
+            raise Exception('Chunked gridding is only available for '+\
+                'irregular to regular plans.')
+
+        if self.out_of_core is not None:
+            return self._finish_slabs(grid, out, workspace, stats)
+
+        t = _now(stats)
+
+        if self.real:
+            full = None
+            if workspace is not None:
+                full = self._buffer(workspace, 'real', \
+                    tuple(self.grid_shape) + grid.shape[self.N:], self.rtype)
+            full = self.fft.irfftn(grid, self.grid_shape, \
+                list(range(self.N)), True, self.nthreads, full)
+        else:
+            full = self._fft(grid, overwrite=True)
+        t = _tick(stats, 'fft', t)
 
-            dy = in_ax[1][0]
-            Ny = in_ax[1][1]
-            ymin = 0.
-            dv = 1./dy/Ny/alpha
-            Nv = int(alpha*Ny)
-            vmin = 0.
-
-            dz = in_ax[2][0]
-            Nz = in_ax[2][1]
-            zmin = 0.
-            dw = 1./dz/Nz/alpha
-            Nw = int(alpha*Nz)
-            wmin = 0.
-
-            if do_postshift:
-                if postshift_axes == None:
-                    vmin = -0.5*Nv*dv
-                    umin = -0.5*Nu*du
-                    wmin = -0.5*Nw*dw
-                else:
-                    if postshift_axes.count(1) > 0:
-                        vmin = -0.5*Nv*dv
-                    if postshift_axes.count(0) > 0:
-                        umin = -0.5*Nu*du
-                    if postshift_axes.count(2) > 0:
-                        wmin = -0.5*Nw*dw
-            if do_preshift:
-                if preshift_axes == None:
-                    xmin = -0.5*Nx*dx
-                    ymin = -0.5*Ny*dy
-                    zmin = -0.5*Nz*dz
-                else:
-                    if preshift_axes.count(1) > 0:
-                        ymin = -0.5*Ny*dy
-                    if preshift_axes.count(0) > 0:
-                        xmin = -0.5*Nx*dx
-                    if preshift_axes.count(2) > 0:
-                        zmin = -0.5*Nz*dz
+        # crop & grid correct
+        out = self._result(out, self.out_shape + full.shape[self.N:], \
+            full.dtype)
+        copy_blocks(out, full, self.crop)
+        t = _tick(stats, 'crop', t)
 
+        out = self._grid_correct(out, self.gc)
+        _tick(stats, 'correction', t)
 
-        # degrid correct & enlargement
-        if N == 1:
-            tndxx = int(0.5*Nx*(alpha-1))
-            inp = inp/gridding.get_grid_corr_1d(dx, Nx, xmin, du, W, alpha)
+        return out
 
-            inp_oversam = np.zeros(Nu, dtype=complex)
 
-            xl = 0
+class NormalOperator(object):
+    """
+    NormalOperator
 
-            if do_preshift:
-                xl = tndxx
+    The normal operator A^H A (or A^H D A, with D diagonal weights) of the
+    transformation A from a regularly spaced N-D image to irregularly spaced
+    samples, for iterative reconstruction.
 
-            inp_oversam[xl:xl+Nx] = inp
+    def NormalOperator(in_ax, out_ax, ftmachine='fft', weights=None, W=6, \
+        alpha=1.5, verbose=False, kernel_tol=1e-7, nthreads=1, \
+        fft_backend=None, precision='double')
 
-        elif N == 2:
-            tndxx = int(0.5*Nx*(alpha-1))
-            tndxy = int(0.5*Ny*(alpha-1))
-            inp = inp/gridding.get_grid_corr_2d(dx, Nx, xmin, dy, Ny, ymin, \
-                du, dv, W, alpha)
+    in_ax holds the coordinates of the samples (a list of N arrays) and
+    out_ax the image axes (a list of N (dx, nx) tuples), as for an irregular
+    to regular gfft. A is defined by
 
-            inp_oversam = np.zeros((Nu,Nv), dtype=complex)
+        (A x)_k = sum_j x_j exp(-s 2 pi i u_k . x_j),
 
-            xl = 0
-            yl = 0
+    where s = -1 along 'fft' axes and s = 1 along 'ifft' axes of ftmachine,
+    so that A^H is the transformation that gfft(vis, in_ax, out_ax,
+    ftmachine) approximates (up to the normalization of the FFT and the
+    gridding). Then
 
-            if do_preshift:
-                if preshift_axes == None:
-                    xl = tndxx
-                    yl = tndxy
-                else:
-                    if preshift_axes.count(0) > 0:
-                        xl = tndxx
-                    if preshift_axes.count(1) > 0:
-                        yl = tndxy
-
-            inp_oversam[xl:xl+Nx, yl:yl+Ny] = inp
-
-
-        elif N == 3:
-            tndxx = int(0.5*Nx*(alpha-1))
-            tndxy = int(0.5*Ny*(alpha-1))
-            tndxz = int(0.5*Nz*(alpha-1))
-            inp = inp/gridding.get_grid_corr_3d(dx, Nx, xmin, dy, Ny, ymin, \
-                dz, Nz, zmin, du, dv, dw, W, alpha)
-            inp_oversam = np.zeros((Nu,Nv,Nw), dtype=complex)
-
-            xl = 0
-            yl = 0
-            zl = 0
-
-            if do_preshift:
-                if preshift_axes == None:
-                    xl = tndxx
-                    yl = tndxy
-                    zl = tndxz
-                else:
-                    if preshift_axes.count(0) > 0:
-                        xl = tndxx
-                    if preshift_axes.count(1) > 0:
-                        yl = tndxy
-                    if preshift_axes.count(2) > 0:
-                        zl = tndxz
-
-            inp_oversam[xl:xl+Nx, yl:yl+Ny, zl:zl+Nz] = inp
-
-        # shift
-        if do_preshift:
-            inp_oversam = np.fft.fftshift(inp_oversam, axes=preshift_axes)
-
-        # fft
-        if do_fft:
-            out = np.fft.fftn(inp_oversam, axes=fftaxes)
-        else:
-            out = inp_oversam.copy()
+        (A^H D A x)_j = sum_l psf(x_j - x_l) x_l,
+        psf(y) = sum_k w_k exp(s 2 pi i u_k . y),
 
-        if do_ifft:
-            out = np.fft.ifftn(out, axes=ifftaxes)
+    is a convolution with the point spread function psf, whose matrix is
+    Toeplitz. psf is computed once, by gridding the weights w_k (ones if
+    weights is None) onto an image twice the size of out_ax along each axis,
+    so that the convolution can be embedded in a circulant one. apply then
+    computes A^H D A x with one FFT and one IFFT of a zero padded array of
+    that size, without any gridding or degridding.
 
-        # shift
-        if do_postshift:
-            out = np.fft.fftshift(out, axes=postshift_axes)
+    The other arguments have the same meaning as for gfft. The psf (on the
+    2x image, centred on its middle pixel) and the Fourier transform of the
+    circulant kernel are kept as the psf and kernel attributes.
+    """
 
-        # degrid
-        if N == 1:
-            out_degrid = gridding.degrid_1d(out_ax[0], out, du, Nu, umin,\
-                alpha, W)
+    def __init__(self, in_ax, out_ax, ftmachine='fft', weights=None, W=6, \
+        alpha=1.5, verbose=False, kernel_tol=1e-7, nthreads=1, \
+        fft_backend=None, precision='double'):
 
-        elif N == 2:
-            out_degrid = gridding.degrid_2d(out_ax[0], out_ax[1], out, du, Nu, \
-                umin, dv, Nv, vmin,  alpha, W)
+        ftmachine, weights = check_operator_args(in_ax, out_ax, ftmachine, \
+            weights)
+        self.N = len(out_ax)
+        if weights is None:
+            weights = np.ones(len(in_ax[0]))
 
-        elif N == 3:
-            out_degrid = gridding.degrid_3d(out_ax[0], out_ax[1], out_ax[2], \
-                out, du, Nu, umin, dv, Nv, vmin, dw, Nw, wmin, alpha, W)
+        if verbose:
+            print("gfft v. "+VERSION)
+            print("Toeplitz normal operator for a "+str(self.N)+"-D image")
+
+        self.shape = tuple([int(ax[1]) for ax in out_ax])
+        psf_ax = [(ax[0], 2*ax[1]) for ax in out_ax]
+
+        # The psf is gridded like any other data, and divided by the response
+        # to a unit sample at u = 0 to undo the normalization of the FFT and
+        # the kernel.
+        opts = dict(ftmachine=ftmachine, out_zero_center=True, W=W, \
+            alpha=alpha, verbose=False, kernel_tol=kernel_tol, \
+            nthreads=nthreads, fft_backend=fft_backend)
+        self.psf = GFFTPlan(in_ax, psf_ax, **opts).execute(\
+            weights.astype(complex))
+        self.psf /= GFFTPlan([np.zeros(1)]*self.N, psf_ax, \
+            **opts).execute(np.ones(1, dtype=complex))
+
+        self.fft = get_fft_backend(fft_backend)
+        self.nthreads = nthreads
+        self.axes = list(range(self.N))
+        if precision == 'single':
+            self.ctype = np.complex64
+        else:
+            self.ctype = np.complex128
+
+        # The first column of the circulant matrix holds psf(m dx) for
+        # m = 0..n-1, then psf(-m dx) wrapped around from the end. The pixel
+        # at -n dx is never used.
+        col = self.psf.copy()
+        col[tuple([0]*self.N)] = 0
+        col = np.fft.ifftshift(col)
+        self.kernel = np.fft.fftn(col).astype(self.ctype)
+
+        self.inner = tuple([slice(0, n) for n in self.shape])
 
         if verbose:
             print("Done!")
             print("")
 
-        return out_degrid
+    def apply(self, x, out=None, workspace=None):
+        """
+        Returns A^H D A x for the image x, which may have channel axes after
+        the first N, in out if given. workspace may be a dict in which the
+        padded work array is kept for reuse (see GFFTPlan.execute).
+        """
 
-    ############################################################################
-    # Do MODE_II transform
+        if type(x) != np.ndarray:
+            raise TypeError('x must be a numpy array.')
+        if x.shape[:self.N] != self.shape:
+            raise Exception('x has an invalid shape for this operator.')
 
-    elif mode == MODE_II:
+        extra = x.shape[self.N:]
+        buf = work_array(self.fft, workspace, 'toeplitz', \
+            self.kernel.shape + extra, self.ctype)
+        buf.fill(0)
+        buf[self.inner] = x
 
-        #defining the grids
-        if type(in_ax) == tuple:
-            raise Exception("Defining grid on in_ax in MODE_II not yet "\
-                +"supported...")
-            # everything in here is out of date... needs total overhaul!
-            if N == 1:
-                du = in_ax[1][0][0]
-                Nu = int(in_ax[1][0][1]*alpha )
-                umin = 0.
-                if do_preshift:
-                    umin = -0.5*Nu*du
-                dx = 1./du/Nu
-                Nx = Nu
-                umin = 0.
-                if do_postshift:
-                    umin = -0.5*Nu*du
-
-                in_ax = in_ax[0]
-
-            elif N == 2:
-                dx = in_ax[1][0][0]
-                Nx = in_ax[1][0][1]
-                xmin = 0.
-                if type(in_zero_center)==bool and in_zero_center==True:
-                    xmin = -0.5*Nx*dx
-                elif in_zero_center[0] == True:
-                    xmin = -0.5*Nx*dx
-                du = 1./dx/Nx/alpha
-                Nu = int(alpha*Nx)
-                umin = 0.
-                if do_postshift:
-                    umin = -0.5*Nu*du
-
-                dy = in_ax[1][1][0]
-                Ny = in_ax[1][1][1]
-                ymin = 0.
-                if type(in_zero_center)==bool and in_zero_center==True:
-                    ymin = -0.5*Ny*dy
-                elif in_zero_center[1] == True:
-                    ymin = -0.5*Ny*dy
-                dv = 1./dy/Ny/alpha
-                Nv = int(alpha*Ny)
-                vmin = 0.
-                if do_postshift:
-                    vmin = -0.5*Nv*dv
-
-                in_ax = in_ax[0]
-
-            elif N == 3:
-                dx = in_ax[1][0][0]
-                Nx = in_ax[1][0][1]
-                xmin = 0.
-                if type(in_zero_center)==bool and in_zero_center==True:
-                    xmin = -0.5*Nx*dx
-                elif in_zero_center[0] == True:
-                    xmin = -0.5*Nx*dx
-                du = 1./dx/Nx/alpha
-                Nu = int(alpha*Nx)
-                umin = 0.
-                if do_postshift:
-                    umin = -0.5*Nu*du
-
-                dy = in_ax[1][1][0]
-                Ny = in_ax[1][1][1]
-                ymin = 0.
-                if type(in_zero_center)==bool and in_zero_center==True:
-                    ymin = -0.5*Ny*dy
-                elif in_zero_center[1] == True:
-                    ymin = -0.5*Ny*dy
-                dv = 1./dy/Ny/alpha
-                Nv = int(alpha*Ny)
-                vmin = 0.
-                if do_postshift:
-                    vmin = -0.5*Nv*dv
-
-                dz = in_ax[1][2][0]
-                Nz = in_ax[1][2][1]
-                zmin = 0.
-                if type(in_zero_center)==bool and in_zero_center==True:
-                    zmin = -0.5*Nz*dz
-                elif in_zero_center[2] == True:
-                    zmin = -0.5*Nz*dz
-                dw = 1./dz/Nz/alpha
-                Nw = int(alpha*Nz)
-                wmin = 0.
-                if do_postshift:
-                    wmin = -0.5*Nw*dw
-
-                in_ax = in_ax[0]
+        buf = self.fft.fftn(buf, self.axes, True, self.nthreads)
+        buf *= self.kernel.reshape(self.kernel.shape + (1,)*len(extra))
+        buf = self.fft.ifftn(buf, self.axes, True, self.nthreads)
 
-        else:
+        out = result_array(out, x.shape, self.ctype)
+        out[...] = buf[self.inner]
 
-            if N == 1:
-                dx = out_ax[1][0][0]
-                Nx = out_ax[1][0][1]
-                xmin = 0.
-                if do_postshift:
-                    xmin = -0.5*Nx*dx
-                du = 1./dx/Nx/alpha
-                Nu = int(Nx*alpha)
-                umin = 0.
-                if do_preshift:
-                    umin = -0.5*Nu*du
-
-                out_ax = out_ax[0]
-
-            elif N == 2:
-                dx = out_ax[1][0][0]
-                Nx = out_ax[1][0][1]
-                xmin = 0.
-                du = 1./dx/Nx/alpha
-                Nu = int(alpha*Nx)
-                umin = 0.
-
-                dy = out_ax[1][1][0]
-                Ny = out_ax[1][1][1]
-                ymin = 0.
-                dv = 1./dy/Ny/alpha
-                Nv = alpha*Ny
-                vmin = 0.
-
-                if do_preshift:
-                    if preshift_axes == None:
-                        vmin = -0.5*Nv*dv
-                        umin = -0.5*Nu*du
-                    else:
-                        if preshift_axes.count(1) > 0:
-                            vmin = -0.5*Nv*dv
-                        if preshift_axes.count(0) > 0:
-                            umin = -0.5*Nu*du
-                if do_postshift:
-                    if postshift_axes == None:
-                        xmin = -0.5*Nx*dx
-                        ymin = -0.5*Ny*dy
-                    else:
-                        if postshift_axes.count(1) > 0:
-                            ymin = -0.5*Ny*dy
-                        if postshift_axes.count(0) > 0:
-                            xmin = -0.5*Nx*dx
-
-                out_ax = out_ax[0]
-
-
-            elif N == 3:
-                dx = out_ax[1][0][0]
-                Nx = out_ax[1][0][1]
-                xmin = 0.
-                du = 1./dx/Nx/alpha
-                Nu = int(alpha*Nx)
-                umin = 0.
-
-                dy = out_ax[1][1][0]
-                Ny = out_ax[1][1][1]
-                ymin = 0.
-                dv = 1./dy/Ny/alpha
-                Nv = alpha*Ny
-                vmin = 0.
-
-                dz = out_ax[1][2][0]
-                Nz = out_ax[1][2][1]
-                zmin = 0.
-                dw = 1./dz/Nz/alpha
-                Nw = alpha*Nz
-                wmin = 0.
-
-                if do_preshift:
-                    if preshift_axes == None:
-                        vmin = -0.5*Nv*dv
-                        umin = -0.5*Nu*du
-                        wmin = -0.5*Nw*dw
-                    else:
-                        if preshift_axes.count(1) > 0:
-                            vmin = -0.5*Nv*dv
-                        if preshift_axes.count(0) > 0:
-                            umin = -0.5*Nu*du
-                        if preshift_axes.count(2) > 0:
-                            wmin = -0.5*Nw*dw
-                if do_postshift:
-                    if postshift_axes == None:
-                        xmin = -0.5*Nx*dx
-                        ymin = -0.5*Ny*dy
-                        zmin = -0.5*Nz*dz
-                    else:
-                        if postshift_axes.count(1) > 0:
-                            ymin = -0.5*Ny*dy
-                        if postshift_axes.count(0) > 0:
-                            xmin = -0.5*Nx*dx
-                        if postshift_axes.count(2) > 0:
-                            zmin = -0.5*Nz*dz
-
-                out_ax = out_ax[0]
-
-        # all gridding code assumes the data array is complex
-        inp = np.array(inp, dtype=complex)
-
-        # grid
-        if N == 1:
-            inp_grid = gridding.grid_1d(in_ax[0], inp, du, Nu, umin, alpha, W, \
-                hermitianized_axes[0])
-        elif N == 2:
-            inp_grid = gridding.grid_2d(in_ax[0], in_ax[1], inp, du, Nu, umin, \
-                dv, Nv, vmin, W, alpha, \
-                hermitianized_axes[0], hermitianized_axes[1])
-        elif N == 3:
-            inp_grid = gridding.grid_3d(in_ax[0], in_ax[1], in_ax[2], inp, \
-                du, Nu, umin, dv, Nv, vmin, dw, Nw, wmin, W, alpha, \
-                hermitianized_axes[0], hermitianized_axes[1], \
-                hermitianized_axes[2])
-
-        # degrid correct
-        if N == 1:
-            inp_grid = inp_grid/gridding.get_grid_corr_1d(du, Nu, umin, \
-                dx/alpha, W, alpha)
-
-            inp_grid_os = np.zeros(Nu*alpha, dtype=complex)
-
-            ul = 0
-            if do_preshift:
-                ul = 0.5*Nu*(alpha-1.)
-
-            inp_grid_os[ul:ul+Nu] = inp_grid
-            inp_grid = inp_grid_os
-            del inp_grid_os
-
-        elif N == 2:
-            inp_grid = inp_grid/gridding.get_grid_corr_2d(du, Nu, umin, \
-                dv, Nv, vmin, dx/alpha, dy/alpha, W, alpha)
-
-            inp_grid_os = np.zeros((Nu*alpha, Nv*alpha), dtype=complex)
-
-            ul = 0
-            vl = 0
-
-            if do_preshift:
-                if preshift_axes == None:
-                    ul = 0.5*Nu*(alpha-1.)
-                    vl = 0.5*Nv*(alpha-1.)
-                else:
-                    if preshift_axes.count(0) > 0:
-                        ul = 0.5*Nu*(alpha-1.)
-                    if preshift_axes.count(1) > 0:
-                        vl = 0.5*Nv*(alpha-1.)
+        return out
 
-            inp_grid_os[ul:ul+Nu, vl:vl+Nv] = inp_grid
-            inp_grid = inp_grid_os
-            del inp_grid_os
 
-        elif N == 3:
-            inp_grid = inp_grid/gridding.get_grid_corr_3d(du, Nu, umin, \
-                dv, Nv, vmin, dw, Nw, wmin, dx/alpha, dy/alpha, dz/alpha, \
-                W, alpha)
+class GFFTOperator(object):
+    """
+    GFFTOperator
+
+    The transformation A from a regularly spaced N-D image to irregularly
+    spaced samples, and its adjoint, as a linear operator for least squares
+    reconstruction.
+
+    def GFFTOperator(in_ax, out_ax, ftmachine='fft', W=6, alpha=1.5, \
+        verbose=False, kernel_tol=1e-7, nthreads=1, \
+        deterministic=False, fft_backend=None, precision='double', \
+        sort_samples=None)
+
+    in_ax holds the coordinates of the samples (a list of N arrays) and
+    out_ax the image axes (a list of N (dx, nx) tuples), as for an irregular
+    to regular gfft. The image is zero centred (pixel nx//2 is at x = 0
+    along each axis) and A is defined as for NormalOperator,
+
+        (A x)_k = sum_j x_j exp(-s 2 pi i u_k . x_j),
+
+    with s = -1 along 'fft' axes and s = 1 along 'ifft' axes of ftmachine.
+    A regular to irregular plan for A (matvec) and an irregular to regular
+    plan for A^H (rmatvec) are made once, and their outputs are rescaled so
+    that they approximate these sums, and so each other's adjoint, to the
+    accuracy of the gridding.
+
+    The operator has the shape (nvis, nx_1*...*nx_N) and dtype attributes
+    and the matvec, rmatvec, matmat and rmatmat methods of
+    scipy.sparse.linalg.LinearOperator, so it can be passed to
+    scipy.sparse.linalg.aslinearoperator and the scipy solvers. Images are
+    flattened in C order. solve finds the least squares image for a set of
+    samples with the conjugate gradient method (see cg).
+
+    The remaining arguments have the same meaning as for gfft.
+    """
 
-            inp_grid_os = np.zeros((Nu*alpha, Nv*alpha, Nw*alpha), \
-                dtype=complex)
+    def __init__(self, in_ax, out_ax, ftmachine='fft', W=6, alpha=1.5, \
+        verbose=False, kernel_tol=1e-7, nthreads=1, \
+        deterministic=False, fft_backend=None, precision='double', \
+        sort_samples=None):
 
-            ul = 0
-            vl = 0
-            wl = 0
+        ftmachine = check_operator_args(in_ax, out_ax, ftmachine, None)[0]
 
-            if do_preshift:
-                if preshift_axes == None:
-                    ul = 0.5*Nu*(alpha-1.)
-                    vl = 0.5*Nv*(alpha-1.)
-                    wl = 0.5*Nw*(alpha-1.)
-                else:
-                    if preshift_axes.count(0) > 0:
-                        ul = 0.5*Nu*(alpha-1.)
-                    if preshift_axes.count(1) > 0:
-                        vl = 0.5*Nv*(alpha-1.)
-                    if preshift_axes.count(2) > 0:
-                        wl = 0.5*Nw*(alpha-1.)
-
-            inp_grid_os[ul:ul+Nu, vl:vl+Nv, wl:wl+Nw] = inp_grid
-            inp_grid = inp_grid_os
-            del inp_grid_os
-
-        # shift
-        if do_preshift:
-            inp_grid = np.fft.fftshift(inp_grid, axes=preshift_axes)
-
-        # fft
-        if do_fft:
-            out = np.fft.fftn(inp_grid, axes=fftaxes)
-        else:
-            out = inp_grid.copy()
-
-        if do_ifft:
-            out = np.fft.ifftn(out, axes=ifftaxes)
-
-        # shift
-        if do_postshift:
-            out = np.fft.fftshift(out, axes=postshift_axes)
-
-        # grid correct
-        if N == 1:
-#            print "Now here..."
-#            print len(out)
-#            print alpha**2*Nx
-            out = out/gridding.get_grid_corr_1d(dx/alpha, alpha**2*Nx, \
-                alpha*xmin, du, W, alpha)
-
-        elif N == 2:
-            out = out/gridding.get_grid_corr_2d(dx/alpha, alpha**2*Nx, \
-                alpha*xmin, dy/alpha, alpha**2*Ny, alpha*ymin, \
-                du, dv, W, alpha)
-
-        elif N == 3:
-            out = out/gridding.get_grid_corr_3d(dx/alpha, alpha**2*Nx, \
-                alpha*xmin, dy/alpha, alpha**2*Ny, alpha*ymin, \
-                dz/alpha, alpha**2*Nz, alpha*zmin, du, dv, dw, W, alpha)
-
-        # degrid
-        if N == 1:
-            out_degrid = gridding.degrid_1d(out_ax[0], out, dx/alpha, \
-                alpha**2*Nx, alpha*xmin, alpha, W)
-
-        elif N == 2:
-            out_degrid = gridding.degrid_2d(out_ax[0], out_ax[1], out, \
-                dx/alpha, alpha**2*Nx, alpha*xmin, dy/alpha, alpha**2*Ny, \
-                alpha*ymin, alpha, W)
-
-        elif N == 3:
-            out_degrid = gridding.degrid_3d(out_ax[0], out_ax[1], out_ax[2], \
-                out, dx/alpha, alpha**2*Nx, alpha*xmin, dy/alpha, alpha**2*Ny, \
-                alpha*ymin, dz/alpha, alpha**2*Nz, alpha*zmin, alpha, W)
+        if verbose:
+            print("gfft v. "+VERSION)
+            print("Linear operator for a "+str(len(out_ax))+"-D image")
+
+        self.N = len(out_ax)
+        self.in_ax = in_ax
+        self.out_ax = out_ax
+        self.ftmachine = ftmachine
+        self.image_shape = tuple([int(ax[1]) for ax in out_ax])
+        self.nvis = len(in_ax[0])
+        self.shape = (self.nvis, int(np.prod(self.image_shape)))
+        self.opts = dict(W=W, alpha=alpha, verbose=False, \
+            kernel_tol=kernel_tol, nthreads=nthreads, fft_backend=fft_backend)
+
+        # A has the opposite sign of the adjoint, which gfft computes
+        inverse = [FTM_IFFT if ftm == FTM_FFT else FTM_FFT \
+            for ftm in ftmachine]
+        self.forward = GFFTPlan(out_ax, in_ax, inverse, \
+            precision=precision, sort_samples=sort_samples, **self.opts)
+        self.adjoint = GFFTPlan(in_ax, out_ax, ftmachine, \
+            deterministic=deterministic, precision=precision, \
+            sort_samples=sort_samples, **self.opts)
+        self.dtype = np.dtype(self.forward.ctype)
+
+        # The plans are normalized by their response to a unit pixel at
+        # x = 0 (sampled at u = 0), and to a unit sample at u = 0.
+        delta = np.zeros(self.image_shape, dtype=self.dtype)
+        delta[tuple([n//2 for n in self.image_shape])] = 1
+        self.forward_scale = 1./GFFTPlan(out_ax, [np.zeros(1)]*self.N, \
+            inverse, **self.opts).execute(delta)[0]
+        self.adjoint_scale = 1./GFFTPlan([np.zeros(1)]*self.N, out_ax, \
+            ftmachine, **self.opts).execute(np.ones(1, dtype=complex))
+        self.adjoint_scale = self.adjoint_scale.astype(self.dtype)
+
+        self.workspace = {'forward':{}, 'adjoint':{}}
+        self.normal = None
 
         if verbose:
             print("Done!")
             print("")
 
-        return out_degrid
+    def _apply_forward(self, x, nchan):
+        if nchan is None:
+            x = x.reshape(self.image_shape)
+        else:
+            x = x.reshape(self.image_shape + (nchan,))
+        y = self.forward.execute(np.asarray(x, dtype=self.dtype), \
+            workspace=self.workspace['forward'])
+        y *= self.forward_scale
+        return y
+
+    def _apply_adjoint(self, v, nchan):
+        if nchan is None:
+            v = v.reshape(self.nvis)
+            scale = self.adjoint_scale
+        else:
+            v = v.reshape((self.nvis, nchan))
+            scale = self.adjoint_scale.reshape(self.image_shape + (1,))
+        x = self.adjoint.execute(np.asarray(v, dtype=self.dtype), \
+            workspace=self.workspace['adjoint'])
+        x *= scale
+        if nchan is None:
+            return x.reshape(self.shape[1])
+        return x.reshape((self.shape[1], nchan))
+
+    def matvec(self, x):
+        """
+        Returns A x for an image x (flattened, or of the image shape), as a
+        1-D array of the samples.
+        """
+        if np.size(x) != self.shape[1]:
+            raise Exception('x has an invalid shape for this operator.')
+        return self._apply_forward(np.asarray(x), None)
+
+    def rmatvec(self, v):
+        """
+        Returns A^H v for a vector v of samples, as a flattened image.
+        """
+        if np.size(v) != self.nvis:
+            raise Exception('v has an invalid shape for this operator.')
+        return self._apply_adjoint(np.asarray(v), None)
+
+    def matmat(self, X):
+        """
+        Returns A X for an (nx_1*...*nx_N, k) array X of k flattened images,
+        transforming all of them in one pass (as channels).
+        """
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[0] != self.shape[1]:
+            raise Exception('X has an invalid shape for this operator.')
+        return self._apply_forward(X, X.shape[1])
+
+    def rmatmat(self, V):
+        """
+        Returns A^H V for an (nvis, k) array V of k sample vectors.
+        """
+        V = np.asarray(V)
+        if V.ndim != 2 or V.shape[0] != self.nvis:
+            raise Exception('V has an invalid shape for this operator.')
+        return self._apply_adjoint(V, V.shape[1])
+
+    def aslinearoperator(self):
+        """
+        Returns the operator wrapped as a scipy.sparse.linalg.LinearOperator.
+        """
+        if sparse_linalg is None:
+            raise Exception('aslinearoperator requires scipy.')
+        return sparse_linalg.aslinearoperator(self)
+
+    def solve(self, vis, x0=None, weights=None, damp=0., tol=1e-6, \
+        maxiter=100, toeplitz=False, callback=None):
+        """
+        Returns the image x (of the image shape) that minimizes
+
+            sum_k w_k |(A x)_k - vis_k|^2 + damp sum_j |x_j|^2,
+
+        with w_k the weights (ones if None), found by solving the normal
+        equations (A^H D A + damp) x = A^H D vis with cg, starting from x0
+        (zeros if None). tol, maxiter and callback are as for cg.
+
+        Each iteration costs one matvec and one rmatvec. With toeplitz=True,
+        A^H D A is instead applied with a NormalOperator, which costs only
+        two FFTs of twice the image size along each axis. It is made on the
+        first call and kept for later calls with the same weights.
+        """
+
+        vis = np.asarray(vis)
+        if vis.shape != (self.nvis,):
+            raise Exception('vis has an invalid shape for this operator.')
+        if weights is not None:
+            weights = np.asarray(weights)
+            vis = vis*weights
+
+        rhs = self._apply_adjoint(vis, None).reshape(self.image_shape)
+        if x0 is not None:
+            x0 = np.reshape(x0, self.image_shape)
+
+        if toeplitz:
+            if self.normal is None or \
+                not np.array_equal(self.normal_weights, weights):
+                    self.normal = NormalOperator(self.in_ax, self.out_ax, \
+                        self.ftmachine, weights, precision=\
+                        'single' if self.dtype == np.complex64 else 'double', \
+                        **self.opts)
+                    self.normal_weights = weights
+            workspace = self.workspace['normal'] = {}
+            def normal(x, out):
+                self.normal.apply(x, out, workspace)
+                if damp != 0:
+                    out += damp*x
+        else:
+            def normal(x, out):
+                y = self._apply_forward(x, None)
+                if weights is not None:
+                    y *= weights
+                out[...] = self._apply_adjoint(y, None).reshape(\
+                    self.image_shape)
+                if damp != 0:
+                    out += damp*x
+
+        return cg(normal, rhs, x0, tol, maxiter, callback)
+
+
+def cg(apply, b, x0=None, tol=1e-6, maxiter=100, callback=None):
+    """
+    Solves M x = b with the conjugate gradient method, for a Hermitian
+    positive definite M applied by apply(x, out), which writes M x to out.
+    Starts from x0 (zeros if None) and stops when the residual norm is at
+    most tol times that of b, or after maxiter iterations. callback, if
+    given, is called with the current x after each iteration.
+
+    The iterate, residual, search direction and M applied to it are kept in
+    four arrays allocated once, which are updated in place, so an iteration
+    allocates nothing beyond what apply does. Returns x.
+    """
+
+    b = np.asarray(b)
+    x = np.zeros_like(b) if x0 is None else np.array(x0, dtype=b.dtype)
+    r = np.empty_like(b)
+    p = np.empty_like(b)
+    q = np.empty_like(b)
+
+    if x0 is None:
+        r[...] = b
+    else:
+        apply(x, q)
+        np.subtract(b, q, out=r)
+    p[...] = r
+
+    rr = np.vdot(r, r).real
+    stop = (tol*np.linalg.norm(b))**2
+
+    for it in range(maxiter):
+        if rr <= stop:
+            break
+
+        apply(p, q)
+        a = rr/np.vdot(p, q).real
+
+        # r -= a q, x += a p, using q as scratch
+        q *= a
+        r -= q
+        np.multiply(p, a, out=q)
+        x += q
+
+        rr, rr_old = np.vdot(r, r).real, rr
+
+        # p = r + (rr/rr_old) p
+        p *= rr/rr_old
+        p += r
+
+        if callback is not None:
+            callback(x)
+
+    return x
+
+
+def check_operator_args(in_ax, out_ax, ftmachine, weights):
+    """
+    Checks the arguments shared by NormalOperator and GFFTOperator, and
+    returns ftmachine as a list and weights as an array (or None).
+    """
+
+    if type(in_ax) != list or type(out_ax) != list or \
+        len(in_ax) != len(out_ax) or len(in_ax) == 0:
+            raise TypeError('in_ax and out_ax must be lists with one '+\
+                'entry for each dimension.')
+
+    if type(ftmachine) == str:
+        ftmachine = [ftmachine]*len(out_ax)
+    if type(ftmachine) != list or len(ftmachine) != len(out_ax):
+        raise TypeError('ftmachine must be a string or a list with one '+\
+            'entry for each dimension.')
+    for ftm in ftmachine:
+        if ftm != FTM_FFT and ftm != FTM_IFFT:
+            raise TypeError("ftmachine must be either 'fft' or 'ifft' "+\
+                "along each axis.")
+
+    if weights is not None:
+        weights = np.asarray(weights)
+        if weights.shape != (len(in_ax[0]),) or np.iscomplexobj(weights):
+            raise TypeError('weights must be a real array with one weight '+\
+                'per sample.')
+
+    return ftmachine, weights
+
+def _now(stats):
+    """
+    The current time if stats are being collected, else None.
+    """
+    if stats is not None:
+        return time.perf_counter()
+
+def _tick(stats, stage, t0):
+    """
+    Adds the time since t0 to the given stage in stats, and returns the
+    current time. Does nothing if stats is None.
+    """
+    if stats is None:
+        return None
+    t = time.perf_counter()
+    times = stats['times']
+    times[stage] = times.get(stage, 0.) + (t - t0)
+    return t
+
+def check_stats(stats):
+    """
+    Raises a TypeError if stats is not None, a dict or a callable.
+    """
+    if stats is not None and type(stats) != dict and not callable(stats):
+        raise TypeError('stats must be a dict or a callable.')
+
+def report_stats(stats, rec):
+    """
+    Delivers the collected stats rec to stats, a dict to fill or a callable.
+    """
+    if callable(stats):
+        stats(rec)
+    else:
+        stats.clear()
+        stats.update(rec)
+
+def lost_samples(kernels, shape):
+    """
+    Returns the numbers of samples whose kernels (see gridding.get_gcf) lie
+    partly and entirely outside a grid of the given shape.
+    """
+    if len(kernels) == 0 or len(kernels[0][0]) == 0:
+        return 0, 0
+    part = np.zeros(len(kernels[0][0]), dtype=bool)
+    whole = np.zeros(len(kernels[0][0]), dtype=bool)
+    for (ndx, gcf), n in zip(kernels, shape):
+        W = gcf.shape[1]
+        part |= (ndx < 0) | (ndx + W > n)
+        whole |= (ndx + W <= 0) | (ndx >= n)
+    return int(part.sum()), int(whole.sum())
+
+def work_array(fft, workspace, name, shape, dtype):
+    """
+    Returns a work array of the given shape and dtype, allocated by the FFT
+    backend fft. If workspace (a dict) is given, the array is kept in it
+    under name and reused by later calls.
+    """
+    shape = tuple(shape)
+    dtype = np.dtype(dtype)
+    if workspace is not None:
+        arr = workspace.get(name)
+        if arr is not None and arr.shape == shape and arr.dtype == dtype:
+            return arr
+    arr = fft.empty(shape, dtype)
+    if workspace is not None:
+        workspace[name] = arr
+    return arr
+
+def scratch_array(dirname, workspace, name, shape, dtype):
+    """
+    Returns a work array of the given shape and dtype that is memory mapped to
+    a temporary file in the directory dirname, which is removed when the
+    array is released. If workspace (a dict) is given, the array is kept in
+    it under name and reused by later calls.
+    """
+    shape = tuple(shape)
+    dtype = np.dtype(dtype)
+    if workspace is not None:
+        arr = workspace.get(name)
+        if arr is not None and arr.shape == shape and arr.dtype == dtype:
+            return arr
+    arr = np.memmap(tempfile.TemporaryFile(dir=dirname), dtype=dtype, \
+        mode='w+', shape=shape)
+    if workspace is not None:
+        workspace[name] = arr
+    return arr
+
+def slab_ranges(n, row_bytes, block_bytes):
+    """
+    Splits n rows of row_bytes bytes each into consecutive [a, b) ranges of
+    at most block_bytes bytes, and at least one row, each.
+    """
+    rows = max(1, int(block_bytes//max(row_bytes, 1)))
+    return [(a, min(a + rows, n)) for a in range(0, n, rows)]
+
+def slab_samples(ndx, W, n, roll, mirror=None):
+    """
+    Returns a function find(a, b) that gives the indices, in increasing order,
+    of the samples whose kernels (ndx holding the index of the first of the
+    W cells of each, see gridding.get_gcf) may reach the cells stored at
+    positions [a, b) along an axis of n cells that is stored rolled by roll.
+    If mirror is given, so that the mirror of cell i is cell mirror - i,
+    samples whose mirrored kernels reach them are included too. The kernels
+    span circular ranges of stored positions, so the samples are sorted by
+    the first of them once, and each range is found by bisection. A few
+    samples whose kernels fall off the grid may be included.
+    """
+    starts = [(np.asarray(ndx) + roll) % n]
+    if mirror is not None:
+        starts += [(mirror - np.asarray(ndx) - (W - 1) + roll) % n]
+
+    sorted_starts = []
+    for start in starts:
+        order = np.argsort(start, kind='stable')
+        sorted_starts += [(start[order], order)]
+
+    def find(a, b):
+        found = []
+        for start, order in sorted_starts:
+            lo = a - (W - 1)
+            ranges = [(max(lo, 0), b)]
+            if lo < 0:
+                ranges += [(max(n + lo, 0), n)]
+            for r0, r1 in ranges:
+                found += [order[np.searchsorted(start, r0):\
+                    np.searchsorted(start, r1)]]
+        return np.unique(np.concatenate(found))
+
+    return find
+
+def slab_blocks(blocks, side, n, a, b):
+    """
+    Restricts the blocks (see index_blocks) to the rows [a, b) of the first
+    axis of the array, with n rows, that the slices side (0 for dst, 1 for
+    src) of each pair index. The rows of that array are counted from a in
+    the blocks returned. The other slices of each pair must be contiguous.
+    """
+    res = []
+    for block in blocks:
+        rows_sl, other = block[side][0], block[1-side][0]
+        rows = np.arange(n)[rows_sl]
+        keep = np.nonzero((rows >= a) & (rows < b))[0]
+        if len(keep) == 0:
+            continue
+        i0, i1 = int(keep[0]), int(keep[-1]) + 1
+        step = rows_sl.step or 1
+        stop = int(rows[i1-1]) - a + step
+        rows_sl = slice(int(rows[i0]) - a, stop if stop >= 0 else None, step)
+        other = slice(other.start + i0, other.start + i1)
+        pair = [None, None]
+        pair[side] = (rows_sl,) + tuple(block[side][1:])
+        pair[1-side] = (other,) + tuple(block[1-side][1:])
+        res += [tuple(pair)]
+    return res
+
+def result_array(out, shape, dtype):
+    """
+    Returns out, after checking that it has the given shape, or a new array
+    of the given shape and dtype if out is None.
+    """
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if out.shape != tuple(shape):
+        raise Exception('out has an invalid shape for this plan.')
+    return out
+
+def index_blocks(ndx):
+    """
+    Splits the indexing dst = src[np.ix_(*ndx)], where ndx holds an index
+    array for each of the first axes, into blocks of basic slices. Returns a
+    list of (dst, src) pairs of slice tuples, for which dst[d] = src[s] for
+    each pair does the same without any temporary arrays. Each index array is
+    split into runs of consecutive (increasing or decreasing) indices.
+    """
+
+    runs = []
+    for idx in ndx:
+        idx = [int(i) for i in idx]
+        axis_runs = []
+        i0 = 0
+        while i0 < len(idx):
+            step = 1
+            if i0 + 1 < len(idx) and idx[i0+1] - idx[i0] == -1:
+                step = -1
+            i1 = i0 + 1
+            while i1 < len(idx) and idx[i1] - idx[i1-1] == step:
+                i1 += 1
+            stop = idx[i1-1] + step
+            if stop < 0:
+                stop = None
+            axis_runs += [(slice(i0, i1), slice(idx[i0], stop, step))]
+            i0 = i1
+        runs += [axis_runs]
+
+    return [tuple(zip(*block)) for block in itertools.product(*runs)]
+
+
+def fftshift_blocks(shape, axes):
+    """
+    The blocks (see index_blocks) for np.fft.fftshift along axes of an array
+    of the given shape.
+    """
+    ndx = []
+    for i in range(len(shape)):
+        n = shape[i]
+        if axes.count(i) > 0:
+            ndx += [(np.arange(n) - n//2) % n]
+        else:
+            ndx += [np.arange(n)]
+    return index_blocks(ndx)
+
+
+def copy_blocks(dst, src, blocks):
+    """
+    Copies the blocks (see index_blocks) of src to dst.
+    """
+    for d, s in blocks:
+        dst[d] = src[s]
 
 
 def validate_iterrable_types(l, t):
@@ -1169,18 +2434,52 @@ def validate_iterrable_types(l, t):
     return is_valid
 
 
-def dft(in_vals, in_ax, out_ax):
+def dft(in_vals, in_ax, out_ax, block_bytes=DFT_BLOCK_BYTES, nthreads=1):
     """
     A function that transforms a list of values using a discrete Fourier
     transformation. Works for arbitrary number of dimensions.
 
     in_ax/out_ax must be a list of numpy arrays, one array for each axis.
+
+    in_vals may also be an (nin, nvec) array holding nvec data vectors defined
+    on the same axes, in which case an (nout, nvec) array is returned.
+
+    The transform is done as a matrix product for blocks of output points,
+    the Fourier matrix of each block taking up to block_bytes bytes. The
+    blocks are divided between nthreads threads.
+    """
+    return _direct_ft(in_vals, in_ax, out_ax, -1., block_bytes, nthreads)
+
+def idft(in_vals, in_ax, out_ax, block_bytes=DFT_BLOCK_BYTES, nthreads=1):
+    """
+    A function that transforms a list of values using an inverse discrete
+    Fourier transformation. Works for arbitrary number of dimensions.
+
+    in_ax/out_ax must be a list of numpy arrays, one array for each axis.
+
+    The remaining arguments are the same as for dft.
+    """
+    return _direct_ft(in_vals, in_ax, out_ax, 1., block_bytes, nthreads)
+
+def _direct_ft(in_vals, in_ax, out_ax, sign, block_bytes, nthreads):
+    """
+    The blocked direct Fourier transformation behind dft (sign=-1) and idft
+    (sign=1).
     """
 
     nax = len(in_ax)
     if len(out_ax) != len(in_ax):
         raise Exception('dft: number of input and output dimensions not equal!')
 
+    if type(nthreads) != int or nthreads < 1:
+        raise TypeError('nthreads must be a positive integer.')
+
+    in_vals = np.asarray(in_vals)
+    if in_vals.ndim > 2:
+        raise Exception('dft: in_vals must be a 1 or 2 dimensional array')
+    in_ax = [np.asarray(a, dtype=float) for a in in_ax]
+    out_ax = [np.asarray(a, dtype=float) for a in out_ax]
+
     nin = len(in_vals)
     nout = len(out_ax[0])
 
@@ -1190,53 +2489,225 @@ def dft(in_vals, in_ax, out_ax):
         if len(out_ax[i]) != nout:
             raise Exception('dft: output axis length invalid')
 
-    out_vals = np.zeros(nout, dtype=complex)
+    vals = in_vals.astype(complex)/nin
+    out_vals = np.zeros((nout,) + in_vals.shape[1:], dtype=complex)
+
+    # number of output points per block, with the complex Fourier matrix
+    # (and the real phases it is made from) within block_bytes
+    nblock = max(1, min(nout, int(block_bytes)//(24*max(nin, 1))))
+
+    def transform_block(i0):
+        i1 = min(i0 + nblock, nout)
+        phs = np.zeros((i1 - i0, nin))
+        for k in range(nax):
+            phs += np.outer(out_ax[k][i0:i1], in_ax[k])
+        phs *= sign*2.*np.pi
+        ftm = np.empty(phs.shape, dtype=complex)
+        np.cos(phs, out=ftm.real)
+        np.sin(phs, out=ftm.imag)
+        out_vals[i0:i1] = np.dot(ftm, vals)
+
+    blocks = range(0, nout, nblock)
+    if nthreads > 1 and len(blocks) > 1:
+        pool = ThreadPool(min(nthreads, len(blocks)))
+        try:
+            pool.map(transform_block, blocks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for i0 in blocks:
+            transform_block(i0)
 
-    for i in range(nout):
-        val = complex(0,0)
-        for j in range(nin):
-            psum = 0
-            for k in range(nax):
-                psum += in_ax[k][j]*out_ax[k][i]
-            cphs = -2.*np.pi*psum
-            val += in_vals[j]*complex(np.cos(cphs),np.sin(cphs))
-        out_vals[i] = val
-#        progress(20, i+1., nk)
+    return out_vals
 
-    return out_vals/len(in_vals)
 
-def idft(in_vals, in_ax, out_ax):
-    """
-    A function that transforms a list of values using a discrete Fourier
-    transformation. Works for arbitrary number of dimensions.
+################################################################################
+# Autotuning
 
-    in_ax/out_ax must be a list of numpy arrays, one array for each axis.
+def autotune(in_ax, out_ax, target=1e-4, ftmachine='fft', Ws=AUTOTUNE_W, \
+    alphas=AUTOTUNE_ALPHA, nsample=256, nerr=2048, repeat=3, cache=True, \
+    cache_file=None, verbose=False, seed=0, **opts):
+    """
+    Returns the fastest (W, alpha) for transforming between in_ax and out_ax
+    with gfft (or a GFFTPlan) with a relative error of at most target.
+
+    The error of each candidate is measured against the exact Fourier sum,
+    on random data, at nsample random output points, using at most nerr of
+    the irregularly spaced input samples (the error does not depend on the
+    number of samples). It is the norm of the difference divided by the norm
+    of the exact result, after fitting the overall scale of the output,
+    which depends on W and alpha. For each alpha in alphas, the smallest W in
+    Ws that reaches target is found, and those (W, alpha) pairs are then
+    timed on the full problem (plan.execute with a workspace, the best of
+    repeat calls), as the smallest W is not always fastest for the largest
+    alpha. If no candidate reaches target, the most accurate one is returned
+    with a warning.
+
+    The axes must be zero centred (the gfft default). opts are passed on to
+    GFFTPlan (e.g. nthreads, fft_backend, precision, kernel_tol). The result
+    is kept in autotune_cache, keyed on the mode, the grid sizes, the number
+    of samples (rounded to a power of 2), target, ftmachine and opts, and
+    returned straight away for a matching problem if cache is True. If
+    cache_file is given, the cache is also read from and written to this
+    JSON file, so that it persists between runs. With verbose, the error and
+    time of each candidate are printed.
     """
 
-    nax = len(in_ax)
-    if len(out_ax) != len(in_ax):
-        raise Exception('dft: number of input and output dimensions not equal!')
+    opts = dict(opts)
+    opts['verbose'] = False
+    rng = np.random.default_rng(seed)
 
-    nin = len(in_vals)
-    nout = len(out_ax[0])
+    # the regular axes and the irregular coordinates
+    if type(in_ax) == tuple:
+        grid_ax, in_pts, out_pts = in_ax[1], in_ax[0], out_ax
+        mode = MODE_II
+    elif type(out_ax) == tuple:
+        grid_ax, in_pts, out_pts = out_ax[1], in_ax, out_ax[0]
+        mode = MODE_II
+    elif len(in_ax) > 0 and type(in_ax[0]) == tuple:
+        grid_ax, in_pts, out_pts = in_ax, None, out_ax
+        mode = MODE_RI
+    elif len(out_ax) > 0 and type(out_ax[0]) == tuple:
+        grid_ax, in_pts, out_pts = out_ax, in_ax, None
+        mode = MODE_IR
+    else:
+        raise Exception('autotune needs irregularly spaced input or output.')
 
-    for i in range(nax):
-        if len(in_ax[i]) != nin:
-            raise Exception('dft: input axis length invalid')
-        if len(out_ax[i]) != nout:
-            raise Exception('dft: output axis length invalid')
+    N = len(grid_ax)
+    if type(ftmachine) == str:
+        ftmachine = [ftmachine]*N
+    for ftm in ftmachine:
+        if ftm != FTM_FFT and ftm != FTM_IFFT:
+            raise TypeError("ftmachine must be either 'fft' or 'ifft' "+\
+                "along each axis.")
+    signs = [-1. if ftm == FTM_FFT else 1. for ftm in ftmachine]
+
+    nvis = len(in_pts[0]) if in_pts is not None else len(out_pts[0])
+    key = json.dumps([mode, [int(ax[1]) for ax in grid_ax], \
+        int(nvis).bit_length(), target, ftmachine, \
+        sorted([(k, repr(v)) for k, v in opts.items()])])
+
+    if cache and cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            autotune_cache.update(json.load(f))
+    if cache and key in autotune_cache:
+        return tuple(autotune_cache[key][:2])
+
+    # the regular points, zero centred
+    def regular_points(npts):
+        ndx = [rng.integers(0, int(ax[1]), npts) for ax in grid_ax]
+        pts = [(ndx[i] - int(grid_ax[i][1])//2)*grid_ax[i][0] \
+            for i in range(N)]
+        return ndx, pts
+
+    def subset(pts, npts):
+        if len(pts[0]) <= npts:
+            return [np.asarray(p, dtype=float) for p in pts]
+        keep = rng.choice(len(pts[0]), npts, replace=False)
+        return [np.asarray(p, dtype=float)[keep] for p in pts]
+
+    # the problem on which the error is measured, with inp the input data,
+    # the exact result at the output points, and select picking them out of
+    # the output of gfft
+    if mode == MODE_IR:
+        err_in = subset(in_pts, nerr)
+        err_out = grid_ax
+        inp = rng.standard_normal(len(err_in[0])) + \
+            1j*rng.standard_normal(len(err_in[0]))
+        ndx, pts = regular_points(nsample)
+        select = lambda out: out[tuple(ndx)]
+        exact = _exact_ft(inp, err_in, pts, signs)
+    elif mode == MODE_RI:
+        err_in = grid_ax
+        err_out = subset(out_pts, nsample)
+        inp = rng.standard_normal(tuple([int(ax[1]) for ax in grid_ax])) + \
+            1j*rng.standard_normal(tuple([int(ax[1]) for ax in grid_ax]))
+        grids = np.meshgrid(*[(np.arange(int(ax[1])) - int(ax[1])//2)*ax[0] \
+            for ax in grid_ax], indexing='ij')
+        select = lambda out: out
+        exact = _exact_ft(inp.ravel(), [g.ravel() for g in grids], err_out, \
+            signs)
+    else:
+        err_in = subset(in_pts, nerr)
+        err_out = subset(out_pts, nsample)
+        if type(in_ax) == tuple:
+            err_in = (err_in, grid_ax)
+        else:
+            err_out = (err_out, grid_ax)
+        pts_in = err_in[0] if type(err_in) == tuple else err_in
+        pts_out = err_out[0] if type(err_out) == tuple else err_out
+        inp = rng.standard_normal(len(pts_in[0])) + \
+            1j*rng.standard_normal(len(pts_in[0]))
+        select = lambda out: out
+        exact = _exact_ft(inp, pts_in, pts_out, signs)
+
+    def error(W, alpha):
+        plan = GFFTPlan(err_in, err_out, ftmachine, W=W, alpha=alpha, **opts)
+        approx = select(plan.execute(inp)).ravel()
+        scale = np.vdot(exact, approx)/np.vdot(exact, exact)
+        return np.linalg.norm(approx - scale*exact)/np.linalg.norm(\
+            scale*exact)
+
+    def timing(W, alpha):
+        plan = GFFTPlan(in_ax, out_ax, ftmachine, W=W, alpha=alpha, **opts)
+        if mode == MODE_RI:
+            data = np.ones(tuple([int(ax[1]) for ax in grid_ax]), \
+                dtype=complex)
+        else:
+            data = np.ones(nvis, dtype=complex)
+        ws = {}
+        plan.execute(data, workspace=ws)
+        best = None
+        for i in range(repeat):
+            t0 = time.time()
+            plan.execute(data, workspace=ws)
+            t = time.time() - t0
+            if best is None or t < best:
+                best = t
+        return best
+
+    # the smallest W reaching target for each alpha
+    candidates = []
+    closest = None
+    for alpha in alphas:
+        for W in sorted(Ws):
+            e = error(W, alpha)
+            if verbose:
+                print("W = %d, alpha = %g: error %.3g" % (W, alpha, e))
+            if closest is None or e < closest[2]:
+                closest = (W, alpha, e)
+            if e <= target:
+                candidates += [(W, alpha, e)]
+                break
+
+    if len(candidates) == 0:
+        warnings.warn('No (W, alpha) candidate reaches the target error, '+\
+            'using the most accurate one (error %.3g).' % closest[2])
+        candidates = [closest]
+
+    best = None
+    for W, alpha, e in candidates:
+        t = timing(W, alpha)
+        if verbose:
+            print("W = %d, alpha = %g: %.4f s" % (W, alpha, t))
+        if best is None or t < best[3]:
+            best = (W, alpha, e, t)
 
-    out_vals = np.zeros(nout, dtype=complex)
+    if cache:
+        autotune_cache[key] = list(best)
+        if cache_file is not None:
+            with open(cache_file, 'w') as f:
+                json.dump(autotune_cache, f)
 
-    for i in range(nout):
-        val = complex(0,0)
-        for j in range(nin):
-            psum = 0
-            for k in range(nax):
-                psum += in_ax[k][j]*out_ax[k][i]
-            cphs = 2.*np.pi*psum
-            val += in_vals[j]*complex(np.cos(cphs),np.sin(cphs))
-        out_vals[i] = val
-#        progress(20, i+1., nk)
+    return best[0], best[1]
 
-    return out_vals/len(in_vals)
+def _exact_ft(vals, in_pts, out_pts, signs):
+    """
+    The exact Fourier sums of vals, defined at in_pts, at out_pts (lists of
+    coordinate arrays), with the sign of the exponent given for each axis.
+    """
+    phs = np.zeros((len(out_pts[0]), len(in_pts[0])))
+    for i in range(len(signs)):
+        phs += signs[i]*np.outer(out_pts[i], in_pts[i])
+    return np.dot(np.exp(2j*np.pi*phs), vals)
@@ -34,156 +34,109 @@ import numpy as np
 cimport numpy as np
 cimport cython
 from cpython cimport bool
+from cython.parallel cimport prange, threadid
+from libc.stdlib cimport malloc, free
 
 DTYPE = np.float64
 CTYPE = np.complex128
+ITYPE = np.intp
 ctypedef np.float64_t DTYPE_t
 ctypedef np.complex128_t CTYPE_t
+ctypedef np.intp_t ITYPE_t
 
-cdef extern from "gsl/gsl_sf_bessel.h":
+# grids can be held in single or double precision, the kernels and the
+# accumulation of degridded samples are always in double precision
+ctypedef fused cplx_t:
+    np.complex64_t
+    np.complex128_t
+
+cdef extern from "gsl/gsl_sf_bessel.h" nogil:
     double gsl_sf_bessel_I0(double x)
 
-cdef extern from "math.h":
+# maximum number of grid axes (not counting channels)
+cdef enum:
+    MAXDIM = 32
+
+MAX_DIMS = MAXDIM
+
+# the layout of an N-D C ordered grid of nchan channels, see scatter and
+# gather. Only the cells stored at positions below S along each axis are kept,
+# e.g. half of the last axis for a Hermitian grid.
+cdef struct grid_t:
+    Py_ssize_t ndim # number of grid axes
+    Py_ssize_t N[MAXDIM] # number of cells along each axis
+    Py_ssize_t S[MAXDIM] # number of cells stored along each axis (S <= N)
+    Py_ssize_t nchan # number of channels, the last (fastest varying) axis
+    Py_ssize_t M[MAXDIM] # mirror index along each axis, see get_mirror
+    Py_ssize_t R[MAXDIM] # cell i is stored at (i + R) % N along each axis
+    bint herm[MAXDIM] # whether to add the conjugate at the mirrored position
+
+# the kernel indices and values along one axis for a set of samples, the
+# values for sample k start at gcf[k*gcf_stride]
+cdef struct kern_t:
+    ITYPE_t* ndx
+    Py_ssize_t ndx_stride
+    double* gcf
+    Py_ssize_t gcf_stride
+    int W
+
+# number of samples for which kernels are precomputed at once when the
+# gridding functions are run with several threads
+GRID_CHUNK = 65536
+
+cdef extern from "math.h" nogil:
     double exp(double theta)
     double sqrt(double x)
     double ceil(double x)
+    double floor(double x)
     double sin(double theta)
 
 
 ################################################################################
-# 3D functions
+# N-D functions
 ################################################################################
 
-def grid_3d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[DTYPE_t,ndim=1] v,\
-    np.ndarray[DTYPE_t, ndim=1] w, np.ndarray[CTYPE_t, ndim=1] vis, \
-    double du, int Nu, double umin, double dv, int Nv, double vmin, \
-    double dw, int Nw, double wmin, double alpha, int W, \
-    bool hflag_u, bool hflag_v, bool hflag_w):
-
-        cdef int W3 = W**3
-        cdef int nvis = u.shape[0]
-
-        cdef np.ndarray[CTYPE_t, ndim=3, mode='c'] gv = \
-            np.zeros((Nu, Nv, Nw), dtype=CTYPE) #output array
-
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] ug = \
-            np.zeros(nvis*W3, dtype=DTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] vg = \
-            np.zeros(nvis*W3, dtype=DTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] wg = \
-            np.zeros(nvis*W3, dtype=DTYPE)
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] visg = \
-            np.zeros(nvis*W3, dtype=CTYPE)
-
-        # holds the W values after u gridding
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tu1 = \
-            np.zeros(W, dtype=DTYPE)
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] tvis1 = \
-            np.zeros(W, dtype=CTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tv1 = \
-            np.zeros(W, dtype=DTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tw1 = \
-            np.zeros(W, dtype=DTYPE)
-
-
-        # holds the W**2 values after subsequent v gridding
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tu2 =\
-            np.zeros(W**2, dtype=DTYPE)
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] tvis2 = \
-            np.zeros(W**2, dtype=CTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tv2 = \
-            np.zeros(W**2, dtype=DTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tw2 = \
-            np.zeros(W**2, dtype=DTYPE)
-
-
-        # holds the W**3 values after subsequent w gridding
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tu3 = \
-            np.zeros(W3, dtype=DTYPE)
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] tvis3 = \
-            np.zeros(W3, dtype=CTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tv3 = \
-            np.zeros(W3, dtype=DTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tw3 = \
-            np.zeros(W3, dtype=DTYPE)
-
-
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] su = \
-            np.zeros(1, dtype=DTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] sv = \
-            np.zeros(1, dtype=DTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] sw = \
-            np.zeros(1, dtype=DTYPE)
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] svis = \
-            np.zeros(1, dtype=CTYPE)
-
-        cdef Py_ssize_t i, undx, vndx, wndx
-
-        cdef double beta = get_beta(W, alpha)
-
-        for i in range(nvis):
-
-            # For each visibility point, grid in 3D, one dimension at a time
-            # so each visibility becomes W**3 values located on the grid
-
-            # Grid in u
-            su[0] = u[i]
-            sv[0] = v[i]
-            sw[0] = w[i]
-            svis[0] = vis[i]
-            grid_1d_from_3d(su, svis, du, W, beta, sv, sw, tu1, tvis1, tv1, tw1)
-
-            # Grid in v
-            grid_1d_from_3d(tv1, tvis1, dv, W, beta, tu1, tw1, \
-                tv2, tvis2, tu2, tw2) # output arrays
+def grid_nd(list coords, np.ndarray[CTYPE_t,ndim=1] vis, list ds, \
+    list shape, list mins, double alpha, int W, list herms, double tol=1e-7, \
+    int nthreads=1, bool deterministic=False):
+        """
+        Grid vis, defined at the coordinates in coords (one array per axis),
+        onto an N-D grid of the given shape. The grid_1d/2d/3d functions are
+        special cases of this.
+        """
 
-            # Grid in l2
-            grid_1d_from_3d(tw2, tvis2, dw, W, beta, tu2, tv2, \
-                tw3, tvis3, tu3, tv3) # output arrays
+        cdef np.ndarray gv = np.zeros(tuple(shape), dtype=CTYPE)
 
-            ug[i*W3:(i+1)*W3] = tu3
-            vg[i*W3:(i+1)*W3] = tv3
-            wg[i*W3:(i+1)*W3] = tw3
-            visg[i*W3:(i+1)*W3] = tvis3
+        grid_points(gv, coords, ds, mins, vis, herms, alpha, W, tol, \
+            nthreads, deterministic)
 
+        return gv
 
-        cdef int N = ug.shape[0]
-        cdef double temp = 0
 
-        for i in range(N):
-            # compute the location for the visibility in the visibility cube
-            temp = (ug[i] - umin)/du + 0.5
-            undx = int(temp)
-            temp = (vg[i] - vmin)/dv + 0.5
-            vndx = int(temp)
-            temp = (wg[i] - wmin)/dw + 0.5
-            wndx = int(temp)
+def degrid_nd(list coords, np.ndarray regVis, list ds, list mins, \
+    double alpha, int W, double tol=1e-7, int nthreads=1):
 
-            if (undx>=0 and undx<Nu) and (vndx>=0 and vndx<Nv)\
-                and (wndx >= 0 and wndx < Nw):
-                    gv[undx, vndx, wndx] = gv[undx, vndx, wndx] + visg[i]
+        return degrid_points(regVis, coords, ds, mins, alpha, W, tol, \
+            nthreads)
 
 
-            # now compute the location for the -u,-v,-l2 visibility, which is
-            # equal to the complex conj of the u,v,l2 visibility if we
-            # assume that the individual Stokes images in Faraday space are real
+################################################################################
+# 3D functions
+################################################################################
 
-            if hflag_u or hflag_v or hflag_w:
-                if hflag_u:
-                    temp = (-1.*ug[i] - umin)/du + 0.5
-                    undx = int(temp)
-                if hflag_v:
-                    temp = (-1.*vg[i] - vmin)/dv + 0.5
-                    vndx = int(temp)
-                if hflag_w:
-                    temp = (-1.*wg[i] - wmin)/dw + 0.5
-                    wndx = int(temp)
+def grid_3d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[DTYPE_t,ndim=1] v,\
+    np.ndarray[DTYPE_t, ndim=1] w, np.ndarray[CTYPE_t, ndim=1] vis, \
+    double du, int Nu, double umin, double dv, int Nv, double vmin, \
+    double dw, int Nw, double wmin, double alpha, int W, \
+    bool hflag_u, bool hflag_v, bool hflag_w, double tol=1e-7, \
+    int nthreads=1, bool deterministic=False):
 
+        cdef np.ndarray[CTYPE_t, ndim=3, mode='c'] gv = \
+            np.zeros((Nu, Nv, Nw), dtype=CTYPE) #output array
 
-                if (undx>=0 and undx<Nu) and (vndx>=0 and vndx<Nv)\
-                    and (wndx >= 0 and wndx < Nw):
-                        gv[undx, vndx, wndx] = gv[undx, vndx, wndx] +\
-                            visg[i].conjugate()
+        grid_points(gv, [u, v, w], [du, dv, dw], [umin, vmin, wmin], vis, \
+            [hflag_u, hflag_v, hflag_w], alpha, W, tol, nthreads, \
+            deterministic)
 
         return gv
 
@@ -191,131 +144,32 @@ def grid_3d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[DTYPE_t,ndim=1] v,\
 def degrid_3d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[DTYPE_t,ndim=1] v, \
     np.ndarray[DTYPE_t,ndim=1] w, np.ndarray[CTYPE_t, ndim=3] regVis, \
     double du, double Nu, double umin, double dv, double Nv, double vmin, \
-    double dw, double Nw, double wmin, double alpha, int W):
-
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] ugrid = \
-            np.arange(0.,Nu,1.)*du + umin
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] vgrid = \
-            np.arange(0.,Nv,1.)*dv + vmin
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] wgrid = \
-            np.arange(0.,Nw,1.)*dw + wmin
-
-        cdef int nvis = u.shape[0]
-
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] Vis = \
-            np.zeros(nvis, dtype=CTYPE)
-
-        # From Beatty et al. (2005)
-        cdef double beta = get_beta(W, alpha)
-        # Grid in u and v
-        cdef double Du = W*du
-        cdef double Dv = W*dv
-        cdef double Dw = W*dw
-
-        cdef Py_ssize_t i, j, vrang, urang, wrang, k, Wu, Wv, l
-
-        cdef double gcf_val
-
-
-        for k in range(nvis):
+    double dw, double Nw, double wmin, double alpha, int W, double tol=1e-7, \
+    int nthreads=1):
 
-            urang = int(np.ceil((u[k] - 0.5*Du - umin)/du))
-            vrang = int(np.ceil((v[k] - 0.5*Dv - vmin)/dv))
-            wrang = int(np.ceil((w[k] - 0.5*Dw - wmin)/dw))
+        return degrid_points(regVis[:int(Nu), :int(Nv), :int(Nw)], \
+            [u, v, w], [du, dv, dw], [umin, vmin, wmin], alpha, W, tol, \
+            nthreads)
 
-            for i in range(urang, urang+W):
-                for j in range(vrang, vrang+W):
-                    for l in range(wrang, wrang+W):
-                        if (i<Nu and i>=0) and (j<Nv and j>=0) and \
-                            (l<Nw and l>=0):
-                                gcf_val = gcf_kaiser(u[k]-ugrid[i], Du, beta)*\
-                                    gcf_kaiser(v[k]-vgrid[j], Dv, beta) \
-                                    *gcf_kaiser(w[k]-wgrid[l], Dw, beta)
 
-                                Vis[k] = Vis[k] + regVis[i,j,l]*gcf_val
 
-        return Vis
-
-
-
-# Cython version is 180x faster than pure python
 def get_grid_corr_3d(double dx, int Nx, double xmin, \
     double dy, int Ny, double ymin, double dz, int Nz, double zmin, \
     double du, double dv, double dw, int W, double alpha):
-
-#    cdef int Nz = z.shape[0]
-#    cdef int Ny = y.shape[0]
-#    cdef int Nx = x.shape[0]
-
-        cdef np.ndarray[DTYPE_t, ndim=3, mode='c'] gridcorr = \
-            np.zeros([Nx, Ny, Nz], dtype=DTYPE)
-
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] x = \
-            np.arange(Nx, dtype=DTYPE)*dx + xmin
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] y = \
-            np.arange(Ny,dtype=DTYPE)*dy + ymin
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] z = \
-            np.arange(Nz,dtype=DTYPE)*dz + zmin
-
-        # see Beatty et al. (2005)
-        cdef double beta = get_beta(W, alpha)
-
-        cdef Py_ssize_t i, j, k
-
-        for i in range(Nx):
-            for j in range(Ny):
-                for k in range(Nz):
-                    gridcorr[i,j,k] = inv_gcf_kaiser(x[i], du, W, beta)*\
-                        inv_gcf_kaiser(y[j], dv, W, beta)*\
-                        inv_gcf_kaiser(z[k], dw, W, beta)
-
-        return gridcorr
-
-
-cdef inline void grid_1d_from_3d(np.ndarray[DTYPE_t,ndim=1] x, \
-    np.ndarray[CTYPE_t,ndim=1] vis, double dx, int W, double beta, \
-    np.ndarray[DTYPE_t,ndim=1] y, np.ndarray[DTYPE_t,ndim=1] z, \
-    np.ndarray[DTYPE_t,ndim=1] x2, np.ndarray[CTYPE_t,ndim=1] vis2,\
-    np.ndarray[DTYPE_t,ndim=1] y2, np.ndarray[DTYPE_t,ndim=1] z2):
-
-
         """
-        Grid the data in w, Qvix, Uvis in 1D (x) and duplicate orthogonal axes
+        The grid correction is separable, so the cube is built as the outer
+        product of the 1D corrections along each axis. Use get_grid_corr_1d
+        for each axis directly to avoid creating the cube at all.
         """
-        cdef int N = x.shape[0]
-
-        cdef double Dx = W*dx
-
-        cdef Py_ssize_t indx, xndx, kndx
-
-        cdef double xval, yval, zval, xref, xg, gcf_val
-
-        cdef CTYPE_t visval
-
-        for indx in range(N):
-
-            visval = vis[indx]
-
-            xval = x[indx]
-            yval = y[indx]
-            zval = z[indx]
-
-            xref = ceil((xval - 0.5*W*dx)/dx)*dx
-
-            for xndx in range(W):
-
-                xg = xref + xndx*dx
-
-                kndx = indx*W + xndx
-
-                gcf_val = gcf_kaiser(xg-xval, Dx, beta)
 
-                vis2[kndx] = visval*gcf_val
-
-                x2[kndx] = xg
-                y2[kndx] = yval
-                z2[kndx] = zval
+        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] gcx = \
+            get_grid_corr_1d(dx, Nx, xmin, du, W, alpha)
+        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] gcy = \
+            get_grid_corr_1d(dy, Ny, ymin, dv, W, alpha)
+        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] gcz = \
+            get_grid_corr_1d(dz, Nz, zmin, dw, W, alpha)
 
+        return gcx[:, None, None]*gcy[None, :, None]*gcz[None, None, :]
 
 
 ################################################################################
@@ -325,346 +179,412 @@ cdef inline void grid_1d_from_3d(np.ndarray[DTYPE_t,ndim=1] x, \
 def grid_2d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[DTYPE_t,ndim=1] v,\
     np.ndarray[CTYPE_t, ndim=1] vis, double du, int Nu, double umin, \
     double dv, int Nv, double vmin, double alpha, int W, bool hflag_u, \
-    bool hflag_v):
-
-        cdef int W2 = W**2
-        cdef int nvis = u.shape[0]
+    bool hflag_v, double tol=1e-7, int nthreads=1, bool deterministic=False):
 
         cdef np.ndarray[CTYPE_t, ndim=2, mode='c'] gv = \
             np.zeros((Nu, Nv), dtype=CTYPE) #output array
 
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] ug = \
-            np.zeros(nvis*W2, dtype=DTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] vg = \
-            np.zeros(nvis*W2, dtype=DTYPE)
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] visg = \
-            np.zeros(nvis*W2, dtype=CTYPE)
-
-        # holds the W values after u gridding
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tu1 = \
-            np.zeros(W, dtype=DTYPE)
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] tvis1 = \
-            np.zeros(W, dtype=CTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tv1 = \
-            np.zeros(W, dtype=DTYPE)
-
-
-        # holds the W**2 values after subsequent v gridding
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tu2 =\
-            np.zeros(W2, dtype=DTYPE)
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] tvis2 = \
-            np.zeros(W2, dtype=CTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tv2 = \
-            np.zeros(W2, dtype=DTYPE)
+        grid_points(gv, [u, v], [du, dv], [umin, vmin], vis, \
+            [hflag_u, hflag_v], alpha, W, tol, nthreads, deterministic)
 
+        return gv
 
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] su = \
-            np.zeros(1, dtype=DTYPE)
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] sv = \
-            np.zeros(1, dtype=DTYPE)
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] svis = \
-            np.zeros(1, dtype=CTYPE)
-
-        cdef Py_ssize_t i, undx, vndx
-
-        cdef double beta = get_beta(W, alpha)
-
-        for i in range(nvis):
-
-            # For each visibility point, grid in 3D, one dimension at a time
-            # so each visibility becomes W**3 values located on the grid
 
-            # Grid in u
-            su[0] = u[i]
-            sv[0] = v[i]
-            svis[0] = vis[i]
-            grid_1d_from_2d(su, svis, du, W, beta, sv, tu1, tvis1, tv1)
+def degrid_2d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[DTYPE_t,ndim=1] v, \
+    np.ndarray[CTYPE_t, ndim=2] regVis, double du, int Nu, double umin, \
+    double dv, int Nv, double vmin, double alpha, int W, double tol=1e-7, \
+    int nthreads=1):
 
-            # Grid in v
-            grid_1d_from_2d(tv1, tvis1, dv, W, beta, tu1, \
-                tv2, tvis2, tu2) # output arrays
+        return degrid_points(regVis[:Nu, :Nv], [u, v], [du, dv], \
+            [umin, vmin], alpha, W, tol, nthreads)
 
-            ug[i*W2:(i+1)*W2] = tu2
-            vg[i*W2:(i+1)*W2] = tv2
-            visg[i*W2:(i+1)*W2] = tvis2
 
+def get_grid_corr_2d(double dx, int Nx, double xmin, \
+    double dy, int Ny, double ymin, double du, double dv, int W, double alpha):
+        """
+        The grid correction is separable, so the array is built as the outer
+        product of the 1D corrections along each axis.
+        """
 
-        cdef int N = ug.shape[0]
-        cdef double temp = 0
+        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] gcx = \
+            get_grid_corr_1d(dx, Nx, xmin, du, W, alpha)
+        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] gcy = \
+            get_grid_corr_1d(dy, Ny, ymin, dv, W, alpha)
 
-        for i in range(N):
-            # compute the location for the visibility in the visibility cube
-            temp = (ug[i] - umin)/du + 0.5
-            undx = int(temp)
-            temp = (vg[i] - vmin)/dv + 0.5
-            vndx = int(temp)
+        return np.outer(gcx, gcy)
 
-            if (undx>=0 and undx<Nu) and (vndx>=0 and vndx<Nv):
-                gv[undx, vndx] = gv[undx, vndx] + visg[i]
 
+################################################################################
+# 1D functions
+################################################################################
 
-            # now compute the location for the -u,-v,-l2 visibility, which is
-            # equal to the complex conj of the u,v,l2 visibility if we
-            # assume that the individual Stokes images in Faraday space are real
+def grid_1d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[CTYPE_t,ndim=1] vis, \
+    double du, int Nu, double umin, double alpha, int W, bool hermitianize, \
+    double tol=1e-7, int nthreads=1, bool deterministic=False):
+        """
+        Grid the data in w, Qvix, Uvis in 1D (x) and duplicate orthogonal axes
+        """
 
-            if hflag_u or hflag_v:
-                if hflag_u:
-                    temp = (-1.*ug[i] - umin)/du + 0.5
-                    undx = int(temp)
-                if hflag_v:
-                    temp = (-1.*vg[i] - vmin)/dv + 0.5
-                    vndx = int(temp)
+        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] gv = \
+            np.zeros(Nu, dtype=CTYPE) # output array
 
-                if (undx>=0 and undx<Nu) and (vndx>=0 and vndx<Nv):
-                    gv[undx, vndx] = gv[undx, vndx] + visg[i].conjugate()
+        grid_points(gv, [u], [du], [umin], vis, [hermitianize], alpha, W, \
+            tol, nthreads, deterministic)
 
         return gv
 
+def degrid_1d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[CTYPE_t, ndim=1] regVis,\
+    double du, int Nu, double umin, double alpha, int W, double tol=1e-7, \
+    int nthreads=1):
 
-def degrid_2d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[DTYPE_t,ndim=1] v, \
-    np.ndarray[CTYPE_t, ndim=2] regVis, double du, int Nu, double umin, \
-    double dv, int Nv, double vmin, double alpha, int W):
+        return degrid_points(regVis[:Nu], [u], [du], [umin], alpha, W, tol, \
+            nthreads)
 
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] ugrid = \
-            np.arange(0.,Nu,1.)*du + umin
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] vgrid = \
-            np.arange(0.,Nv,1.)*dv + vmin
 
-        cdef int nvis = u.shape[0]
+def get_grid_corr_1d(double dx, int Nx, double xmin, double du, int W, \
+    double alpha):
 
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] Vis = \
-            np.zeros(nvis, dtype=CTYPE)
+        cdef np.ndarray[DTYPE_t,ndim=1, mode='c'] gridcorr = np.zeros(Nx,\
+            dtype=DTYPE)
+        cdef np.ndarray[DTYPE_t,ndim=1, mode='c'] x = np.arange(Nx,\
+            dtype=DTYPE)*dx + xmin
 
-        # From Beatty et al. (2005)
         cdef double beta = get_beta(W, alpha)
-        # Grid in u and v
-        cdef double Du = W*du
-        cdef double Dv = W*dv
-
-        cdef Py_ssize_t i, j, urang, vrang, k, Wu, Wv
-
-        cdef double gcf_val, gcf_val_u, gcf_val_v
-
-
-        for k in range(nvis):
-
-            urang = int(np.ceil((u[k] - 0.5*Du - umin)/du))
-            vrang = int(np.ceil((v[k] - 0.5*Dv - vmin)/dv))
-
-            for i in range(urang, urang+W):
-                if (i>=Nu or i<0): continue
-                gcf_val_u = gcf_kaiser(u[k]-ugrid[i], Du, beta)
-                for j in range(vrang, vrang+W):
-                    if (j>=Nv or j<0): continue
 
-                    gcf_val_v = gcf_kaiser(v[k]-vgrid[j], Dv, beta)
+        cdef Py_ssize_t i
 
-                    # convolution kernel for position i,j
-                    gcf_val = gcf_val_v*gcf_val_u
-                    #sampling back to visibility point k
-                    Vis[k] = Vis[k] + regVis[i,j]*gcf_val
+        for i in range(Nx):
+            gridcorr[i] = inv_gcf_kaiser(x[i], du, W, beta)
 
-        return Vis
+        return gridcorr
 
 
-def get_grid_corr_2d(double dx, int Nx, double xmin, \
-    double dy, int Ny, double ymin, double du, double dv, int W, double alpha):
+def get_grid_corr_points(np.ndarray[DTYPE_t,ndim=1] x, double du, int W, \
+    double alpha):
+        """
+        Grid correction evaluated at the arbitrary coordinates in x rather than
+        on a regular grid.
+        """
 
-#    cdef int Nz = z.shape[0]
-#    cdef int Ny = y.shape[0]
-#    cdef int Nx = x.shape[0]
+        cdef int Nx = x.shape[0]
 
-        cdef np.ndarray[DTYPE_t,ndim=2, mode='c'] gridcorr = np.zeros([Ny, Nx],\
+        cdef np.ndarray[DTYPE_t,ndim=1, mode='c'] gridcorr = np.zeros(Nx,\
             dtype=DTYPE)
 
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] x = \
-            np.arange(Nx, dtype=DTYPE)*dx + xmin
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] y = \
-            np.arange(Ny, dtype=DTYPE)*dy + ymin
-
-        # see Beatty et al. (2005)
         cdef double beta = get_beta(W, alpha)
 
-        cdef Py_ssize_t i, j
+        cdef Py_ssize_t i
 
         for i in range(Nx):
-            for j in range(Ny):
-                gridcorr[i,j] = inv_gcf_kaiser(x[i], du, W, beta)*\
-                    inv_gcf_kaiser(y[j], dv, W, beta)
+            gridcorr[i] = inv_gcf_kaiser(x[i], du, W, beta)
 
         return gridcorr
 
 
-cdef inline void grid_1d_from_2d(np.ndarray[DTYPE_t,ndim=1] x, \
-    np.ndarray[CTYPE_t,ndim=1] vis, double dx, int W, double beta, \
-    np.ndarray[DTYPE_t,ndim=1] y, \
-    np.ndarray[DTYPE_t,ndim=1] x2, np.ndarray[CTYPE_t,ndim=1] vis2,\
-    np.ndarray[DTYPE_t,ndim=1] y2):
+def test_gcf_kaiser(double k, double dk, int W, double alpha):
+
+    cdef double beta = get_beta(W, alpha)
+    return gcf_kaiser(k, dk*W, beta)
 
+################################################################################
+# Functions using precomputed convolution kernels
+################################################################################
 
+def get_gcf(np.ndarray[DTYPE_t,ndim=1] u, double du, double umin, \
+    double alpha, int W, double tol=1e-7):
         """
-        Grid the data in w, Qvix, Uvis in 1D (x) and duplicate orthogonal axes
+        Precompute the gridding convolution kernel along one axis. Returns the
+        index of the first grid cell touched by each sample and the W kernel
+        values for each sample. These can be passed to the *_gcf gridding and
+        degridding functions any number of times for data that live on the
+        same coordinates. The *_gcf functions also accept several channels at
+        once, as an (nvis, nchan) data array to grid or a grid with a
+        trailing channel axis to degrid, applying the same kernel weights to
+        every channel. Their optional rolls argument (one integer per axis)
+        makes them produce or read np.roll(grid, rolls) instead of the grid
+        itself, which e.g. folds an fftshift into the gridding. With half=True
+        the gridding functions only keep the first N//2+1 (stored) cells along
+        the last axis, as used by numpy.fft.irfftn for a Hermitian grid.
+        complex64 (or float32) data give a complex64 grid and a complex64
+        grid gives complex64 samples, the kernels are always double.
         """
-        cdef int N = x.shape[0]
-
-        cdef double Dx = W*dx
-
-        cdef Py_ssize_t indx, xndx, kndx
+        cdef int nvis = u.shape[0]
 
-        cdef double xval, yval, xref, xg, gcf_val
+        cdef np.ndarray[ITYPE_t, ndim=1, mode='c'] undx = \
+            np.zeros(nvis, dtype=ITYPE)
+        cdef np.ndarray[DTYPE_t, ndim=2, mode='c'] ugcf = \
+            np.zeros((nvis, W), dtype=DTYPE)
 
-        cdef CTYPE_t visval
+        # From Beatty et al. (2005)
+        cdef double beta = get_beta(W, alpha)
+        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tab = \
+            get_kernel_table(W, alpha, tol)
+        cdef double* ptab = <double*>tab.data
+        cdef int ntab = tab.shape[0] - 1
 
-        for indx in range(N):
+        cdef Py_ssize_t k
 
-            visval = vis[indx]
+        for k in range(nvis):
+            undx[k] = point_gcf(u[k], du, umin, W, beta, ptab, ntab, \
+                &ugcf[k, 0])
 
-            xval = x[indx]
-            yval = y[indx]
+        return undx, ugcf
 
-            xref = ceil((xval - 0.5*W*dx)/dx)*dx
 
-            for xndx in range(W):
+cdef inline object grid_dtype(np.ndarray vis):
+    """
+    The dtype of the grid for vis: complex64 for single precision data,
+    complex128 otherwise.
+    """
+    if vis.dtype == np.complex64 or vis.dtype == np.float32:
+        return np.complex64
+    return CTYPE
 
-                xg = xref + xndx*dx
 
-                kndx = indx*W + xndx
+def grid_nd_gcf(list kernels, np.ndarray vis, list shape, list mins, \
+    list ds, list herms, int nthreads=1, bool deterministic=False, \
+    list rolls=None, bool half=False, np.ndarray out=None, \
+    dict workspace=None):
+        """
+        Grids vis onto an N-D grid of the given shape, with the grid cell i
+        along axis n at mins[n] + i*ds[n]. kernels holds an (index, values)
+        pair from get_gcf for each axis, and herms a flag for each axis that
+        is to be Hermitian symmetrized. If out is given, the grid is made in
+        out (which must have the shape and dtype of the grid) instead of a
+        new array. workspace is a dict in which the per thread grids used
+        when gridding with several threads are kept for reuse.
+        """
 
-                gcf_val = gcf_kaiser(xg-xval, Dx, beta)
+        cdef Py_ssize_t ndim = len(kernels)
 
-                vis2[kndx] = visval*gcf_val
+        vis = np.ascontiguousarray(vis, dtype=grid_dtype(vis))
+        gshape = list(shape)
+        if half:
+            gshape[ndim-1] = shape[ndim-1]//2 + 1
+        gshape = tuple(gshape) + np.shape(vis)[1:]
 
-                x2[kndx] = xg
-                y2[kndx] = yval
+        if out is None:
+            out = np.zeros(gshape, dtype=vis.dtype)
+        elif np.shape(out) != gshape or out.dtype != vis.dtype:
+            raise TypeError('out must have the shape and dtype of the grid.')
+        else:
+            out.fill(0)
 
+        return add_nd_gcf(out, kernels, vis, shape, mins, ds, herms, \
+            nthreads, deterministic, rolls, workspace)
 
 
-################################################################################
-# 1D functions
-################################################################################
+def get_sample_order(list kernels, list shape, list rolls=None, \
+    str method='tile', int tile=16):
+        """
+        Returns the permutation that sorts samples, given their precomputed
+        kernels (see get_gcf) on a grid of the given shape, so that
+        consecutive samples touch nearby grid cells. With method='tile' the
+        samples are sorted by the tile of tile**N cells that the centre of
+        their kernel falls in, with the tiles in C order, and with
+        method='morton' along a Morton (Z order) curve through the grid. If
+        rolls is given, the grid is stored rolled (see grid_nd_gcf) and the
+        samples are sorted by the stored positions. The order of samples in
+        the same tile (or cell) is kept.
+        """
 
-def grid_1d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[CTYPE_t,ndim=1] vis, \
-    double du, int Nu, double umin, double alpha, int W, bool hermitianize):
+        cdef Py_ssize_t n, b, ndim = len(kernels)
+
+        check_ndim(ndim)
+        if tile < 1:
+            raise TypeError('tile must be a positive integer.')
+
+        # the stored position of the kernel centre of each sample
+        cells = []
+        for n in range(ndim):
+            ndx, gcf = kernels[n]
+            c = np.clip(ndx + np.shape(gcf)[1]//2, 0, shape[n]-1)
+            cells += [((c + get_roll(rolls, n, shape[n])) % shape[n]).astype(\
+                np.int64)]
+
+        key = np.zeros(len(cells[0]), dtype=np.int64)
+        if method == 'tile':
+            for n in range(ndim):
+                key = key*((shape[n] + tile - 1)//tile) + cells[n]//tile
+        elif method == 'morton':
+            # interleave the bits of the cell indices, dropping the lowest
+            # bits if they do not all fit in the key
+            nbits = max([int(shape[n]-1).bit_length() for n in range(ndim)])
+            for b in range(nbits-1, max(nbits - 63//ndim, 0) - 1, -1):
+                for n in range(ndim):
+                    key = (key << 1) | ((cells[n] >> b) & 1)
+        else:
+            raise Exception("method must be either 'tile' or 'morton'.")
+
+        return np.argsort(key, kind='stable')
+
+
+def add_nd_gcf(np.ndarray gv, list kernels, np.ndarray vis, list shape, \
+    list mins, list ds, list herms, int nthreads=1, \
+    bool deterministic=False, list rolls=None, dict workspace=None):
         """
-        Grid the data in w, Qvix, Uvis in 1D (x) and duplicate orthogonal axes
+        As grid_nd_gcf, but adds vis to the existing C contiguous grid gv
+        (complex64 or complex128, possibly with half of the last axis) and
+        returns it. This allows data to be gridded a chunk at a time.
         """
-        cdef int N = u.shape[0]
-        cdef double Du = W*du
 
-        cdef Py_ssize_t indx, undx, kndx
-        cdef double uval, uref, tu, gcf_val
-        cdef CTYPE_t visval
-        cdef double temp = 0.
+        cdef Py_ssize_t n, ndim = len(kernels)
 
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] ug = \
-            np.zeros(N*W, dtype=DTYPE)
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] visg = \
-            np.zeros(N*W, dtype=CTYPE)
+        if not gv.flags.c_contiguous or \
+            (gv.dtype != np.complex64 and gv.dtype != CTYPE):
+                raise TypeError('gv must be a C contiguous complex64 or '+\
+                    'complex128 array.')
+        if np.shape(gv)[ndim:] != np.shape(vis)[1:]:
+            raise TypeError('gv and vis must have the same channel axes.')
 
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] gv = \
-            np.zeros(Nu, dtype=CTYPE) # output array
+        vis = np.ascontiguousarray(vis, dtype=gv.dtype)
+        kernels = [(np.ascontiguousarray(ndx, dtype=ITYPE), \
+            np.ascontiguousarray(gcf, dtype=DTYPE)) for ndx, gcf in kernels]
 
-        # From Beatty et al. (2005)
-        cdef double beta = get_beta(W, alpha)
+        add_gcf(gv, kernels, vis, [get_mirror(mins[n], ds[n]) for n in \
+            range(ndim)], herms, nthreads, deterministic, rolls, shape, \
+            workspace)
 
-        # do convolution
-        for indx in range(N):
+        return gv
 
-            visval = vis[indx]
-            uval = u[indx]
 
-            uref = ceil((uval - 0.5*W*du - umin)/du)*du + umin
+def degrid_nd_gcf(list kernels, np.ndarray regVis, int nthreads=1, \
+    list rolls=None, np.ndarray out=None, list shape=None):
+        """
+        Degrids the N-D grid regVis, with kernels holding an (index, values)
+        pair from get_gcf for each axis. If out is given, the samples are
+        written to out (C contiguous, of shape (nvis,) plus the channel axes
+        of regVis and of the same dtype) instead of a new array. shape is the
+        shape of the grid, which defaults to that of regVis. If regVis is
+        shorter along an axis, it holds only the cells stored at the positions
+        that fit in it (see add_nd_gcf), and the other cells are taken as
+        zero, so that a grid can be degridded a slab at a time.
+        """
 
-            for undx in range(W):
+        return sample_gcf(regVis, kernels, nthreads, rolls, out, shape)
 
-                tu = uref + undx*du
-                kndx = indx*W + undx
 
-                gcf_val = gcf_kaiser(tu-uval, Du, beta)
+def grid_1d_gcf(np.ndarray[ITYPE_t,ndim=1] undx, \
+    np.ndarray[DTYPE_t,ndim=2,mode='c'] ugcf, \
+    np.ndarray vis, int Nu, double umin, double du, \
+    bool hflag_u, int nthreads=1, bool deterministic=False, list rolls=None, \
+    bool half=False, np.ndarray out=None, dict workspace=None):
 
-                visg[kndx] = visval*gcf_val
-                ug[kndx] = tu
+        return grid_nd_gcf([(undx, ugcf)], vis, [Nu], [umin], [du], \
+            [hflag_u], nthreads, deterministic, rolls, half, out, workspace)
 
-        # sample onto grid
-        for indx in range(N*W):
-            # compute the location for the visibility in the visibility cube
-            temp = (ug[indx] - umin)/du + 0.5
-            undx = int(temp)
 
-            if (undx>=0 and undx<Nu):
-                    gv[undx] = gv[undx] + visg[indx]
+def degrid_1d_gcf(np.ndarray[ITYPE_t,ndim=1] undx, \
+    np.ndarray[DTYPE_t,ndim=2] ugcf, np.ndarray regVis, int nthreads=1, \
+    list rolls=None, np.ndarray out=None):
 
-            if hermitianize:
-                temp = (-1.*ug[indx] - umin)/du + 0.5
-                undx = int(temp)
+        return sample_gcf(regVis, [(undx, ugcf)], nthreads, rolls, out)
 
-                if (undx>=0 and undx<Nu):
-                    gv[undx] = gv[undx] + visg[indx].conjugate()
 
-        return gv
+def grid_2d_gcf(np.ndarray[ITYPE_t,ndim=1] undx, \
+    np.ndarray[DTYPE_t,ndim=2,mode='c'] ugcf, \
+    np.ndarray[ITYPE_t,ndim=1] vndx, \
+    np.ndarray[DTYPE_t,ndim=2,mode='c'] vgcf, \
+    np.ndarray vis, int Nu, double umin, double du, \
+    int Nv, double vmin, double dv, bool hflag_u, bool hflag_v, \
+    int nthreads=1, bool deterministic=False, list rolls=None, \
+    bool half=False, np.ndarray out=None, dict workspace=None):
 
-def degrid_1d(np.ndarray[DTYPE_t,ndim=1] u, np.ndarray[CTYPE_t, ndim=1] regVis,\
-    double du, int Nu, double umin, double alpha, int W):
+        return grid_nd_gcf([(undx, ugcf), (vndx, vgcf)], vis, [Nu, Nv], \
+            [umin, vmin], [du, dv], [hflag_u, hflag_v], nthreads, \
+            deterministic, rolls, half, out, workspace)
 
-        cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] ugrid = \
-            np.arange(0.,Nu,1.)*du + umin
 
-        cdef int nvis = u.shape[0]
+def degrid_2d_gcf(np.ndarray[ITYPE_t,ndim=1] undx, \
+    np.ndarray[DTYPE_t,ndim=2] ugcf, np.ndarray[ITYPE_t,ndim=1] vndx, \
+    np.ndarray[DTYPE_t,ndim=2] vgcf, np.ndarray regVis, int nthreads=1, \
+    list rolls=None, np.ndarray out=None):
 
-        cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] Vis = \
-            np.zeros(nvis, dtype=CTYPE)
+        return sample_gcf(regVis, [(undx, ugcf), (vndx, vgcf)], nthreads, \
+            rolls, out)
 
-        # From Beatty et al. (2005)
-        cdef double beta = get_beta(W, alpha)
-        # Grid in u and v
-        cdef double Du = W*du
 
-        cdef Py_ssize_t i, j, urang, k
+def grid_3d_gcf(np.ndarray[ITYPE_t,ndim=1] undx, \
+    np.ndarray[DTYPE_t,ndim=2,mode='c'] ugcf, \
+    np.ndarray[ITYPE_t,ndim=1] vndx, \
+    np.ndarray[DTYPE_t,ndim=2,mode='c'] vgcf, \
+    np.ndarray[ITYPE_t,ndim=1] wndx, \
+    np.ndarray[DTYPE_t,ndim=2,mode='c'] wgcf, \
+    np.ndarray vis, int Nu, double umin, double du, \
+    int Nv, double vmin, double dv, int Nw, double wmin, double dw, \
+    bool hflag_u, bool hflag_v, bool hflag_w, int nthreads=1, \
+    bool deterministic=False, list rolls=None, bool half=False, \
+    np.ndarray out=None, dict workspace=None):
 
-        cdef double gcf_val
+        return grid_nd_gcf([(undx, ugcf), (vndx, vgcf), (wndx, wgcf)], vis, \
+            [Nu, Nv, Nw], [umin, vmin, wmin], [du, dv, dw], \
+            [hflag_u, hflag_v, hflag_w], nthreads, deterministic, rolls, half, \
+            out, workspace)
 
-        for k in range(nvis):
 
-            urang = int(np.ceil((u[k] - 0.5*Du - umin)/du))
+def degrid_3d_gcf(np.ndarray[ITYPE_t,ndim=1] undx, \
+    np.ndarray[DTYPE_t,ndim=2] ugcf, np.ndarray[ITYPE_t,ndim=1] vndx, \
+    np.ndarray[DTYPE_t,ndim=2] vgcf, np.ndarray[ITYPE_t,ndim=1] wndx, \
+    np.ndarray[DTYPE_t,ndim=2] wgcf, np.ndarray regVis, int nthreads=1, \
+    list rolls=None, np.ndarray out=None):
 
-            for i in range(urang, urang+W):
-                if (i<Nu and i>=0):
-                    #convolution kernel for position i
-                    gcf_val = gcf_kaiser(u[k]-ugrid[i], Du, beta)
-                    #sampling back to visibility point k
-                    Vis[k] = Vis[k] + regVis[i]*gcf_val
+        return sample_gcf(regVis, [(undx, ugcf), (vndx, vgcf), \
+            (wndx, wgcf)], nthreads, rolls, out)
 
-        return Vis
+################################################################################
+# Kernel tables
+################################################################################
 
+# tabulated gridding kernels, keyed on (W, alpha, tol)
+_kernel_tables = {}
 
-def get_grid_corr_1d(double dx, int Nx, double xmin, double du, int W, \
-    double alpha):
+def get_kernel_table(int W, double alpha, double tol=1e-7):
+    """
+    Returns the Kaiser-Bessel gridding kernel tabulated on [0, 1], in units of
+    half the kernel width. The table is refined until linear interpolation
+    between its entries reproduces the kernel to within tol. Tables are
+    cached, so each is only built once per (W, alpha, tol). If tol <= 0, an
+    empty table is returned and the kernel is evaluated exactly.
+    """
 
-        cdef np.ndarray[DTYPE_t,ndim=1, mode='c'] gridcorr = np.zeros(Nx,\
-            dtype=DTYPE)
-        cdef np.ndarray[DTYPE_t,ndim=1, mode='c'] x = np.arange(Nx,\
-            dtype=DTYPE)*dx + xmin
+    if tol <= 0:
+        return np.zeros(0, dtype=DTYPE)
 
-        cdef double beta = get_beta(W, alpha)
+    key = (W, alpha, tol)
+    if key in _kernel_tables:
+        return _kernel_tables[key]
 
-        cdef Py_ssize_t i
+    cdef double beta = get_beta(W, alpha)
 
-        for i in range(Nx):
-            gridcorr[i] = inv_gcf_kaiser(x[i], du, W, beta)
+    cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tab
+    cdef int ntab = 128
+    cdef double err, mid
+    cdef Py_ssize_t i
 
-        return gridcorr
+    while True:
+        tab = np.zeros(ntab+1, dtype=DTYPE)
+        for i in range(ntab+1):
+            tab[i] = gcf_kaiser(0.5*i/ntab, 1., beta)
 
+        # linear interpolation is least accurate half way between entries
+        err = 0.
+        for i in range(ntab):
+            mid = gcf_kaiser(0.5*(i+0.5)/ntab, 1., beta)
+            err = max(err, abs(mid - 0.5*(tab[i] + tab[i+1])))
 
-def test_gcf_kaiser(double k, double dk, int W, double alpha):
+        if err <= tol or ntab >= 4194304:
+            break
+        ntab = 2*ntab
 
-    cdef double beta = get_beta(W, alpha)
-    return gcf_kaiser(k, dk*W, beta)
+    _kernel_tables[key] = tab
+
+    return tab
 
 ################################################################################
 # Common functions
 ################################################################################
 
-cdef inline double get_beta(int W, double alpha):
+cdef inline double get_beta(int W, double alpha) nogil:
     cdef double pi = 3.141592653589793
     # see Beatty et al. (2005)
     cdef double beta = pi*sqrt((W*W/alpha/alpha)*(alpha - 0.5)*(alpha - 0.5) \
@@ -672,13 +592,15 @@ cdef inline double get_beta(int W, double alpha):
 
     return beta
 
-cdef inline double gcf_kaiser(double k, double Dk, double beta):
+cdef inline double gcf_kaiser(double k, double Dk, double beta) \
+    except -1 nogil:
 
     cdef double temp3 = 2.*k/Dk
 
     if (1 - temp3)*(1 + temp3) < -1e-12:
 #        print "There is an issue with the gridding code!"
-        raise Exception("There is an issue with the gridding code!")
+        with gil:
+            raise Exception("There is an issue with the gridding code!")
 
     temp3 = sqrt(abs((1 - temp3)*(1 + temp3)))
 
@@ -690,6 +612,610 @@ cdef inline double gcf_kaiser(double k, double Dk, double beta):
     return C
 
 
+cdef inline double gcf_lookup(double k, double Dk, double beta, double* tab, \
+    int ntab) except -1 nogil:
+    """
+    The gridding kernel interpolated from a kernel table with ntab intervals
+    (see get_kernel_table). Falls back on gcf_kaiser if the table is empty.
+    """
+
+    if ntab < 1:
+        return gcf_kaiser(k, Dk, beta)
+
+    cdef double temp3 = 2.*k/Dk
+    if temp3 < 0:
+        temp3 = -temp3
+
+    if temp3 > 1. + 1e-12:
+        with gil:
+            raise Exception("There is an issue with the gridding code!")
+
+    temp3 = temp3*ntab
+    cdef int i = <int>temp3
+    if i >= ntab:
+        return tab[ntab]
+
+    temp3 = temp3 - i
+
+    return tab[i] + temp3*(tab[i+1] - tab[i])
+
+
+cdef inline Py_ssize_t get_mirror(double umin, double du) nogil:
+    """
+    Index of the grid cell holding the mirrored (-u) position of grid cell 0,
+    so that the mirror of grid cell i is cell get_mirror(umin, du) - i.
+    """
+    return <Py_ssize_t>floor(-2.*umin/du + 0.5)
+
+
+cdef inline Py_ssize_t point_gcf(double u, double du, double umin, int W, \
+    double beta, double* tab, int ntab, double* gcf) except? -1 nogil:
+    """
+    Fills gcf with the W kernel values for a point at u, and returns the index
+    of the first grid cell that they belong to.
+    """
+
+    cdef double Du = W*du
+    cdef Py_ssize_t urang = <Py_ssize_t>ceil((u - 0.5*Du - umin)/du)
+    cdef Py_ssize_t i
+
+    for i in range(W):
+        gcf[i] = gcf_lookup(u - ((urang + i)*du + umin), Du, beta, tab, ntab)
+
+    return urang
+
+
+cdef inline Py_ssize_t roll_ndx(Py_ssize_t i, Py_ssize_t N, Py_ssize_t R, \
+    Py_ssize_t S) noexcept nogil:
+    """
+    The position at which grid cell i is stored along an axis of N cells that
+    is rolled by R (0 <= R < N), or -1 if cell i lies outside the grid or is
+    not stored (position >= S).
+    """
+    if i<0 or i>=N:
+        return -1
+    i = i + R
+    if i>=N:
+        i = i - N
+    if i>=S:
+        return -1
+    return i
+
+
+cdef inline void scatter(grid_t* g, cplx_t* gv, kern_t* kern, Py_ssize_t k, \
+    cplx_t* vis, Py_ssize_t ulo, Py_ssize_t uhi) noexcept nogil:
+    """
+    Adds the kernel weighted copies of vis (the nchan values of sample k) to
+    the grid gv, along with their complex conjugates at the mirrored positions
+    where requested. The kernel weights are computed once for all channels.
+    Only grid cells stored at a first axis index in [ulo, uhi) are touched,
+    so that separate threads can own separate slabs of the grid.
+
+    The W**ndim footprint is visited axis by axis, keeping the offsets of the
+    direct and mirrored cells and the product of the kernel weights of the
+    outer axes, so that the innermost axis is a plain loop whatever ndim is.
+    """
+
+    cdef Py_ssize_t last = g.ndim - 1, nchan = g.nchan
+    cdef bint herm = False
+
+    # position in the footprint along each outer axis, and the offsets and
+    # weights of the cells selected along the axes before axis n (-1 for an
+    # offset that lies outside the grid or is not stored)
+    cdef Py_ssize_t cnt[MAXDIM]
+    cdef Py_ssize_t off[MAXDIM]
+    cdef Py_ssize_t moff[MAXDIM]
+    cdef double wt[MAXDIM]
+
+    cdef Py_ssize_t n, c, ch, i, im, rang, ndx
+    cdef double* gcf
+    cdef double val
+
+    # the innermost axis, kept in locals as gv may alias g
+    cdef Py_ssize_t N = g.N[last], R = g.R[last], S = g.S[last], M = g.M[last]
+    cdef bint hlast = g.herm[last]
+    cdef Py_ssize_t lrang = kern[last].ndx[k*kern[last].ndx_stride]
+    cdef double* lgcf = kern[last].gcf + k*kern[last].gcf_stride
+    cdef int W = kern[last].W
+    cdef Py_ssize_t base, mbase
+    cdef double w
+
+    for n in range(g.ndim):
+        herm = herm or g.herm[n]
+
+    off[0] = 0
+    moff[0] = 0 if herm else -1
+    wt[0] = 1.
+    cnt[0] = -1
+    n = 0
+
+    while n >= 0:
+        if n == last:
+            base = off[n]*S if off[n]>=0 else -1
+            mbase = moff[n]*S if moff[n]>=0 else -1
+            w = wt[n]
+            for c in range(W):
+                i = lrang + c
+                im = M - i if hlast else i
+                i = roll_ndx(i, N, R, S)
+                im = roll_ndx(im, N, R, S)
+                if last == 0:
+                    if i<ulo or i>=uhi: i = -1
+                    if im<ulo or im>=uhi: im = -1
+                val = w*lgcf[c]
+
+                if base>=0 and i>=0:
+                    ndx = (base + i)*nchan
+                    for ch in range(nchan):
+                        gv[ndx+ch] = gv[ndx+ch] + vis[ch]*val
+
+                if mbase>=0 and im>=0:
+                    ndx = (mbase + im)*nchan
+                    for ch in range(nchan):
+                        gv[ndx+ch] = gv[ndx+ch] + vis[ch].conjugate()*val
+            n = n - 1
+            continue
+
+        rang = kern[n].ndx[k*kern[n].ndx_stride]
+        gcf = kern[n].gcf + k*kern[n].gcf_stride
+        cnt[n] = cnt[n] + 1
+        if cnt[n] >= kern[n].W:
+            n = n - 1
+            continue
+
+        i = rang + cnt[n]
+        im = g.M[n] - i if g.herm[n] else i
+        i = roll_ndx(i, g.N[n], g.R[n], g.S[n])
+        im = roll_ndx(im, g.N[n], g.R[n], g.S[n])
+        if n == 0:
+            if i<ulo or i>=uhi: i = -1
+            if im<ulo or im>=uhi: im = -1
+
+        off[n+1] = off[n]*g.S[n] + i if off[n]>=0 and i>=0 else -1
+        moff[n+1] = moff[n]*g.S[n] + im if moff[n]>=0 and im>=0 else -1
+        if off[n+1]<0 and moff[n+1]<0:
+            continue
+
+        wt[n+1] = wt[n]*gcf[cnt[n]]
+        n = n + 1
+        cnt[n] = -1
+
+
+cdef void grid_kernels(grid_t* g, cplx_t* gv, kern_t* kern, cplx_t* vis, \
+    Py_ssize_t nvis, int nthreads, ITYPE_t* slabs, cplx_t* tiles) \
+    noexcept nogil:
+    """
+    Scatters all samples onto the grid gv. With more than one thread, either
+    each thread owns the slab [slabs[t], slabs[t+1]) of the grid and visits
+    every sample (deterministic, the result is identical to the serial one),
+    or each thread grids its share of the samples onto its own copy of the
+    grid (tiles, thread 0 uses the grid itself) and the copies are summed at
+    the end.
+    """
+
+    cdef Py_ssize_t ncell = g.nchan
+    cdef Py_ssize_t n, k, t, s, c
+    cdef cplx_t* tgv
+    cdef double complex acc
+
+    for n in range(g.ndim):
+        ncell = ncell*g.S[n]
+
+    if nthreads <= 1:
+        for k in range(nvis):
+            scatter(g, gv, kern, k, vis + k*g.nchan, 0, g.S[0])
+
+    elif slabs != NULL:
+        for t in prange(nthreads, num_threads=nthreads, schedule='static', \
+            chunksize=1):
+            for k in range(nvis):
+                scatter(g, gv, kern, k, vis + k*g.nchan, slabs[t], \
+                    slabs[t+1])
+
+    else:
+        for t in prange(nthreads, num_threads=nthreads, schedule='static', \
+            chunksize=1):
+            tgv = gv
+            if t > 0:
+                tgv = tiles + (t-1)*ncell
+            for k in range(t*nvis//nthreads, (t+1)*nvis//nthreads):
+                scatter(g, tgv, kern, k, vis + k*g.nchan, 0, g.S[0])
+
+        # reduce the tiles, always in the same order
+        for c in prange(ncell, num_threads=nthreads, schedule='static'):
+            acc = gv[c]
+            for s in range(nthreads-1):
+                acc = acc + tiles[s*ncell + c]
+            gv[c] = acc
+
+
+cdef int check_ndim(Py_ssize_t ndim) except -1:
+    if ndim < 1 or ndim > MAXDIM:
+        raise Exception('Gridding is only supported for 1 to '+str(MAXDIM)+\
+            ' dimensions.')
+    return 0
+
+
+cdef int grid_points(np.ndarray gv, list coords, list d, list mins, \
+    np.ndarray[CTYPE_t,ndim=1] vis, list herms, double alpha, int W, \
+    double tol, int nthreads, bint deterministic) except -1:
+    """
+    Adds vis, defined at the coordinates in coords (one array for each axis of
+    the N-D grid gv), to gv. Serially, the kernel for each point is computed
+    into a small scratch array and added to the grid straight away. With
+    several threads, the kernels for GRID_CHUNK points at a time are computed
+    first and then gridded in parallel (see add_gcf).
+    """
+
+    cdef Py_ssize_t ndim = gv.ndim
+    cdef Py_ssize_t nvis = vis.shape[0]
+    cdef Py_ssize_t n, k, k0, k1
+    cdef CTYPE_t* pvis
+
+    cdef grid_t g
+    cdef kern_t kern[MAXDIM]
+    cdef ITYPE_t rang[MAXDIM]
+    cdef double* pc[MAXDIM]
+    cdef double dn[MAXDIM]
+    cdef double mn[MAXDIM]
+
+    check_ndim(ndim)
+
+    # holds the W kernel values along each axis for the current point, the
+    # W**ndim footprint is their outer product and is never stored
+    cdef np.ndarray[DTYPE_t, ndim=2, mode='c'] scratch = \
+        np.zeros((ndim, W), dtype=DTYPE)
+
+    # From Beatty et al. (2005)
+    cdef double beta = get_beta(W, alpha)
+    cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tab = \
+        get_kernel_table(W, alpha, tol)
+    cdef double* ptab = <double*>tab.data
+    cdef int ntab = tab.shape[0] - 1
+
+    # index of the grid cell holding the mirrored value of grid cell 0
+    mirrors = [get_mirror(mins[n], d[n]) for n in range(ndim)]
+
+    if nthreads > 1:
+        for k0 in range(0, nvis, GRID_CHUNK):
+            k1 = min(k0 + GRID_CHUNK, nvis)
+            kernels = [get_gcf(coords[n][k0:k1], d[n], mins[n], alpha, W, \
+                tol) for n in range(ndim)]
+            add_gcf(gv, kernels, np.ascontiguousarray(vis[k0:k1]), mirrors, \
+                herms, nthreads, deterministic)
+        return 0
+
+    coords = [np.ascontiguousarray(c, dtype=DTYPE) for c in coords]
+    vis = np.ascontiguousarray(vis)
+    pvis = <CTYPE_t*>vis.data
+
+    g.ndim = ndim
+    g.nchan = 1
+    for n in range(ndim):
+        g.N[n] = gv.shape[n]
+        g.S[n] = g.N[n]
+        g.M[n] = mirrors[n]
+        g.R[n] = 0
+        g.herm[n] = herms[n]
+        kern[n].ndx = &rang[n]
+        kern[n].ndx_stride = 0
+        kern[n].gcf = &scratch[n, 0]
+        kern[n].gcf_stride = 0
+        kern[n].W = W
+        pc[n] = <double*>(<np.ndarray>coords[n]).data
+        dn[n] = d[n]
+        mn[n] = mins[n]
+
+    for k in range(nvis):
+        for n in range(ndim):
+            rang[n] = point_gcf(pc[n][k], dn[n], mn[n], W, beta, ptab, ntab, \
+                kern[n].gcf)
+        scatter(&g, <CTYPE_t*>gv.data, kern, 0, pvis + k, 0, g.S[0])
+
+    return 0
+
+
+cdef inline void set_kern(kern_t* kern, \
+    np.ndarray[ITYPE_t,ndim=1,mode='c'] ndx, \
+    np.ndarray[DTYPE_t,ndim=2,mode='c'] gcf):
+    """
+    Points kern at precomputed kernel indices and values (see get_gcf).
+    """
+    kern.ndx = <ITYPE_t*>ndx.data
+    kern.ndx_stride = 1
+    kern.gcf = <double*>gcf.data
+    kern.gcf_stride = gcf.shape[1]
+    kern.W = gcf.shape[1]
+
+
+cdef inline Py_ssize_t get_roll(list rolls, Py_ssize_t n, Py_ssize_t N):
+    """
+    The roll along axis n of a grid with N cells along that axis, in [0, N).
+    """
+    if rolls is None or N == 0:
+        return 0
+    return rolls[n] % N
+
+
+cdef int add_gcf(np.ndarray gv, list kernels, np.ndarray vis, list mirrors, \
+    list herms, int nthreads, bint deterministic, list rolls=None, \
+    list shape=None, dict workspace=None) except -1:
+    """
+    Adds vis to the N-D grid gv using the precomputed kernels, a list holding
+    an (index, values) pair for each grid axis. vis is C contiguous and of
+    the same (complex64 or complex128) dtype as gv, any axes after the first
+    are channels, which gv must also have as its last axes. If rolls is
+    given, gv is filled as np.roll(grid, rolls) would be. shape is the shape
+    of the grid, which defaults to that of gv. If gv is shorter along an
+    axis, only the cells stored at positions that fit in gv are kept. The per
+    thread grids are kept in workspace under 'tiles' if it is given.
+    """
+
+    cdef grid_t g
+    cdef kern_t kern[MAXDIM]
+    cdef Py_ssize_t n, ndim = len(kernels)
+    cdef Py_ssize_t nvis = vis.shape[0]
+
+    cdef np.ndarray[ITYPE_t, ndim=1, mode='c'] slabs
+    cdef np.ndarray tiles
+    cdef ITYPE_t* pslabs = NULL
+    cdef void* ptiles = NULL
+    cdef bint single = gv.dtype == np.complex64
+
+    check_ndim(ndim)
+    if vis.dtype != gv.dtype:
+        raise TypeError('vis and gv must have the same dtype.')
+
+    g.ndim = ndim
+    g.nchan = vis.size//nvis if nvis > 0 else 0
+    for n in range(ndim):
+        set_kern(&kern[n], kernels[n][0], kernels[n][1])
+        g.S[n] = gv.shape[n]
+        g.N[n] = g.S[n] if shape is None else shape[n]
+        g.M[n] = mirrors[n]
+        g.herm[n] = herms[n]
+        g.R[n] = get_roll(rolls, n, g.N[n])
+
+    if nthreads > 1 and deterministic:
+        # split the first axis so that each slab gets a similar number of
+        # samples (including the mirrored ones)
+        rows = np.clip(kernels[0][0] + kern[0].W//2, 0, g.N[0]-1)
+        if g.herm[0]:
+            rows = np.concatenate((rows, np.clip(g.M[0] - rows, 0, g.N[0]-1)))
+        rows = np.minimum((rows + g.R[0]) % g.N[0], g.S[0]-1)
+        cum = np.cumsum(np.bincount(rows, minlength=g.S[0]))
+        slabs = np.searchsorted(cum, \
+            cum[-1]*np.arange(nthreads+1)/float(nthreads)).astype(ITYPE)
+        slabs[0] = 0
+        slabs[nthreads] = g.S[0]
+        pslabs = <ITYPE_t*>slabs.data
+
+    elif nthreads > 1:
+        tiles = None if workspace is None else workspace.get('tiles')
+        if tiles is None or tiles.size != (nthreads-1)*gv.size or \
+            tiles.dtype != gv.dtype:
+                tiles = np.empty((nthreads-1)*gv.size, dtype=gv.dtype)
+                if workspace is not None:
+                    workspace['tiles'] = tiles
+        tiles.fill(0)
+        ptiles = tiles.data
+
+    with nogil:
+        if single:
+            grid_kernels(&g, <np.complex64_t*>gv.data, kern, \
+                <np.complex64_t*>vis.data, nvis, nthreads, pslabs, \
+                <np.complex64_t*>ptiles)
+        else:
+            grid_kernels(&g, <CTYPE_t*>gv.data, kern, <CTYPE_t*>vis.data, \
+                nvis, nthreads, pslabs, <CTYPE_t*>ptiles)
+
+    return 0
+
+
+cdef inline void gather(grid_t* g, cplx_t* gv, kern_t* kern, Py_ssize_t k, \
+    cplx_t* vis) noexcept nogil:
+    """
+    Adds the kernel weighted sum of the values of the grid gv around sample k
+    to vis (the nchan values of sample k), i.e. the inverse operation of
+    scatter (without the Hermitian mirroring). The footprint is visited as in
+    scatter, and the sum is accumulated in double precision.
+    """
+
+    cdef Py_ssize_t last = g.ndim - 1, nchan = g.nchan
+
+    cdef Py_ssize_t cnt[MAXDIM]
+    cdef Py_ssize_t off[MAXDIM]
+    cdef double wt[MAXDIM]
+
+    cdef Py_ssize_t n, c, ch, i, rang, base
+    cdef double* gcf
+    cdef double w
+    cdef double complex acc
+
+    # the innermost axis
+    cdef Py_ssize_t N = g.N[last], R = g.R[last], S = g.S[last]
+    cdef Py_ssize_t lrang = kern[last].ndx[k*kern[last].ndx_stride]
+    cdef double* lgcf = kern[last].gcf + k*kern[last].gcf_stride
+    cdef int W = kern[last].W
+
+    for ch in range(nchan):
+        acc = vis[ch]
+        off[0] = 0
+        wt[0] = 1.
+        cnt[0] = -1
+        n = 0
+
+        while n >= 0:
+            if n == last:
+                base = off[n]*S
+                w = wt[n]
+                for c in range(W):
+                    i = roll_ndx(lrang + c, N, R, S)
+                    if i>=0:
+                        acc = acc + gv[(base + i)*nchan + ch]*(w*lgcf[c])
+                n = n - 1
+                continue
+
+            rang = kern[n].ndx[k*kern[n].ndx_stride]
+            gcf = kern[n].gcf + k*kern[n].gcf_stride
+            cnt[n] = cnt[n] + 1
+            if cnt[n] >= kern[n].W:
+                n = n - 1
+                continue
+
+            i = roll_ndx(rang + cnt[n], g.N[n], g.R[n], g.S[n])
+            if i<0:
+                continue
+
+            off[n+1] = off[n]*g.S[n] + i
+            wt[n+1] = wt[n]*gcf[cnt[n]]
+            n = n + 1
+            cnt[n] = -1
+
+        vis[ch] = acc
+
+
+cdef np.ndarray sample_gcf(np.ndarray regVis, list kernels, int nthreads, \
+    list rolls=None, np.ndarray out=None, list shape=None):
+    """
+    Degrids the N-D grid regVis using the precomputed kernels, a list holding
+    an (index, values) pair for each grid axis. Any further axes of regVis
+    are channels, which are kept as the last axes of the result. Each sample
+    is an independent gather, so the samples are simply split between
+    nthreads threads. If rolls is given, regVis is taken to be
+    np.roll(grid, rolls) and the grid is degridded. A complex64 regVis gives
+    complex64 samples, anything else complex128. The samples are written to
+    out if it is given. shape is the shape of the grid if regVis holds only
+    part of it (see degrid_nd_gcf).
+    """
+
+    cdef grid_t g
+    cdef kern_t kern[MAXDIM]
+    cdef Py_ssize_t n, k, ndim = len(kernels)
+    cdef Py_ssize_t nvis = kernels[0][0].shape[0]
+    cdef bint single = regVis.dtype == np.complex64
+
+    check_ndim(ndim)
+
+    regVis = np.ascontiguousarray(regVis, \
+        dtype=np.complex64 if single else CTYPE)
+
+    cdef np.ndarray Vis = out
+    if Vis is None:
+        Vis = np.zeros((nvis,) + np.shape(regVis)[ndim:], dtype=regVis.dtype)
+    elif np.shape(Vis) != (nvis,) + np.shape(regVis)[ndim:] or \
+        Vis.dtype != regVis.dtype or not Vis.flags.c_contiguous:
+            raise TypeError('out must be a C contiguous array of the shape '+\
+                'and dtype of the samples.')
+    else:
+        Vis.fill(0)
+    cdef np.complex64_t* pvis32 = <np.complex64_t*>Vis.data
+    cdef np.complex64_t* pgv32 = <np.complex64_t*>regVis.data
+    cdef CTYPE_t* pvis = <CTYPE_t*>Vis.data
+    cdef CTYPE_t* pgv = <CTYPE_t*>regVis.data
+
+    kernels = [(np.ascontiguousarray(ndx, dtype=ITYPE), \
+        np.ascontiguousarray(gcf, dtype=DTYPE)) for ndx, gcf in kernels]
+
+    g.ndim = ndim
+    g.nchan = np.prod(np.shape(regVis)[ndim:], dtype=ITYPE)
+    for n in range(ndim):
+        set_kern(&kern[n], kernels[n][0], kernels[n][1])
+        g.S[n] = regVis.shape[n]
+        g.N[n] = g.S[n] if shape is None else shape[n]
+        g.R[n] = get_roll(rolls, n, g.N[n])
+
+    if single:
+        for k in prange(nvis, nogil=True, num_threads=nthreads, \
+            schedule='static'):
+            gather(&g, pgv32, kern, k, pvis32 + k*g.nchan)
+    else:
+        for k in prange(nvis, nogil=True, num_threads=nthreads, \
+            schedule='static'):
+            gather(&g, pgv, kern, k, pvis + k*g.nchan)
+
+    return Vis
+
+
+cdef np.ndarray degrid_points(np.ndarray regVis, list coords, list d, \
+    list mins, double alpha, int W, double tol, int nthreads):
+    """
+    Degrids the N-D grid regVis onto the coordinates in coords (one array for
+    each axis of regVis). The kernel for each point is computed into a small
+    scratch array belonging to the thread handling the point.
+    """
+
+    cdef grid_t g
+    cdef kern_t* kern
+    cdef ITYPE_t* rang
+    cdef Py_ssize_t n, k, t, ndim = regVis.ndim
+    cdef Py_ssize_t nvis = coords[0].shape[0]
+    cdef double* pc[MAXDIM]
+    cdef double dn[MAXDIM]
+    cdef double mn[MAXDIM]
+
+    check_ndim(ndim)
+
+    cdef np.ndarray[CTYPE_t, ndim=1, mode='c'] Vis = \
+        np.zeros(nvis, dtype=CTYPE)
+    cdef CTYPE_t* pvis = <CTYPE_t*>Vis.data
+    cdef CTYPE_t* pgv
+
+    # W kernel values along each axis for the current point of each thread
+    cdef np.ndarray[DTYPE_t, ndim=3, mode='c'] scratch = \
+        np.zeros((nthreads, ndim, W), dtype=DTYPE)
+
+    # From Beatty et al. (2005)
+    cdef double beta = get_beta(W, alpha)
+    cdef np.ndarray[DTYPE_t, ndim=1, mode='c'] tab = \
+        get_kernel_table(W, alpha, tol)
+    cdef double* ptab = <double*>tab.data
+    cdef int ntab = tab.shape[0] - 1
+
+    regVis = np.ascontiguousarray(regVis, dtype=CTYPE)
+    coords = [np.ascontiguousarray(c, dtype=DTYPE) for c in coords]
+    pgv = <CTYPE_t*>regVis.data
+
+    g.ndim = ndim
+    g.nchan = 1
+    for n in range(ndim):
+        g.N[n] = regVis.shape[n]
+        g.S[n] = g.N[n]
+        g.R[n] = 0
+        pc[n] = <double*>(<np.ndarray>coords[n]).data
+        dn[n] = d[n]
+        mn[n] = mins[n]
+
+    kern = <kern_t*>malloc(ndim*nthreads*sizeof(kern_t))
+    rang = <ITYPE_t*>malloc(ndim*nthreads*sizeof(ITYPE_t))
+    if kern == NULL or rang == NULL:
+        free(kern)
+        free(rang)
+        raise MemoryError()
+
+    try:
+        for t in range(nthreads):
+            for n in range(ndim):
+                kern[ndim*t+n].ndx = &rang[ndim*t+n]
+                kern[ndim*t+n].ndx_stride = 0
+                kern[ndim*t+n].gcf = &scratch[t, n, 0]
+                kern[ndim*t+n].gcf_stride = 0
+                kern[ndim*t+n].W = W
+
+        for k in prange(nvis, nogil=True, num_threads=nthreads, \
+            schedule='static'):
+            t = threadid()
+            for n in range(ndim):
+                rang[ndim*t+n] = point_gcf(pc[n][k], dn[n], mn[n], W, beta, \
+                    ptab, ntab, kern[ndim*t+n].gcf)
+            gather(&g, pgv, &kern[ndim*t], 0, pvis + k)
+    finally:
+        free(kern)
+        free(rang)
+
+    return Vis
+
+
 cdef inline double inv_gcf_kaiser(double x, double dk, int W, double beta):
 
     cdef double pi = 3.141592653589793
@@ -0,0 +1,284 @@
+"""
+gridpool.py
+
+This file contains GriddingPool, which grids irregularly spaced data with a
+pool of worker processes instead of (or as well as) the OpenMP threads of the
+gridding module, e.g. to use several sockets at once. The samples are split
+between the workers, each of which grids its share onto its own copy (tile)
+of the grid. The tiles are then summed pairwise, in a tree, and the last sum
+is made in the grid of the calling process, which does the FFT as usual.
+
+The gridding kernels, the data and the tiles are all passed to the workers
+in shared memory (multiprocessing.shared_memory), so nothing but their names
+and shapes is pickled.
+
+A pool is created once and given to gfft or GFFTPlan with their executor
+argument, e.g.
+
+    with GriddingPool(4) as pool:
+        plan = GFFTPlan(in_ax, out_ax, executor=pool)
+        for inp in data:
+            out = plan.execute(inp)
+"""
+
+"""
+Copyright 2012 Michael Bell, Henrik Junklewitz
+
+This file is part of GFFT.
+
+GFFT is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+GFFT is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with GFFT.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+from gfft import gridding
+
+################################################################################
+# Shared arrays
+
+def shared_array(shape, dtype, segments):
+    """
+    Returns an array of the given shape and dtype in a new block of shared
+    memory, and the spec (name, shape, dtype) with which other processes can
+    attach to it (see attach_array). The block is appended to segments, and
+    must be released with release_segments.
+    """
+    dtype = np.dtype(dtype)
+    shape = tuple(int(n) for n in shape)
+    shm = shared_memory.SharedMemory(create=True, \
+        size=max(int(np.prod(shape))*dtype.itemsize, 1))
+    segments.append(shm)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), \
+        (shm.name, shape, dtype.str)
+
+def attach_array(spec, segments):
+    """
+    Returns the array in the shared memory block given by spec (see
+    shared_array). The block is appended to segments, and must be closed
+    (but not unlinked) with release_segments once the array is no longer
+    used.
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    segments.append(shm)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+def release_segments(segments, unlink=False):
+    """
+    Closes the shared memory blocks in segments, and removes them if unlink
+    is True (only in the process that created them). No arrays in them may
+    be used afterwards.
+    """
+    while len(segments) > 0:
+        shm = segments.pop()
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+################################################################################
+# Worker tasks
+
+def _grid_tile(task):
+    """
+    Grids the samples [k0, k1) onto a tile, in a worker process.
+    """
+    kernels, vis, tile, k0, k1, shape, mins, ds, herms, rolls, nthreads, \
+        deterministic = task
+
+    segments = []
+    try:
+        kernels = [(attach_array(ndx, segments)[k0:k1], \
+            attach_array(gcf, segments)[k0:k1]) for ndx, gcf in kernels]
+        vis = attach_array(vis, segments)[k0:k1]
+        tile = attach_array(tile, segments)
+        tile.fill(0)
+        gridding.add_nd_gcf(tile, kernels, vis, shape, mins, ds, herms, \
+            nthreads, deterministic, rolls)
+    finally:
+        kernels = vis = tile = None
+        release_segments(segments)
+
+def _add_tiles(task):
+    """
+    Adds the second of two tiles to the first, in a worker process.
+    """
+    segments = []
+    try:
+        a = attach_array(task[0], segments)
+        b = attach_array(task[1], segments)
+        a += b
+    finally:
+        a = b = None
+        release_segments(segments)
+
+################################################################################
+# The pool
+
+class GriddingPool(object):
+    """
+    GriddingPool
+
+    def GriddingPool(nprocs, start_method=None)
+
+    A pool of nprocs worker processes for gridding, to be passed to gfft or
+    GFFTPlan as their executor argument. start_method is the multiprocessing
+    start method ('fork', 'spawn' or 'forkserver'), by default that of the
+    platform.
+
+    Each worker grids a contiguous share of the samples (in the order given
+    by sort_samples, so that with sorting each share covers a compact part
+    of the grid), using the nthreads and deterministic options of the plan
+    within the worker. Every worker needs a tile the size of the grid, and
+    the tiles are kept in shared memory between calls for grids of the same
+    shape. The tiles are always summed in the same order, so the result is
+    reproducible for a given number of processes, but it can differ from the
+    single process one by rounding errors.
+
+    The kernels of the last plan used are also kept in shared memory, so
+    that repeated calls only copy the data. The pool must be closed with
+    close, or used as a context manager, to stop the workers and free the
+    shared memory.
+    """
+
+    def __init__(self, nprocs, start_method=None):
+
+        if type(nprocs) != int or nprocs < 1:
+            raise TypeError('nprocs must be a positive integer.')
+        if start_method is not None and type(start_method) != str:
+            raise TypeError('start_method must be None or a string.')
+
+        self.nprocs = nprocs
+
+        # The workers must share the resource tracker of this process, which
+        # tracks the shared memory blocks. Forked workers would otherwise
+        # each start their own, which removes the blocks they attached to
+        # when they exit.
+        resource_tracker.ensure_running()
+        self.pool = multiprocessing.get_context(start_method).Pool(nprocs)
+
+        # the shared tiles as (array, spec) pairs, and the specs of the shared
+        # kernels along with the arrays they were copied from
+        self.tiles = None
+        self.tile_segments = []
+        self.kernels = None
+        self.kernel_segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.tiles = None
+        self.kernels = None
+        release_segments(self.tile_segments, unlink=True)
+        release_segments(self.kernel_segments, unlink=True)
+
+    def _share_kernels(self, kernels):
+        """
+        The specs of the kernels copied to shared memory, reusing the last
+        copy if the kernels are the same arrays.
+        """
+        if self.kernels is not None and len(self.kernels[0]) == \
+            len(kernels) and all([a is b for k, l in zip(self.kernels[0], \
+            kernels) for a, b in zip(k, l)]):
+                return self.kernels[1]
+
+        self.kernels = None
+        release_segments(self.kernel_segments, unlink=True)
+        specs = []
+        for ndx, gcf in kernels:
+            pair = []
+            for arr in (ndx, gcf):
+                shared, spec = shared_array(np.shape(arr), \
+                    np.asarray(arr).dtype, self.kernel_segments)
+                shared[...] = arr
+                pair += [spec]
+            specs += [tuple(pair)]
+        self.kernels = (kernels, specs)
+        return specs
+
+    def _share_tiles(self, ntiles, shape, dtype):
+        """
+        ntiles shared tiles of the given shape and dtype, as (array, spec)
+        pairs.
+        """
+        if self.tiles is not None and len(self.tiles) >= ntiles and \
+            self.tiles[0][0].shape == tuple(shape) and \
+            self.tiles[0][0].dtype == dtype:
+                return self.tiles[:ntiles]
+
+        self.tiles = None
+        release_segments(self.tile_segments, unlink=True)
+        self.tiles = [shared_array(shape, dtype, self.tile_segments) \
+            for t in range(ntiles)]
+        return self.tiles
+
+    def grid(self, grid, kernels, vis, shape, mins, ds, herms, rolls=None, \
+        nthreads=1, deterministic=False):
+            """
+            Grids vis onto grid, a C contiguous array holding the grid as
+            for gridding.grid_nd_gcf (i.e. of shape shape, or with half of
+            the last axis, plus the channel axes of vis), which is
+            overwritten. The other arguments are as for grid_nd_gcf.
+            Returns grid.
+            """
+
+            if self.pool is None:
+                raise Exception('The GriddingPool has been closed.')
+
+            nvis = len(vis)
+            ntiles = max(1, min(self.nprocs, nvis))
+            kspecs = self._share_kernels(kernels)
+            tiles = self._share_tiles(ntiles, grid.shape, grid.dtype)
+
+            segments = []
+            try:
+                shared, vspec = shared_array(np.shape(vis), grid.dtype, \
+                    segments)
+                shared[...] = vis
+                shared = None
+
+                self.pool.map(_grid_tile, [(kspecs, vspec, tiles[t][1], \
+                    t*nvis//ntiles, (t+1)*nvis//ntiles, list(shape), \
+                    list(mins), list(ds), list(herms), rolls, nthreads, \
+                    deterministic) for t in range(ntiles)], chunksize=1)
+            finally:
+                release_segments(segments, unlink=True)
+
+            # sum the tiles pairwise until two are left, which are summed
+            # into grid
+            live = list(range(ntiles))
+            while len(live) > 2:
+                self.pool.map(_add_tiles, [(tiles[live[i]][1], \
+                    tiles[live[i+1]][1]) for i in range(0, len(live) - 1, 2)], \
+                    chunksize=1)
+                live = live[::2]
+
+            if len(live) == 2:
+                np.add(tiles[live[0]][0], tiles[live[1]][0], out=grid)
+            else:
+                grid[...] = tiles[live[0]][0]
+
+            return grid
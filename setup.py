@@ -10,7 +10,8 @@ lib_gsl_dir = "/usr/lib64/"
 # Note that I need to include gslcblas otherwise I get import errors!!!
 ext = Extension("gfft.gridding", ["gridding.pyx"], include_dirs=\
     [numpy.get_include(),include_gsl_dir], library_dirs=[lib_gsl_dir],\
-    libraries=["gsl", "gslcblas"])
+    libraries=["gsl", "gslcblas"], extra_compile_args=["-fopenmp"], \
+    extra_link_args=["-fopenmp"])
 
 setup(name="gfft",
       version="1.0",